@@ -1,8 +1,8 @@
 from vola.models import Company, Stock, SNP500, Portfolio, Past_Portfolio, Past_Statistics, Plot
 import numpy as np
 from datetime import datetime, timedelta
-from collections import Counter
 from scraper import ystockquote
+from db import stockPanel, rollingCovariance, tradingCalendar
 
 '''This module provides common database access functions.'''
 
@@ -16,24 +16,82 @@ def get_stock_matrix(start, end, symbols, value):
 
   :returns: A numpy array of floats.
   '''
-  values = Stock.objects.filter(
-    company__symbol__in=symbols, date__gte=start, date__lte=end).values_list(value, flat=True).order_by('date', 'company__symbol')
-  num_symbols, num_entries = len(symbols), len(values)  
-  total_dates = int(num_entries / num_symbols)
-  if num_entries % num_symbols != 0: #Inconsistent dates
-      ds= get_dates_to_exclude(start, end, symbols, value)
-      print("Inconsistent")
-      if not ds: #Error
-        print("Error ", num_entries, num_symbols)
+  panel = stockPanel.get()
+  symbols = sorted(symbols) #columns ordered by symbol
+  cols = stockPanel.columns(panel, symbols)
+  if cols is None:
+    print("Error ", "no stocks for some of", symbols)
+    return None
+  rows = stockPanel.rows(panel, start, end)
+  available = ~np.isnan(panel['close_price'][rows][:, cols])
+  present = available.any(axis=1) #dates with at least one entry
+  dates = panel['dates'][rows][present]
+  available = available[present]
+  values = panel[value][rows][:, cols][present]
+  if not available.all(): #Inconsistent dates
+      alignment = align_dates(start, end, symbols)
+      if alignment is None or alignment['exclude'] is None: #Error
+        print("Error ", "inconsistent dates", alignment and alignment['missing'])
         return None
-      else:
-        #Stock.objects.filter(date__in=ds).delete() #remove inconsistent dates for future calculations
-        values = Stock.objects.filter(company__symbol__in=symbols, date__gte=start, date__lte=end).exclude(date__in=ds).values_list(value, flat=True).order_by('date', 'company__symbol')
-        num_entries = len(values)
-  total_dates = int(num_entries / num_symbols)
-  a = np.array(values, dtype=np.float32)
-  a.shape = (total_dates, num_symbols)
-  return a
+      keep = ~np.isin(dates, alignment['exclude'])
+      available, values = available[keep], values[keep]
+      if not available.all(): #Error
+        print("Error ", "inconsistent dates", alignment['missing'], alignment['extra'])
+        return None
+  return values
+
+def align_dates(start, end, symbols):
+  ''' Aligns the stocks of the given symbols with the trading calendar in one pass over the availability matrix.
+  Dates only some companies have stocks for are excluded, unless those companies are also missing dates, e.g. after a merger/aquisition.
+
+  :param start: A date object indicating the start of the period to be analysed.
+  :param end: A date object indicating the end of the period to be analysed.
+  :param symbols: A list of ticker symbols.
+
+  :returns: A dict containing the common dates (dates all companies have stocks for), missing dates and extra dates per symbol
+  (symbols without either omitted) and dates to exclude (None if the stocks cannot be aligned), or None if some symbols have no stocks.
+  Dates are numpy datetime64 arrays.
+  '''
+  calendar = tradingCalendar.get()
+  panel = calendar['panel']
+  symbols = sorted(symbols)
+  cols = stockPanel.columns(panel, symbols)
+  if cols is None:
+    return None
+  rows = stockPanel.rows(panel, start, end)
+  dates = panel['dates'][rows]
+  available = ~np.isnan(panel['close_price'][rows][:, cols])
+  trading = calendar['trading'][rows][:, np.newaxis]
+  missing, extra = trading & ~available, available & ~trading
+  has_missing, has_extra = missing.any(axis=0), extra.any(axis=0)
+  alignment = {
+    'dates': dates[available.all(axis=1)],
+    'missing': {symbols[i]: dates[missing[:, i]] for i in np.flatnonzero(has_missing)},
+    'extra': {symbols[i]: dates[extra[:, i]] for i in np.flatnonzero(has_extra)},
+    'exclude': dates[extra[:, ~has_missing].any(axis=1)]}
+  if np.any(has_missing & ~has_extra):
+    #company no longer available (normally merger/aquisiton - unlikely company collapses in year following its inclusion in SNP500)
+    #manually investigated here - database updated with new company figures for remainder of the year
+    #example: ACE -> CB around 15/01/2016
+    alignment['exclude'] = None
+  return alignment
+
+def get_covariance(start, end, symbols):
+  ''' Calculates the covariance matrix of daily changes for the given period and symbols from the rolling windows (see rollingCovariance).
+
+  :param start: A date object indicating the start of the period to be analysed.
+  :param end: A date object indicating the end of the period to be analysed.
+  :param symbols: A list of ticker symbols for the companies in the portfolio.
+
+  :returns: A pair containing the covariance matrix (symbols x symbols, ordered by symbol) and the number of trading days, or None if unavailable.
+  '''
+  result = rollingCovariance.covariance(start, end, symbols)
+  if result is None: #inconsistent dates are excluded by the change matrix
+    changes = get_stock_matrix(start, end, symbols, 'change')
+    if changes is None:
+      return None
+    result = np.atleast_2d(np.cov(changes, rowvar=False, bias=True)), len(changes)
+  return result
 
 def get_stock_matrixd(start, end, symbols, value):
   ''' Retreives stock matrix for the given period, symbols and value.
@@ -62,9 +120,7 @@ def SP500(start, end, value):
 
   :returns: A numpy array of floats.
   '''
-  s = '^GSPC'
-  values = Stock.objects.filter(company__symbol=s, date__gte=start, date__lte=end).values_list(value, flat=True).order_by('date')
-  return np.array(values, dtype=np.float32)
+  return stockPanel.series('^GSPC', start, end, value)
 
 def SP500TR(start, end, value):
   ''' Retreives S&P 500 total return stock matrix for the given period and value.
@@ -75,9 +131,7 @@ def SP500TR(start, end, value):
 
   :returns: A numpy array of floats.
   '''
-  s = '^SP500TR'
-  values = Stock.objects.filter(company__symbol=s, date__gte=start, date__lte=end).values_list(value, flat=True).order_by('date')
-  return np.array(values, dtype=np.float32)  
+  return stockPanel.series('^SP500TR', start, end, value)  
 
 def SP500LV(start, end, value):
   ''' Retreives S&P 500 LV stock matrix for the given period and value.
@@ -88,9 +142,7 @@ def SP500LV(start, end, value):
 
   :returns: A numpy array of floats.
   '''
-  s = 'SPLV'
-  values = Stock.objects.filter(company__symbol=s, date__gte=start, date__lte=end).values_list(value, flat=True).order_by('date')
-  return np.array(values, dtype=np.float32)
+  return stockPanel.series('SPLV', start, end, value)
 
 #Valid symbols methods need to ensure:
 # 1) Symbols were all available for the same number of trading days (no company just started etc.)
@@ -111,39 +163,47 @@ def get_valid_symbols(start, end, current=False, perf=False):
     snp = get_SNP500_companies(int(start.year)) #start of performance period, i.e. SNP500 symbols when investing
   else:
     snp = get_SNP500_companies(int(end.year)) #end of minimisation period, i.e. SNP500 symbols when investing
-  valid_dates = get_valid_dates(start, end)
-  syms = Stock.objects.filter(company__symbol__in=snp, date__gte=start, date__lte=end, date__in=valid_dates).values_list('company__symbol')
-  s = Counter(syms) #symbols
-  mc_s = s.most_common()
-  num_trading_days = mc_s[0][1]
-  return sorted([x[0][0] for x in mc_s if x[1]==num_trading_days])
+  return select_valid_symbols(start, end, snp)
+
+def get_valid_symbols_check(start, end):
+  ''' Retreives symbols that are definately valid for given period.
+
+  :param start: A date object indicating the start of the period to be analysed.
+  :param end: A date object indicating the end of the period to be analysed.
 
-def get_valid_symbols_check(start, end): #above method faster but not always consistent - double check required
-  ''' Retreives symbols that are definately valid for given period (consistent but not efficent).
+  :returns: A sorted list of valid ticker symbols.
+  '''
+  return select_valid_symbols(start, end, get_SNP500_companies(int(end.year))) #end of minimisation period, i.e. SNP500 symbols when investing
+
+def select_valid_symbols(start, end, snp):
+  ''' Selects the companies with consistent stocks for given period from the availability matrix (dates x companies).
+  Companies must have the most common number of trading days (the larger one if tied).
+  Companies trading on the least common dates of those are removed, e.g. dates only some companies have stocks for.
 
   :param start: A date object indicating the start of the period to be analysed.
   :param end: A date object indicating the end of the period to be analysed.
+  :param snp: A list of ticker symbols to select from.
 
   :returns: A sorted list of valid ticker symbols.
   '''
-  year  = int(end.year) #end of minimisation period, i.e. SNP500 symbols when investing
-  snp = SNP500.objects.filter(year=year).values_list('companies__symbol',flat=True) #SNP stocks for that year
-  syms_n_dates = Stock.objects.filter(company__symbol__in=snp, date__gte=start, date__lte=end).values_list('company__symbol', 'date')
-  s = Counter([x[0] for x in syms_n_dates]) #symbols
-  mc_s = s.most_common()
-  cm = Counter([x[1] for x in mc_s])
-  mode = cm.most_common(1)[0][0] #find most common number of trading days, i.e. mode
-  filtered_syms = [x[0]  for x in mc_s if x[1] == mode]
-  filtered_syms_n_dates = [x for x in syms_n_dates if x[0] in filtered_syms]
-  d = Counter([x[1] for x in filtered_syms_n_dates]) #dates
-  mc_d = d.most_common() # find mode number of most common dates
-  mc_d_least = mc_d[-1][1]
-  mc_d_most = mc_d[0][1]
-  if mc_d_most == mc_d_least: #if consistent dates already, return symbols
-    return sorted(filtered_syms)
-  dates_to_remove = [x[0] for x in mc_d if x[1] == mc_d_least]
-  syms_to_remove = list(set([x[0] for x in filtered_syms_n_dates if x[1] in dates_to_remove]))
-  return sorted([x for x in filtered_syms if x not in syms_to_remove])
+  panel = stockPanel.get()
+  symbols = sorted(set(s for s in snp if s in panel['index']))
+  if not symbols:
+    return []
+  cols = stockPanel.columns(panel, symbols)
+  available = ~np.isnan(panel['close_price'][stockPanel.rows(panel, start, end)][:, cols])
+  trading_days = available.sum(axis=0)
+  listed = trading_days > 0
+  if not listed.any():
+    return []
+  counts, frequency = np.unique(trading_days[listed], return_counts=True)
+  mode = np.max(counts[frequency == np.max(frequency)]) #most common number of trading days
+  valid = trading_days == mode
+  companies = available[:, valid].sum(axis=1) #per date
+  least = np.min(companies[companies > 0])
+  if least != np.max(companies): #inconsistent dates
+    valid &= ~available[companies == least].any(axis=0)
+  return [symbols[i] for i in np.flatnonzero(valid)]
 
 def get_lowest_100_vol(symbols, end):
   ''' Calculates the 100 symbols with lowest volatility over the past year.
@@ -152,24 +212,40 @@ def get_lowest_100_vol(symbols, end):
   :param end: A date object indicating the end of the period to be analysed.
   :param current(optional): Use current S&P 500 list rather than historical.
 
-  :returns: A sorted list of 100 low volatility ticker symbols.
+  :returns: A sorted list of 100 low volatility ticker symbols, only those with consistent stocks over the past year if some are unavailable.
   '''
+  start = end - timedelta(days=365)
   symbols = sorted(symbols) # ensure sorted for zip
-  changes = get_stock_matrix(end - timedelta(days=365), end, symbols, 'change')
-  s = np.std(changes, axis=0)
+  result = get_covariance(start, end, symbols)
+  if result is None: #e.g. listed within the past year
+    symbols = select_valid_symbols(start, end, symbols)
+    result = get_covariance(start, end, symbols) if symbols else None
+    if result is None:
+      print("Error ", "no covariance for some of", symbols)
+      return []
+  cov, trading_days = result
+  s = np.sqrt(np.diag(cov))
   z = list(zip(symbols, s))
   z_sorted = sorted(z, key=lambda tup: tup[1])
   return [tup[0] for tup in z_sorted[:100]]
 
-def get_valid_dates(start, end, sym='KO'):
+def get_valid_dates(start, end, sym=None):
   ''' Retreives valid dates for given period.
 
   :param start: A date object indicating the start of the period to be analysed.
   :param end: A date object indicating the end of the period to be analysed.
+  :param sym(optional): A ticker symbol to retrieve the dates of. Defaults to the trading calendar (see tradingCalendar).
 
   :returns: A list of date objects.
   '''
-  return Stock.objects.filter(company__symbol=sym, date__gte=start, date__lte=end).values_list('date', flat=True).order_by('date')
+  if sym is None:
+    return list(tradingCalendar.dates(start, end).astype(object))
+  panel = stockPanel.get()
+  col = panel['index'].get(sym)
+  if col is None:
+    return []
+  rows = stockPanel.rows(panel, start, end)
+  return list(panel['dates'][rows][~np.isnan(panel['close_price'][rows, col])].astype(object))
 
 def get_SNP500_companies(year):
   ''' Retreives companies included in the S&P 500 list for a given year.
@@ -240,13 +316,17 @@ def get_symbols_performance(start, end, lv, perf_test=False, current=False):
     symbols = get_lowest_100_vol(symbols, end)
   return symbols
 
-def get_investments():
+def get_investments(grid=None):
   ''' Retreives stored investments.
 
+  :param grid(optional): A list of investments to keep, e.g. portfolioCalculator.INVESTMENTS without the requested ones stored until they expire.
+
   :returns: A sorted list of investments.
   '''
   p = Portfolio.objects.filter(title='Custom').first()
   plots = Plot.objects.filter(portfolio=p)
+  if grid is not None:
+    plots = plots.filter(investment__in=grid)
   return sorted([pl.investment for pl in plots])
 
 def get_periods():
@@ -265,6 +345,17 @@ def get_spreads():
   ps = Portfolio.objects.filter(title='Custom', period=1, lv=True)
   return sorted([p.spread for p in ps])
 
+def get_custom_portfolio(spread, period, lv):
+  ''' Retreives a stored custom portfolio.
+
+  :param spread: A positive integer.
+  :param period: A positive integer.
+  :param lv: A boolean.
+
+  :returns: A Portfolio object or None if the spread is not stored (calculated live, no past performance).
+  '''
+  return Portfolio.objects.filter(title='Custom', spread=spread, period=period, lv=lv).first()
+
 def get_suggested_portfolio_performance():
   ''' Retreives plot and statistics for suggested portfolio.
 
@@ -282,6 +373,16 @@ def get_performance_data(p, investment):
   plot = saved_plot.first()
   fig = plot.html
   ps = list(Past_Statistics.objects.filter(plot=plot, past_portfolio__in=pp).order_by('past_portfolio__start_date'))
+  return fig, zip_performance_stats(pp, ps)
+
+def zip_performance_stats(pp, ps):
+  ''' Zips the annual statistics of past portfolios for display.
+
+  :param pp: A list of past portfolios ordered by start date.
+  :param ps: A list of their Past_Statistics objects, ordered as pp.
+
+  :returns: A list of 4-tuples containing the end date, volatilities, returns (portfolio, S&P 500, S&P 500 LV) and sharpe ratio of each year.
+  '''
   p_vols = [p.vol for p in ps]
   b_vols = [p.snp_vol for p in ps]
   blv_vols = [p.snp_lv_vol for p in ps]
@@ -292,8 +393,7 @@ def get_performance_data(p, investment):
   vols = list(zip(p_vols, b_vols, blv_vols))
   returns = list(zip(p_rets, b_rets, blv_rets))
   dates = [str(pp.start_date + timedelta(days=365)) for pp in pp] #already sorted by date
-  stats = list(zip(dates, vols, returns, sharpes))
-  return fig, stats
+  return list(zip(dates, vols, returns, sharpes))
 
 def get_most_recent_date(symbol):
     try:
@@ -301,23 +401,3 @@ def get_most_recent_date(symbol):
     except Stock.DoesNotExist:
         return None #'1988101' #when new symbols added
     return stk.date
-
-def get_dates_to_exclude(start, end, symbols, value):
-  dates_to_exclude = []
-  valid_syms = get_valid_symbols_check(start,end)
-  problem_syms = [x for x in symbols if x not in valid_syms]
-  valid_dates = get_valid_dates(start, end)
-  for s in problem_syms:
-    prob_dates = Stock.objects.filter(company__symbol=s, date__gte=start, date__lte=end).values_list('date', flat=True)
-    if not [x for x in valid_dates if x not in prob_dates]:
-      exclude = [x for x in prob_dates if x not in valid_dates]
-      dates_to_exclude += exclude
-    elif not [x for x in prob_dates if x not in valid_dates]:
-      #company no longer available (normally merger/aquisiton - unlikely company collapses in year following its inclusion in SNP500)
-      #manually investigated here - database updated with new company figures for remainder of the year (avoid repeating workaround with each query)
-      #example: ACE -> CB around 15/01/2016
-      print("Data no longer available for " + s + " - merger? aquisiton?")
-      return None
-    else:
-      print("{0} is missing dates:{1}\n{0} has extra dates:{2}".format(s,[x for x in valid_dates if x not in prob_dates], [x for x in prob_dates if x not in valid_dates]))
-  return list(set(dates_to_exclude))
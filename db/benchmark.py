@@ -0,0 +1,590 @@
+from vola.models import Company, Stock, Portfolio, Past_Portfolio, Plot, SNP500, compress_html
+from datetime import datetime, timedelta
+from db import access as dba, stockPanel, stockHistory, rollingCovariance, maintenance_multiprocessing as maintenance
+from vola import minimizer, portfolioCalculator, portfolioAnalyzer
+from django.db import connection
+from django.conf import settings
+import numpy as np
+import multiprocessing as mp
+from collections import Counter
+from decimal import Decimal
+import resource, time, os, sqlite3, tempfile, json
+import django
+
+'''
+This module provides benchmarks for the performance-critical database and calculation paths.
+
+->Each benchmark prints its results and returns them for further analysis.
+->Run manually against a populated database, e.g. python db/benchmark.py
+'''
+
+def benchmark_stock_panel(period=4, end=None):
+  ''' Compares the time to first query and memory of a fresh worker for the ORM query, the panel built from the ORM and the memory-mapped snapshot.
+
+  :param period(optional): A positive integer indicating the number of years queried.
+  :param end(optional): A date object indicating the end of the period queried. Defaults to the most recent date.
+
+  :returns: A dict mapping each path to a pair containing the seconds to first query and the increase in peak RSS (KB).
+  '''
+  end = end or dba.get_most_recent_date('KO')
+  start = end - timedelta(days=365*period)
+  symbols = dba.get_valid_symbols(start, end)
+  if stockPanel.snapshot_version() is None:
+    stockPanel.write_snapshot()
+  results = {}
+  for path in ['orm', 'panel', 'snapshot']:
+    queue = mp.Queue()
+    worker = mp.Process(target=first_query, args=[path, start, end, symbols, queue])
+    worker.start()
+    results[path] = queue.get()
+    worker.join()
+    print("{0}: {1:.3f} seconds, {2} KB".format(path, *results[path]))
+  return results
+
+def first_query(path, start, end, symbols, queue):
+  connection.close() #fresh worker
+  stockPanel.invalidate()
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  start_time = time.time()
+  if path == 'orm':
+    values = Stock.objects.filter(
+      company__symbol__in=symbols, date__gte=start, date__lte=end).values_list('change', flat=True).order_by('date', 'company__symbol')
+    np.array(values, dtype=np.float32)
+  else:
+    stockPanel.reload(snapshot=(path == 'snapshot'))
+    dba.get_stock_matrix(start, end, symbols, 'change')
+  queue.put((time.time() - start_time, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss))
+
+def benchmark_minimizer(periods=[1, 2, 4, 8, 12], spread=50, end=None):
+  ''' Compares the standard deviation objective (finite-differenced) with the covariance objective (exact gradient) for each minimisation period.
+
+  :param periods(optional): A list of positive integers indicating the minimisation periods (years).
+  :param spread(optional): A positive integer indicating the minimum spread.
+  :param end(optional): A date object indicating the end of the minimisation periods. Defaults to the most recent date.
+
+  :returns: A list of 5-tuples containing the period, seconds for each method, maximum allocation difference and volatility difference.
+  '''
+  end = end or dba.get_most_recent_date('KO')
+  results = []
+  for period in periods:
+    start = end - timedelta(days=365*period)
+    symbols = dba.get_symbols_performance(start, end, False)
+    changes = dba.get_stock_matrix(start, end, symbols, 'change')
+    allocations, seconds = {}, {}
+    for method in ['std', 'cov']:
+      start_time = time.time()
+      allocations[method] = minimizer.minimize(minimizer.vol, changes, None, spread, method)
+      seconds[method] = time.time() - start_time
+    diff = np.max(np.abs(allocations['std'] - allocations['cov']))
+    vol_diff = minimizer.vol(allocations['cov'], changes) - minimizer.vol(allocations['std'], changes)
+    results.append((period, seconds['std'], seconds['cov'], diff, vol_diff))
+    print("{0} years, {1} symbols: std {2:.3f}s, cov {3:.3f}s, max allocation difference {4:.2e}, volatility difference {5:.2e}".format(
+      period, len(symbols), seconds['std'], seconds['cov'], diff, vol_diff))
+  return results
+
+def benchmark_qp(periods=[1, 4, 12], spreads=[10, 25, 33, 50, 100], end=None):
+  ''' Times the dedicated active-set solver against SLSQP on the covariance objective, e.g. to check live custom spreads stay below 100ms.
+
+  :param periods(optional): A list of positive integers indicating the minimisation periods (years).
+  :param spreads(optional): A list of positive integers indicating the minimum spreads.
+  :param end(optional): A date object indicating the end of the minimisation periods. Defaults to the most recent date.
+
+  :returns: A list of 6-tuples containing the period, spread, seconds for each solver, iterations and KKT residual of the active-set solver.
+  '''
+  end = end or dba.get_most_recent_date('KO')
+  results = []
+  for period in periods:
+    start = end - timedelta(days=365*period)
+    symbols = dba.get_symbols_performance(start, end, False)
+    cov = minimizer.covariance(dba.get_stock_matrix(start, end, symbols, 'change'))
+    for spread in spreads:
+      start_time = time.time()
+      minimizer.minimize_cov(cov, spread)
+      cov_seconds = time.time() - start_time
+      start_time = time.time()
+      allocations, iterations = minimizer.minimize_qp(cov, spread)
+      qp_seconds = time.time() - start_time
+      residual = minimizer.kkt_residual(cov, allocations, 1./spread)
+      results.append((period, spread, cov_seconds, qp_seconds, iterations, residual))
+      print("{0} years, {1} symbols, spread {2}: slsqp {3:.3f}s, active-set {4:.3f}s ({5} iterations, KKT residual {6:.1e})".format(
+        period, len(symbols), spread, cov_seconds, qp_seconds, iterations, residual))
+  return results
+
+def benchmark_warm_start(period=4, lv=False, start_year=2012, end=None):
+  ''' Compares calculating the chain of past portfolios cold (each year from scratch) with warm-starting each year from the previous year's allocations.
+
+  :param period(optional): A positive integer indicating the minimisation period of the portfolios (years).
+  :param lv(optional): A boolean indicating the portfolios' stock universe (True for the SP500 low volatility index).
+  :param start_year(optional): A positive integer indicating the year in which the first past portfolio starts.
+  :param end(optional): A date object indicating the date on which the portfolios are calculated. Defaults to today.
+
+  :returns: A dict mapping 'cold' and 'warm' to pairs containing the seconds and total solver iterations.
+  '''
+  end = end or datetime.today().date()
+  ps = list(Portfolio.objects.filter(period=period, lv=lv).order_by('spread'))
+  results = {}
+  for path in ['cold', 'warm']:
+    info = {}
+    start_time = time.time()
+    portfolioCalculator.create_past_portfolios_group(ps, start_year, end, info=info, warm_start=(path == 'warm'))
+    results[path] = (time.time() - start_time, sum(sum(i) for i in info.values()))
+    print("{0}: {1:.3f} seconds, {2} iterations ({3})".format(path, results[path][0], results[path][1], portfolioCalculator.iteration_summary(info)))
+  return results
+
+def benchmark_rolling_covariance(period=12, years=5, end=None):
+  ''' Compares computing the covariance of each yearly window of a past portfolio chain from the change matrix with moving the rolling window.
+
+  :param period(optional): A positive integer indicating the window length (years).
+  :param years(optional): A positive integer indicating the number of consecutive yearly windows.
+  :param end(optional): A date object indicating the end of the last window. Defaults to the most recent date.
+
+  :returns: A list of 5-tuples containing the window end, seconds for each path, the maximum covariance difference
+  and the bytes held by the rolling windows (compared with a single window over every company of the panel).
+  '''
+  end = end or dba.get_most_recent_date('KO')
+  panel_bytes = 8 * len(stockPanel.get()['symbols']) ** 2
+  results = []
+  for year in range(years - 1, -1, -1):
+    window_end = end - timedelta(days=365*year)
+    start = window_end - timedelta(days=365*period)
+    symbols = dba.get_symbols_performance(start, window_end, False)
+    start_time = time.time()
+    cov = minimizer.covariance(dba.get_stock_matrix(start, window_end, symbols, 'change'))
+    matrix_seconds = time.time() - start_time
+    start_time = time.time()
+    rolling_cov, trading_days = dba.get_covariance(start, window_end, symbols)
+    rolling_seconds = time.time() - start_time
+    diff = np.max(np.abs(cov - rolling_cov))
+    window_bytes = rollingCovariance.memory()
+    results.append((window_end, matrix_seconds, rolling_seconds, diff, window_bytes))
+    print("{0}, {1} symbols: change matrix {2:.3f}s, rolling {3:.3f}s, max difference {4:.2e}, windows {5} KB (panel-wide window {6} KB)".format(
+      window_end, len(symbols), matrix_seconds, rolling_seconds, diff, window_bytes // 1024, panel_bytes // 1024))
+  return results
+
+def verify_valid_symbols(periods=[1, 2, 4, 8, 12], start_year=2001, end=None):
+  ''' Compares the vectorized universe selection with the original Counter implementation for each past portfolio period.
+
+  :param periods(optional): A list of positive integers indicating the minimisation periods (years).
+  :param start_year(optional): A positive integer indicating the first year in which a period ends.
+  :param end(optional): A date object indicating the end of the last period. Defaults to the most recent date.
+
+  :returns: A list of 4-tuples containing the period end, period and symbols only selected by the Counter or vectorized implementation.
+  '''
+  end = end or dba.get_most_recent_date('KO')
+  mismatches = []
+  seconds = {'counter': 0., 'vectorized': 0.}
+  for year in range(start_year, end.year + 1):
+    period_end = end.replace(year=year)
+    for period in periods:
+      start = period_end - timedelta(days=365*period)
+      start_time = time.time()
+      expected = set(valid_symbols_counter(start, period_end))
+      seconds['counter'] += time.time() - start_time
+      start_time = time.time()
+      selected = set(dba.get_valid_symbols_check(start, period_end))
+      seconds['vectorized'] += time.time() - start_time
+      if selected != expected:
+        mismatches.append((period_end, period, sorted(expected - selected), sorted(selected - expected)))
+        print("{0}, {1} years: counter only {2}, vectorized only {3}".format(*mismatches[-1]))
+  print("counter {0:.3f}s, vectorized {1:.3f}s, {2} mismatches".format(seconds['counter'], seconds['vectorized'], len(mismatches)))
+  return mismatches
+
+def valid_symbols_counter(start, end):
+  year  = int(end.year) #original access.get_valid_symbols_check
+  snp = SNP500.objects.filter(year=year).values_list('companies__symbol',flat=True)
+  syms_n_dates = Stock.objects.filter(company__symbol__in=snp, date__gte=start, date__lte=end).values_list('company__symbol', 'date')
+  s = Counter([x[0] for x in syms_n_dates]) #symbols
+  mc_s = s.most_common()
+  cm = Counter([x[1] for x in mc_s])
+  mode = cm.most_common(1)[0][0] #find most common number of trading days, i.e. mode
+  filtered_syms = [x[0]  for x in mc_s if x[1] == mode]
+  filtered_syms_n_dates = [x for x in syms_n_dates if x[0] in filtered_syms]
+  d = Counter([x[1] for x in filtered_syms_n_dates]) #dates
+  mc_d = d.most_common()
+  mc_d_least = mc_d[-1][1]
+  mc_d_most = mc_d[0][1]
+  if mc_d_most == mc_d_least:
+    return sorted(filtered_syms)
+  dates_to_remove = [x[0] for x in mc_d if x[1] == mc_d_least]
+  syms_to_remove = list(set([x[0] for x in filtered_syms_n_dates if x[1] in dates_to_remove]))
+  return sorted([x for x in filtered_syms if x not in syms_to_remove])
+
+def benchmark_backtest(investment=100000):
+  ''' Compares simulating each past portfolio of the suggested portfolio separately with the single-pass backtest.
+
+  :param investment(optional): A positive integer.
+
+  :returns: A triple containing the seconds for each path and whether the daily values are equal.
+  '''
+  portfolio = Portfolio.objects.filter(suggested=True).first() or Portfolio.objects.first()
+  past_portfolios = list(Past_Portfolio.objects.filter(portfolio=portfolio).order_by('start_date'))
+  stockPanel.get()
+  start_time = time.time()
+  values = [[investment] for _ in range(3)]
+  for pp in past_portfolios:
+    stats, daily_values, daily_changes, ds = portfolioAnalyzer.simulate(pp.start_date, pp.start_date + timedelta(days=365), pp.symbols, pp.allocations, values[0][-1], values[1][-1], values[2][-1])
+    for v, daily in zip(values, daily_values):
+      v += list(daily)
+  simulate_seconds = time.time() - start_time
+  start_time = time.time()
+  annual_stats, daily_values, dates = portfolioAnalyzer.backtest(past_portfolios, investment)
+  backtest_seconds = time.time() - start_time
+  equal = all(np.allclose(v, daily) for v, daily in zip(values, daily_values))
+  print("{0} past portfolios: simulate {1:.3f}s, backtest {2:.3f}s, equal daily values: {3}".format(len(past_portfolios), simulate_seconds, backtest_seconds, equal))
+  return simulate_seconds, backtest_seconds, equal
+
+def benchmark_investments(investments=[10000, 25000, 50000, 100000, 250000, 1000000]):
+  ''' Compares backtesting the suggested portfolio separately for each stored investment with backtesting all investments at once.
+
+  :param investments(optional): A list of positive integers.
+
+  :returns: A pair containing the seconds for each path.
+  '''
+  portfolio = Portfolio.objects.filter(suggested=True).first() or Portfolio.objects.first()
+  past_portfolios = list(Past_Portfolio.objects.filter(portfolio=portfolio).order_by('start_date'))
+  stockPanel.get()
+  start_time = time.time()
+  for investment in investments:
+    portfolioAnalyzer.backtest(past_portfolios, investment)
+  separate_seconds = time.time() - start_time
+  start_time = time.time()
+  portfolioAnalyzer.backtest_investments(past_portfolios, investments)
+  batch_seconds = time.time() - start_time
+  print("{0} investments: separately {1:.3f}s, at once {2:.3f}s".format(len(investments), separate_seconds, batch_seconds))
+  return separate_seconds, batch_seconds
+
+def benchmark_storage():
+  ''' Compares the time and memory of a fresh worker bulk reading the full stock history (i.e. building the stock panel)
+  from the Stock rows and from the stock histories. Histories are rebuilt first if there are none.
+
+  :returns: A dict mapping each storage to a pair containing the seconds to build the panel and the increase in peak RSS (KB).
+  '''
+  if not stockHistory.Stock_History.objects.exists():
+    stockHistory.rebuild()
+  results = {}
+  for storage in ['rows', 'history']:
+    queue = mp.Queue()
+    worker = mp.Process(target=bulk_read, args=[storage, queue])
+    worker.start()
+    results[storage] = queue.get()
+    worker.join()
+    print("{0}: {1:.3f} seconds, {2} KB".format(storage, *results[storage]))
+  return results
+
+def bulk_read(storage, queue):
+  connection.close() #fresh worker
+  settings.STOCK_STORAGE = storage
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  start_time = time.time()
+  stockPanel.build()
+  queue.put((time.time() - start_time, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss))
+
+def stock_queries(start, end, symbols):
+  ''' Builds the hot Stock queries, i.e. the ORM access patterns of get_stock_matrix, get_valid_symbols, get_valid_dates and get_most_recent_date.
+
+  :param start: A date object indicating the start of the period queried.
+  :param end: A date object indicating the end of the period queried.
+  :param symbols: A list of ticker symbols.
+
+  :returns: A dict mapping each access pattern to a queryset.
+  '''
+  period = Stock.objects.filter(date__gte=start, date__lte=end)
+  return {
+    'stock_matrix': period.filter(company__symbol__in=symbols).values_list('change', flat=True).order_by('date', 'company__symbol'),
+    'valid_symbols': period.filter(company__symbol__in=symbols).values_list('company__symbol', 'date'),
+    'valid_dates': period.values_list('date', flat=True).distinct().order_by('date'),
+    'most_recent_date': Stock.objects.filter(company__symbol=symbols[0]).order_by('-date')[:1],
+  }
+
+def query_plan(queryset, db=None):
+  ''' Retreives the SQLite query plan of a queryset.
+
+  :param queryset: A queryset.
+  :param db(optional): A sqlite3 connection to explain the query on. Defaults to the Django connection.
+
+  :returns: A list of strings, one per plan step, e.g. 'SEARCH vola_stock USING COVERING INDEX ...'.
+  '''
+  sql, params = queryset.query.sql_with_params()
+  if db is None:
+    with connection.cursor() as cursor:
+      cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+      return [row[-1] for row in cursor.fetchall()]
+  return [row[-1] for row in db.execute('EXPLAIN QUERY PLAN ' + sql.replace('%s', '?'), params)]
+
+def check_query_plans(start, end, symbols, db=None):
+  ''' Checks that no hot Stock query scans the table or sorts its results.
+
+  :returns: A dict mapping each access pattern to a pair containing its plan and a boolean indicating whether or not it passed.
+  '''
+  results = {}
+  for name, queryset in stock_queries(start, end, symbols).items():
+    plan = query_plan(queryset, db)
+    passed = not any(step.startswith('SCAN') or 'TEMP B-TREE' in step for step in plan)
+    results[name] = plan, passed
+    print("{0}: {1} {2}".format(name, 'ok' if passed else 'FAIL', plan))
+  return results
+
+INDEXES = [ #candidates, none in the schema: the hot paths read the stock panel or Stock_History (see benchmark_indexes)
+  ('none', None),
+  ('date', 'CREATE INDEX "vola_stock_date" ON "vola_stock" ("date")'),
+  ('date_company', 'CREATE INDEX "vola_stock_date_company" ON "vola_stock" ("date", "company_id")'),
+  ('covering', 'CREATE INDEX "vola_stock_covering" ON "vola_stock" ("date", "company_id", "close_price", "change")'),
+]
+
+def benchmark_indexes(num_symbols=500, years=30, period=4, path=None, indexes=INDEXES):
+  ''' Compares the query plans and times of the Stock queries, the time to insert a day of stocks and the database size
+  on a synthetic Stock table (num_symbols companies x years of weekdays) with each candidate index in turn.
+  The table is created with the model's own DDL in a separate SQLite database.
+  Most reads are served by the stock panel or Stock_History, so an index only pays off if it speeds up the remaining queries
+  more than it costs in size and inserts.
+
+  :param num_symbols(optional): A positive integer indicating the number of companies.
+  :param years(optional): A positive integer indicating the number of years of stocks.
+  :param period(optional): A positive integer indicating the number of years queried (ending on the last date).
+  :param path(optional): A path for the synthetic database. Defaults to a temporary file.
+  :param indexes(optional): A list of pairs containing a label and a CREATE INDEX statement on vola_stock (None for the schema only).
+
+  :returns: A dict mapping each access pattern to a list (ordered as indexes) of pairs containing its plan and seconds,
+  and 'insert' to a list of pairs containing the database size (bytes) and the seconds to insert a day of stocks.
+  '''
+  with connection.schema_editor(collect_sql=True) as editor:
+    editor.create_model(Company)
+    editor.create_model(Stock)
+  db = sqlite3.connect(path or os.path.join(tempfile.mkdtemp(), 'stocks.sqlite3'))
+  for sql in editor.collected_sql:
+    db.execute(sql)
+  end = np.datetime64('today', 'D')
+  dates = np.arange(end - 365 * years, end + 1)
+  dates = [str(d) for d in dates[np.is_busday(dates)]]
+  symbols = ['S' + str(i) for i in range(num_symbols)]
+  rng = np.random.RandomState(0)
+  for symbol in symbols:
+    changes = rng.randn(len(dates))
+    db.execute('INSERT INTO vola_company (symbol, name, sector, sub_industry, hq_address) VALUES (?, ?, ?, ?, ?)', [symbol] * 5)
+    db.executemany('INSERT INTO vola_stock (company_id, date, close_price, change) VALUES (?, ?, ?, ?)',
+      ((symbol, d, round(100 + c, 2), round(c, 12)) for d, c in zip(dates, changes)))
+  db.commit()
+  end = datetime.strptime(dates[-1], '%Y-%m-%d').date()
+  queries = stock_queries(end - timedelta(days=365*period), end, symbols[:int(num_symbols * 0.9)])
+  next_day = str(end + timedelta(days=1))
+  results = {}
+  for label, index in indexes:
+    if index is not None:
+      db.execute(index)
+    db.execute('ANALYZE')
+    db.commit()
+    db.execute('VACUUM')
+    size = db.execute('PRAGMA page_count').fetchone()[0] * db.execute('PRAGMA page_size').fetchone()[0]
+    start_time = time.time()
+    db.executemany('INSERT INTO vola_stock (company_id, date, close_price, change) VALUES (?, ?, ?, ?)',
+      ((symbol, next_day, 100., 0.) for symbol in symbols))
+    db.commit()
+    seconds = time.time() - start_time
+    db.execute('DELETE FROM vola_stock WHERE date = ?', [next_day])
+    db.commit()
+    results.setdefault('insert', []).append((size, seconds))
+    print("insert ({0} index): {1:.3f} seconds, {2} bytes".format(label, seconds, size))
+    for name, queryset in queries.items():
+      sql, params = queryset.query.sql_with_params()
+      start_time = time.time()
+      db.execute(sql.replace('%s', '?'), params).fetchall()
+      seconds = time.time() - start_time
+      plan = query_plan(queryset, db)
+      results.setdefault(name, []).append((plan, seconds))
+      print("{0} ({1} index): {2:.3f} seconds, {3}".format(name, label, seconds, plan))
+    if index is not None:
+      db.execute('DROP INDEX ' + index.split('"')[1])
+  db.close()
+  return results
+
+def benchmark_plot(years=5, investment=100000):
+  ''' Measures rendering the performance plot of a backtest as an mpld3 html figure, downsampled as stored (see settings.PLOT_POINTS) and at full resolution.
+
+  :param years(optional): A positive integer indicating the number of years backtested, i.e. the most recent past portfolios of the suggested portfolio.
+  :param investment(optional): A positive integer.
+
+  :returns: A dict mapping 'stored' and 'full' to pairs containing the seconds to render and the payload size (bytes).
+  '''
+  portfolio = Portfolio.objects.filter(suggested=True).first() or Portfolio.objects.first()
+  past_portfolios = list(Past_Portfolio.objects.filter(portfolio=portfolio).order_by('start_date'))[-years:]
+  annual_stats, daily_values, dates = portfolioAnalyzer.backtest(past_portfolios, investment)
+  results = {}
+  for resolution, points in [('stored', None), ('full', 0)]:
+    start_time = time.time()
+    fig = portfolioCalculator.plot_graphs(daily_values[0], daily_values[1], daily_values[2], dates, points=points)
+    results[resolution] = time.time() - start_time, len(fig.encode('utf-8'))
+    print("{0} ({1} days): {2:.3f} seconds, {3} bytes".format(resolution, len(dates), *results[resolution]))
+  return results
+
+def benchmark_past_portfolios():
+  ''' Compares decoding the allocations and symbols of all past portfolios from their binary fields with decoding the equivalent JSON.
+
+  :returns: A triple containing the seconds to load the rows, decode the binary fields and decode the JSON.
+  '''
+  start_time = time.time()
+  past_portfolios = list(Past_Portfolio.objects.all())
+  load_seconds = time.time() - start_time
+  start_time = time.time()
+  decoded = [(pp.allocations, pp.symbols) for pp in past_portfolios]
+  binary_seconds = time.time() - start_time
+  encoded = [(json.dumps(a.tolist()), json.dumps(s)) for a, s in decoded]
+  start_time = time.time()
+  for a, s in encoded:
+    np.array(json.loads(a))
+    json.loads(s)
+  json_seconds = time.time() - start_time
+  print("{0} past portfolios: load {1:.3f}s, decode binary {2:.3f}s, decode json {3:.3f}s".format(len(past_portfolios), load_seconds, binary_seconds, json_seconds))
+  return load_seconds, binary_seconds, json_seconds
+
+def benchmark_plot_storage(path=None):
+  ''' Compares writing all stored plots uncompressed (text) and compressed (see Plot.set_html) to a separate SQLite database.
+
+  :param path(optional): A path for the database. Defaults to a temporary file.
+
+  :returns: A dict mapping each storage to a pair containing the bytes stored and the seconds to write them (including compression).
+  '''
+  htmls = [plot.html for plot in Plot.objects.all() if plot.html is not None]
+  db = sqlite3.connect(path or os.path.join(tempfile.mkdtemp(), 'plots.sqlite3'))
+  results = {}
+  for storage, column, encode in [('raw', 'text', lambda html: html), ('compressed', 'blob', compress_html)]:
+    db.execute('CREATE TABLE {0} (id integer PRIMARY KEY, html {1})'.format(storage, column))
+    db.executemany('INSERT INTO {0} (id) VALUES (?)'.format(storage), [(i,) for i in range(len(htmls))])
+    db.commit()
+    start_time = time.time()
+    values = [encode(html) for html in htmls]
+    db.executemany('UPDATE {0} SET html = ? WHERE id = ?'.format(storage), [(v, i) for i, v in enumerate(values)])
+    db.commit()
+    results[storage] = sum(len(v if storage == 'compressed' else v.encode('utf-8')) for v in values), time.time() - start_time
+    print("{0}: {1} plots, {2} KB, written in {3:.3f} seconds".format(storage, len(htmls), results[storage][0] // 1024, results[storage][1]))
+  db.close()
+  return results
+
+def benchmark_pool_results(num_symbols=500, days=250, processes=8):
+  ''' Compares the previous maintenance pools, i.e. workers storing stock objects in Manager list proxies collected by the parent,
+  with streaming compact stock values (see maintenance_multiprocessing.stream_pool). Each path runs in a fresh process,
+  database writes are excluded.
+
+  :param num_symbols(optional): A positive integer indicating the number of companies updated.
+  :param days(optional): A positive integer indicating the number of stocks per company.
+  :param processes(optional): A positive integer indicating the number of pool workers.
+
+  :returns: A dict mapping each path to a triple containing the seconds taken, the increase in peak RSS of the parent (KB)
+  and the peak RSS of its largest child (KB), e.g. the Manager server.
+  '''
+  return compare_pool_paths(pool_results, num_symbols, days, processes)
+
+def compare_pool_paths(target, *args):
+  ''' Runs target(path, *args, queue) for the Manager and the streamed path, each in a fresh process, and prints the triples put on queue. '''
+  results = {}
+  for path in ['manager', 'streamed']:
+    queue = mp.Queue()
+    worker = mp.Process(target=target, args=[path] + list(args) + [queue])
+    worker.start()
+    results[path] = queue.get()
+    worker.join()
+    print("{0}: {1:.3f} seconds, parent {2} KB, largest child {3} KB".format(path, *results[path]))
+  return results
+
+def pool_results(path, num_symbols, days, processes, queue):
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  start_time = time.time()
+  symbols = ['S' + str(i) for i in range(num_symbols)]
+  if path == 'manager':
+    manager = mp.Manager()
+    stocks = manager.list([None]*num_symbols)
+    pool = mp.Pool(processes=processes)
+    for i, symbol in enumerate(symbols):
+      pool.apply_async(manager_stocks, args=[i, symbol, days, stocks])
+    pool.close()
+    pool.join()
+    bulklist = [item for sublist in stocks for item in sublist] #collapse list
+    manager.shutdown() #joins the server, RUSAGE_CHILDREN only covers children already waited for
+  else:
+    bulklist = []
+    for symbol, values in maintenance.stream_pool(symbols, streamed_stocks, processes, days=days):
+      bulklist.extend(Stock(company_id=symbol, close_price=close_price, change=change, date=date) for date, close_price, change in values)
+      bulklist = written(bulklist)
+  queue.put(pool_usage(start_time, rss))
+
+def pool_usage(start_time, rss):
+  ''' :returns: A triple containing the seconds since start_time, the increase in peak RSS of this process since rss (KB)
+  and the peak RSS of its largest child waited for (KB). '''
+  return (time.time() - start_time, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss,
+    resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+def written(objects):
+  ''' Drops objects once a chunk is complete, i.e. as if written (see maintenance_multiprocessing.write_chunk). '''
+  return [] if len(objects) >= maintenance.WRITE_CHUNK else objects
+
+def streamed_stocks(symbol, days):
+  start = datetime(2000, 1, 1).date()
+  return symbol, [(start + timedelta(days=d), Decimal('100.25') + d, Decimal('0.25')) for d in range(days)]
+
+def manager_stocks(i, symbol, days, stocks):
+  stocks[i] = [Stock(company_id=symbol, close_price=close_price, change=change, date=date) for date, close_price, change in streamed_stocks(symbol, days)[1]]
+
+def benchmark_portfolio_calculations(num_groups=None, processes=None):
+  ''' Compares the results path of maintenance_multiprocessing.update_portfolio_calculations before (workers storing Portfolio
+  and Past_Portfolio objects in Manager lists, collected by the parent) and after streaming compact rows (see stream_pool),
+  calculating the stored portfolios without writing them.
+
+  :param num_groups(optional): A positive integer indicating the number of portfolio groups calculated. Defaults to all.
+  :param processes(optional): A positive integer indicating the number of pool workers. Defaults to the number of CPUs.
+
+  :returns: A dict mapping each path to a triple containing the seconds taken, the increase in peak RSS of the parent (KB)
+  and the peak RSS of its largest child (KB), e.g. the Manager server.
+  '''
+  groups = portfolioCalculator.group_portfolios(list(Portfolio.objects.all()))[:num_groups]
+  return compare_pool_paths(portfolio_results, groups, processes or mp.cpu_count())
+
+def portfolio_results(path, groups, processes, queue):
+  connection.close() #fresh worker
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  start_time = time.time()
+  stockPanel.get() #load once, forked workers share it
+  if path == 'manager':
+    manager = mp.Manager()
+    results, past_results = manager.list([None]*len(groups)), manager.list([None]*len(groups))
+    pool = mp.Pool(processes=processes)
+    for i, ps in enumerate(groups):
+      pool.apply_async(manager_portfolios, args=[i, ps, results, past_results])
+    pool.close()
+    pool.join()
+    portfolios = [item for sublist in results for item in sublist] #collapse list
+    past_portfolios = [item for sublist, info in past_results for item in sublist] #collapse list
+    manager.shutdown() #joins the server, RUSAGE_CHILDREN only covers children already waited for
+  else:
+    portfolios, past_portfolios = [], []
+    for rows, past_rows, info in maintenance.stream_pool(groups, maintenance.multi_processing_portfolios, processes):
+      portfolios = written(portfolios + maintenance.unpack_rows(Portfolio, maintenance.PORTFOLIO_FIELDS, rows))
+      past_portfolios = written(past_portfolios + maintenance.unpack_rows(Past_Portfolio, maintenance.PAST_PORTFOLIO_FIELDS, past_rows))
+  queue.put(pool_usage(start_time, rss))
+
+def manager_portfolios(i, ps, results, past_results):
+  connection.close()
+  today = datetime.today().date()
+  p = ps[0]
+  ps_updated = portfolioCalculator.update_or_create_portfolios([x.spread for x in ps], p.period, p.lv, today, p.title, ps=ps)
+  results[i] = ps_updated
+  info = {}
+  past_results[i] = (portfolioCalculator.update_past_portfolios_group(ps_updated, today, info=info), info)
+
+if __name__ == '__main__':
+    django.setup()
+    benchmark_stock_panel()
+    benchmark_minimizer()
+    benchmark_qp()
+    benchmark_warm_start()
+    benchmark_rolling_covariance()
+    verify_valid_symbols()
+    benchmark_backtest()
+    benchmark_investments()
+    benchmark_storage()
+    end = dba.get_most_recent_date('KO')
+    check_query_plans(end - timedelta(days=365*4), end, dba.get_valid_symbols(end - timedelta(days=365*4), end))
+    benchmark_indexes()
+    benchmark_plot()
+    benchmark_past_portfolios()
+    benchmark_plot_storage()
+    benchmark_pool_results()
+    benchmark_portfolio_calculations()
@@ -1,8 +1,8 @@
-from scraper import ystockquote, snp500
+from scraper import quoteFetcher, snp500
 from vola.models import Company, Stock, SNP500, Portfolio, Past_Portfolio, Past_Statistics
 from datetime import datetime, timedelta
 from db import access as dba, stockInserter
-from vola import portfolioCalculator
+from vola import portfolioCalculator, portfolioAnalyzer, resultCache
 from bulk_update.helper import bulk_update
 import time, os
 
@@ -18,7 +18,7 @@ def update_stocks(companies):
 
   :returns: A pair containing total stocks updated and companies updated.
   '''
-  bulklist = []
+  jobs = []
   not_updated = []
   yday = datetime.today().date() - timedelta(days=1)
   cut_off_date = datetime.today().date() - timedelta(days=60) #no data in the last 2 months
@@ -29,17 +29,22 @@ def update_stocks(companies):
       continue
     if (start_date == yday) or (start_date < cut_off_date): 
       continue #already up to date
-    yday = str(yday).replace("-","") #ystockquote date format
-    start_date = str(start_date).replace("-","")
-    hist_prices = ystockquote.get_historical_prices(c.symbol, start_date, yday)
-    if not hist_prices: #http error / no stock hist for specified dates
-      not_updated.append(c.symbol)
-      continue
-    bulklist.extend(stockInserter.create_stock_objects(hist_prices, c))
-  bulklist.extend(manual_update_ACE())
+    jobs.append((c.symbol, str(start_date).replace("-",""), str(yday).replace("-",""))) #ystockquote date format
+  inserted, symbols = insert_stocks(jobs, not_updated)
   print("All scraped...")
-  stockInserter.insert_and_log_stocks(bulklist, len(companies) - len(not_updated), "previous latest", "yesterday", not_updated)
-  return len(bulklist), len(companies)
+  stockInserter.refresh_and_log_stocks(symbols, inserted, len(companies) - len(not_updated), "previous latest", "yesterday", not_updated)
+  return inserted, len(companies)
+
+def insert_stocks(jobs, not_updated):
+  ''' Inserts stocks of given jobs in chunks while retrieving them (see stockInserter.insert_stocks), followed by the ACE stocks (see manual_update_ACE).
+
+  :returns: A pair containing the number of stocks inserted and the set of symbols inserted.
+  '''
+  inserted, symbols = stockInserter.insert_stocks(jobs, not_updated)
+  bulklist = manual_update_ACE()
+  stockInserter.bulk_insert(bulklist)
+  symbols.update(s.company_id for s in bulklist)
+  return inserted + len(bulklist), symbols
 
 def update_recent_admin(selected_companies): #recent SNP500 stocks only
   ''' Updates stocks for given companies.
@@ -48,8 +53,6 @@ def update_recent_admin(selected_companies): #recent SNP500 stocks only
 
   :returns: A pair containing total stocks updated and companies updated.
   '''
-  bulklist = []
-  not_updated = []
   indexes = get_indexes()
   current_companies = list(SNP500.objects.get(year=0).companies.all())
   this_year_companies = list(SNP500.objects.get(year=datetime.today().year).companies.all())
@@ -60,15 +63,10 @@ def update_recent_admin(selected_companies): #recent SNP500 stocks only
   yday = str(datetime.today().date() - timedelta(days=1)).replace("-","")
   if last_update == yday:
     return None, None
-  for c in companies:
-    hist_prices = ystockquote.get_historical_prices(c.symbol, last_update, yday)
-    if not hist_prices: #http error / no stock hist for specified dates
-      not_updated.append(c.symbol)
-      continue
-    bulklist.extend(stockInserter.create_stock_objects(hist_prices, c))
-  bulklist.extend(manual_update_ACE())
-  stockInserter.insert_and_log_stocks(bulklist, len(companies) - len(not_updated), "previous latest", "yesterday", not_updated)
-  return len(bulklist), len(companies)
+  not_updated = []
+  inserted, symbols = insert_stocks([(c.symbol, last_update, yday) for c in companies], not_updated)
+  stockInserter.refresh_and_log_stocks(symbols, inserted, len(companies) - len(not_updated), "previous latest", "yesterday", not_updated)
+  return inserted, len(companies)
 
 def update_current_SNP500(current_snp):
   ''' Updates current S&P 500 constituents.
@@ -109,18 +107,12 @@ def update_recently_added(companies):
 
   :returns: An integer indicating the number of stocks added.
   '''
-  bulklist = []
   not_updated = []
   yday = str(datetime.today().date() - timedelta(days=1)).replace("-","")
-  for c in companies:
-    start_date = '19880101'
-    hist_prices = ystockquote.get_historical_prices(c.symbol, start_date, yday)
-    if not hist_prices: #http error / no stock hist for specified dates
-      not_updated.append(c.symbol)
-      continue
-    bulklist.extend(stockInserter.create_stock_objects(hist_prices, c))
-  stockInserter.insert_and_log_stocks(bulklist, len(companies) - len(not_updated), "previous latest", "yesterday", not_updated)
-  return len(bulklist)
+  start_date = '19880101'
+  inserted, symbols = stockInserter.insert_stocks([(c.symbol, start_date, yday) for c in companies], not_updated)
+  stockInserter.refresh_and_log_stocks(symbols, inserted, len(companies) - len(not_updated), "previous latest", "yesterday", not_updated)
+  return inserted
 
 def update_portfolio_calculations(portfolios):
   ''' Updates calculations for given portfolios.
@@ -129,11 +121,23 @@ def update_portfolio_calculations(portfolios):
   '''
   today = datetime.today().date()
   past_portfolios = []
-  for p in portfolios:
-    p = portfolioCalculator.update_or_create_portfolio(p.spread, p.period, p.lv, today, p=p) #reassignment allowed? Otherwise new list (updated_portfolios)
-    past_portfolios += portfolioCalculator.update_past_portfolios(p, datetime.today().date())
+  info = {}
+  for ps in portfolioCalculator.group_portfolios(portfolios): #spreads sharing period and stocks are calculated together
+    ps = portfolioCalculator.update_or_create_portfolios([p.spread for p in ps], ps[0].period, ps[0].lv, today, ps[0].title, ps=ps)
+    past_portfolios += portfolioCalculator.update_past_portfolios_group(ps, today, info=info)
   bulk_update(portfolios, update_fields=['symbols_field', 'allocations_field', 'vol', 'date_calculated'])
   bulk_update(past_portfolios, update_fields=['start_date', 'allocations_field', 'symbols_field'])
+  log_solver_iterations(info)
+  resultCache.invalidate() #cached custom portfolios are stale
+
+def log_solver_iterations(info):
+  ''' Logs the solver iterations of past portfolio calculations, i.e. the effect of warm-starting each year from the previous year.
+
+  :param info: A dict mapping 'warm' and 'cold' to lists of iteration counts (see portfolioCalculator.record_iterations).
+  '''
+  logfile = open(stockInserter.log, 'a')
+  logfile.write("\n\nDate: {0}\nUpdated past portfolios: {1}".format(datetime.now(), portfolioCalculator.iteration_summary(info)))
+  logfile.close()
 
 def update_portfolio_performances(plots):
   ''' Updates calculations for given plots.
@@ -142,12 +146,45 @@ def update_portfolio_performances(plots):
   '''
   past_stats = []
   altered_plots = []
-  for p in plots:
-    ps, plot = portfolioCalculator.calculate_past_portfolio_performance(p.investment, p.portfolio, p)
-    past_stats += ps
-    altered_plots.append(plot)
-  bulk_update(altered_plots, update_fields=['html'])
+  for group in portfolioCalculator.group_plots(plots): #investments sharing the portfolio are calculated together
+    try:
+      calculated = portfolioCalculator.calculate_past_portfolio_performances([p.investment for p in group], group[0].portfolio, group)
+    except portfolioAnalyzer.UnavailableStocksError as e: #keep the previous performance
+      print(group[0].portfolio, e)
+      continue
+    for ps, plot in calculated:
+      past_stats += ps
+      altered_plots.append(plot)
+  start_time = time.time()
+  bulk_update(altered_plots, update_fields=['html_field'])
+  raw, compressed = plot_storage(altered_plots)
+  log_plot_storage(len(altered_plots), raw, compressed, time.time() - start_time)
   bulk_update(past_stats, update_fields=['vol', 'ret', 'snp_vol', 'snp_ret', 'snp_lv_vol', 'snp_lv_ret', 'sharpe_ratio']) 
+  resultCache.invalidate() #cached performances are stale
+
+def plot_storage(plots):
+  ''' Calculates the storage of given plots (see log_plot_storage).
+
+  :param plots: A list of Plot objects with compressed html.
+
+  :returns: A pair containing the bytes of the uncompressed and the compressed html.
+  '''
+  raw = sum(len(p.html.encode('utf-8')) for p in plots if p.html is not None)
+  compressed = sum(len(p.html_field) for p in plots if p.html_field is not None)
+  return raw, compressed
+
+def log_plot_storage(num_plots, raw, compressed, seconds):
+  ''' Logs the space saved by compressing the updated plots and the time taken to write them.
+
+  :param num_plots: An integer indicating the number of plots updated.
+  :param raw: An integer indicating the bytes of the uncompressed html (see plot_storage).
+  :param compressed: An integer indicating the bytes of the compressed html.
+  :param seconds: A float indicating the seconds taken to write the plots.
+  '''
+  logfile = open(stockInserter.log, 'a')
+  logfile.write("\n\nDate: {0}\nUpdated plots: {1}, {2} KB compressed to {3} KB ({4} KB saved), written in {5:.3f} seconds".format(
+    datetime.now(), num_plots, raw // 1024, compressed // 1024, (raw - compressed) // 1024, seconds))
+  logfile.close()
 
 def select_suggested_portfolio(p):
   ''' Marks given portfolio as suggested.
@@ -226,7 +263,7 @@ def manual_update_ACE():
   start_date = get_most_recent_date(old_symbol)
   yday = str(yday).replace("-","") #ystockquote date format
   start_date = str(start_date).replace("-","")
-  hist_prices = ystockquote.get_historical_prices(new_symbol, start_date, yday)
-  if not hist_prices:
-    return []
-  return stockInserter.create_stock_objects(hist_prices, company)
\ No newline at end of file
+  for symbol, content in quoteFetcher.get_historical_csv([(new_symbol, start_date, yday)]): #retried like the other companies
+    if content:
+      return stockInserter.create_stock_objects(content, company)
+  return []
\ No newline at end of file
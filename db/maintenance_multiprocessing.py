@@ -1,18 +1,28 @@
-from scraper import ystockquote, snp500
-from vola.models import Company, Stock, SNP500, Portfolio, Past_Portfolio, Past_Statistics
+from scraper import snp500, quoteFetcher
+from vola.models import Company, Stock, SNP500, Portfolio, Past_Portfolio, Past_Statistics, Plot
 from datetime import datetime, timedelta
-from db import access as dba, stockInserter
-from vola import portfolioCalculator
+from db import access as dba, maintenance, stockInserter, stockPanel
+from vola import portfolioCalculator, portfolioAnalyzer, resultCache
 from bulk_update.helper import bulk_update
+from functools import partial
 import time, os, multiprocessing as mp
 from django.db import connection
 
-'''This module provides functions to keep the database up to date.'''
+'''
+This module provides functions to keep the database up to date.
+
+->Historical prices are retrieved concurrently on an event loop rather than a pool (see quoteFetcher).
+->Pool workers return compact results (plain tuples) streamed back as they complete (see stream_pool).
+->Results are written in chunks while streaming, so the parent never holds all results of a pool at once.
+'''
 
 directory = os.path.join(os.path.abspath(os.path.dirname(__file__)), "textfiles/")
 recently_ceased_companies = os.path.join(directory, "ceased.txt")
-results = []
-past_results = []
+WRITE_CHUNK = 5000 #objects written per bulk query
+PORTFOLIO_FIELDS = ['symbols_field', 'allocations_field', 'vol', 'date_calculated']
+PAST_PORTFOLIO_FIELDS = ['start_date', 'allocations_field', 'symbols_field']
+PLOT_FIELDS = ['html_field']
+PAST_STATISTICS_FIELDS = ['vol', 'ret', 'snp_vol', 'snp_ret', 'snp_lv_vol', 'snp_lv_ret', 'sharpe_ratio']
 
 def update_stocks(companies):
   ''' Updates stocks for given companies.
@@ -24,53 +34,69 @@ def update_stocks(companies):
   start_time = time.time()
   yday = datetime.today().date() - timedelta(days=1)
   cut_off_date = datetime.today().date() - timedelta(days=360) #no data in the last 2 months
-  bulklist, not_updated = init_pool_stocks(companies, multi_processing_stocks, yday, cut_off_date)
-  bulklist = [x for x in bulklist if x is not None]
-  bulklist = [item for sublist in bulklist for item in sublist] #collapse list
-  bulklist.extend(manual_update_ACE())
-  not_updated = [x for x in not_updated if x is not None]
-  if len(bulklist) == 0:
+  jobs, not_updated = [], []
+  for c in companies:
+    start_date = get_most_recent_date(c.symbol)
+    if not start_date or (start_date == yday) or (start_date < cut_off_date):
+      not_updated.append(c.symbol)
+      continue
+    jobs.append((c.symbol, str(start_date).replace("-",""), str(yday).replace("-",""))) #ystockquote date format
+  inserted, symbols = insert_stocks(jobs, not_updated)
+  if inserted == 0:
     return None, None
-  stockInserter.insert_and_log_stocks(bulklist, len(companies) - len(not_updated), "previous latest", "yesterday", not_updated)
+  stockInserter.refresh_and_log_stocks(symbols, inserted, len(companies) - len(not_updated), "previous latest", "yesterday", not_updated)
   print("--- %s seconds ---" % (time.time() - start_time))
-  return len(bulklist), len(companies)
-
-def init_pool_stocks(cs, funct, yday, date):
-  num = len(cs)
-  manager = mp.Manager() #results, past results
-  results = manager.list([None]*num)
-  past_results = manager.list([None]*num)
-  pool = mp.Pool(processes=50) #os scheduling saves time due to http request delays
-  for i, c in enumerate(cs):
-    pool.apply_async(funct, args=[i, c, yday, date, results, past_results])
-  pool.close()
-  pool.join()
-  return results, past_results
-
-def multi_processing_stocks(i, c, yday, cut_off_date, results, past_results):
-  connection.close()
-  start_date = get_most_recent_date(c.symbol)
-  if not start_date:
-    past_results[i] = c.symbol
-    return None
-  if (start_date == yday) or (start_date < cut_off_date):
-    past_results[i] = c.symbol
-    return None
-  yday = str(yday).replace("-","") #ystockquote date format
-  start_date = str(start_date).replace("-","")
-  hist_prices = ystockquote.get_historical_prices(c.symbol, start_date, yday)
-  if not hist_prices: #http error / no stock hist for specified dates
-    past_results[i] = c.symbol
-    return None
-  results[i] = stockInserter.create_stock_objects(hist_prices, c)
+  return inserted, len(companies)
 
-def multi_processing_recent_stocks(i, c, yday, last_update, results, past_results):
-  connection.close()
-  hist_prices = ystockquote.get_historical_prices(c.symbol, last_update, yday)
-  if not hist_prices: #http error / no stock hist for specified dates
-    past_results[i] = c.symbol
-    return None
-  results[i] = stockInserter.create_stock_objects(hist_prices, c)
+def stream_pool(items, funct, processes, **kwargs):
+  ''' Runs funct(item, **kwargs) for each item in a pool of processes.
+
+  :param items: A list of picklable items, e.g. ticker symbols or groups of portfolios.
+  :param funct: A module-level function returning a compact (picklable) result.
+  :param processes: A positive integer indicating the number of worker processes.
+
+  :returns: A generator of results in order of completion.
+  '''
+  pool = mp.Pool(processes=processes)
+  try:
+    for result in pool.imap_unordered(partial(funct, **kwargs), items):
+      yield result
+  finally:
+    pool.terminate()
+    pool.join()
+
+def insert_stocks(jobs, not_updated):
+  ''' Inserts stocks of given jobs in chunks while retrieving them (see stockInserter.insert_stocks), followed by the ACE stocks (see manual_update_ACE).
+
+  :returns: A pair containing the number of stocks inserted and the set of symbols inserted.
+  '''
+  inserted, symbols = stockInserter.insert_stocks(jobs, not_updated)
+  bulklist = manual_update_ACE()
+  stockInserter.bulk_insert(bulklist)
+  symbols.update(s.company_id for s in bulklist)
+  return inserted + len(bulklist), symbols
+
+def write_chunk(objects, fields, final=False):
+  ''' Updates given objects once a chunk is complete.
+
+  :param objects: A list of model objects pending update.
+  :param fields: A list of field names to update.
+  :param final(optional): A boolean indicating whether or not to update the remaining objects regardless of their number.
+
+  :returns: A list of objects still pending update.
+  '''
+  if not objects or (len(objects) < WRITE_CHUNK and not final):
+    return objects
+  bulk_update(objects, update_fields=fields)
+  return []
+
+def pack_rows(objects, fields):
+  ''' Reduces model objects to plain tuples of their primary key and given field values, i.e. a compact pool result. '''
+  return [(o.pk,) + tuple(getattr(o, f) for f in fields) for o in objects]
+
+def unpack_rows(model, fields, rows):
+  ''' Rebuilds model objects from tuples of their primary key and given field values (see pack_rows), e.g. for bulk updates. '''
+  return [model(pk=row[0], **dict(zip(fields, row[1:]))) for row in rows]
 
 def update_recent_admin(selected_companies): #recent SNP500 stocks only
   ''' Updates stocks for given companies.
@@ -89,15 +115,12 @@ def update_recent_admin(selected_companies): #recent SNP500 stocks only
   yday = str(datetime.today().date() - timedelta(days=1)).replace("-","")
   if last_update == yday:
     return None, None
-  bulklist, not_updated = init_pool_stocks(companies, multi_processing_recent_stocks, yday, last_update)
-  bulklist = [x for x in bulklist if x is not None]
-  if len(bulklist) == 0:
+  not_updated = []
+  inserted, symbols = insert_stocks([(c.symbol, last_update, yday) for c in companies], not_updated)
+  if inserted == 0:
     return None, None
-  bulklist = [item for sublist in bulklist for item in sublist] #collapse list
-  bulklist.extend(manual_update_ACE())
-  not_updated = [x for x in not_updated if x is not None]
-  stockInserter.insert_and_log_stocks(bulklist, len(companies) - len(not_updated), "previous latest", "yesterday", not_updated)
-  return len(bulklist), len(companies)
+  stockInserter.refresh_and_log_stocks(symbols, inserted, len(companies) - len(not_updated), "previous latest", "yesterday", not_updated)
+  return inserted, len(companies)
 
 def update_current_SNP500(current_snp):
   ''' Updates current S&P 500 constituents.
@@ -138,18 +161,12 @@ def update_recently_added(companies):
 
   :returns: An integer indicating the number of stocks added.
   '''
-  bulklist = []
   not_updated = []
   yday = str(datetime.today().date() - timedelta(days=1)).replace("-","")
-  for c in companies:
-    start_date = '19880101'
-    hist_prices = ystockquote.get_historical_prices(c.symbol, start_date, yday)
-    if not hist_prices: #http error / no stock hist for specified dates
-      not_updated.append(c.symbol)
-      continue
-    bulklist.extend(stockInserter.create_stock_objects(hist_prices, c))
-  stockInserter.insert_and_log_stocks(bulklist, len(companies) - len(not_updated), "previous latest", "yesterday", not_updated)
-  return len(bulklist)
+  start_date = '19880101'
+  inserted, symbols = stockInserter.insert_stocks([(c.symbol, start_date, yday) for c in companies], not_updated)
+  stockInserter.refresh_and_log_stocks(symbols, inserted, len(companies) - len(not_updated), "previous latest", "yesterday", not_updated)
+  return inserted
 
 def update_portfolio_calculations(portfolios):
   ''' Updates calculations for given portfolios.
@@ -157,10 +174,18 @@ def update_portfolio_calculations(portfolios):
   :param portfolios: A list of portfolio objects to update.
   '''
   start_time = time.time()
-  portfolios, past_results = init_pool(portfolios, multi_processing_portfolios)
-  past_portfolios = [item for sublist in past_results for item in sublist] #collapse list
-  bulk_update(portfolios, update_fields=['symbols_field', 'allocations_field', 'vol', 'date_calculated'])
-  bulk_update(past_portfolios, update_fields=['start_date', 'allocations_field', 'symbols_field'])
+  groups = portfolioCalculator.group_portfolios(portfolios) #spreads sharing period and stocks are calculated together
+  stockPanel.get() #load once, forked workers share it
+  portfolios, past_portfolios, info = [], [], {}
+  for rows, past_rows, group_info in stream_pool(groups, multi_processing_portfolios, mp.cpu_count()):
+    portfolios = write_chunk(portfolios + unpack_rows(Portfolio, PORTFOLIO_FIELDS, rows), PORTFOLIO_FIELDS)
+    past_portfolios = write_chunk(past_portfolios + unpack_rows(Past_Portfolio, PAST_PORTFOLIO_FIELDS, past_rows), PAST_PORTFOLIO_FIELDS)
+    for key, iterations in group_info.items():
+      info.setdefault(key, []).extend(iterations)
+  write_chunk(portfolios, PORTFOLIO_FIELDS, True)
+  write_chunk(past_portfolios, PAST_PORTFOLIO_FIELDS, True)
+  maintenance.log_solver_iterations(info)
+  resultCache.invalidate() #cached custom portfolios are stale
   print("--- %s seconds ---" % (time.time() - start_time))
 
 def update_portfolio_performances(plots):
@@ -169,37 +194,52 @@ def update_portfolio_performances(plots):
   :param portfolios: A list of plot objects to update.
   '''
   start_time = time.time()
-  altered_plots, past_results = init_pool(plots, multi_processing_performances)
-  past_stats = [item for sublist in past_results for item in sublist] #collapse list
-  bulk_update(altered_plots, update_fields=['html'])
-  bulk_update(past_stats, update_fields=['vol', 'ret', 'snp_vol', 'snp_ret', 'snp_lv_vol', 'snp_lv_ret', 'sharpe_ratio'])
+  groups = portfolioCalculator.group_plots(plots) #investments sharing the portfolio are calculated together
+  stockPanel.get() #load once, forked workers share it
+  altered_plots, past_stats, num_plots, raw, compressed, seconds = [], [], 0, 0, 0, 0.
+  for rows, stat_rows, (raw_size, compressed_size) in stream_pool(groups, multi_processing_performances, mp.cpu_count()):
+    num_plots, raw, compressed = num_plots + len(rows), raw + raw_size, compressed + compressed_size
+    write_time = time.time()
+    altered_plots = write_chunk(altered_plots + unpack_rows(Plot, PLOT_FIELDS, rows), PLOT_FIELDS)
+    seconds += time.time() - write_time
+    past_stats = write_chunk(past_stats + unpack_rows(Past_Statistics, PAST_STATISTICS_FIELDS, stat_rows), PAST_STATISTICS_FIELDS)
+  write_time = time.time()
+  write_chunk(altered_plots, PLOT_FIELDS, True)
+  maintenance.log_plot_storage(num_plots, raw, compressed, seconds + time.time() - write_time)
+  write_chunk(past_stats, PAST_STATISTICS_FIELDS, True)
+  resultCache.invalidate() #cached performances are stale
+  print("--- %s seconds ---" % (time.time() - start_time))
+
+def update_stock_panel_snapshot():
+  ''' Writes the full stock history to the memory-mapped snapshot shared by all web and pool workers.
+
+  :returns: A pair containing the snapshot directory (None if disabled) and the number of trading dates written.
+  '''
+  start_time = time.time()
+  directory = stockPanel.write_snapshot()
+  stockPanel.invalidate()
   print("--- %s seconds ---" % (time.time() - start_time))
+  return directory, len(stockPanel.get()['dates'])
 
-def init_pool(ps, funct):
-  num = len(ps)
-  manager = mp.Manager() #results, past results
-  results = manager.list([None]*num)
-  past_results = manager.list([None]*num)
-  cores = mp.cpu_count()
-  pool = mp.Pool(processes=cores)
-  for i, p in enumerate(ps):
-    pool.apply_async(funct, args=[i, p, results, past_results])
-  pool.close()
-  pool.join()
-  return results, past_results
-
-def multi_processing_portfolios(i, p, results, past_results):
+def multi_processing_portfolios(ps):
   connection.close()
   today = datetime.today().date()
-  p_updated = portfolioCalculator.update_or_create_portfolio(p.spread, p.period, p.lv, today, p=p)
-  results[i] = p_updated
-  past_results[i] = portfolioCalculator.update_past_portfolios(p_updated, today)
+  p = ps[0]
+  ps_updated = portfolioCalculator.update_or_create_portfolios([x.spread for x in ps], p.period, p.lv, today, p.title, ps=ps)
+  info = {}
+  past_portfolios = portfolioCalculator.update_past_portfolios_group(ps_updated, today, info=info)
+  return pack_rows(ps_updated, PORTFOLIO_FIELDS), pack_rows(past_portfolios, PAST_PORTFOLIO_FIELDS), info
 
-def multi_processing_performances(i, p, results, past_results):
+def multi_processing_performances(plots):
   connection.close()
-  ps, plot = portfolioCalculator.calculate_past_portfolio_performance(p.investment, p.portfolio, p)
-  results[i] = plot
-  past_results[i] = ps
+  try:
+    calculated = portfolioCalculator.calculate_past_portfolio_performances([p.investment for p in plots], plots[0].portfolio, plots)
+  except portfolioAnalyzer.UnavailableStocksError as e: #keep the previous performance
+    print(plots[0].portfolio, e)
+    calculated = []
+  altered_plots = [plot for ps, plot in calculated]
+  past_stats = [item for ps, plot in calculated for item in ps]
+  return pack_rows(altered_plots, PLOT_FIELDS), pack_rows(past_stats, PAST_STATISTICS_FIELDS), maintenance.plot_storage(altered_plots)
 
 def select_suggested_portfolio(p):
   ''' Marks given portfolio as suggested.
@@ -278,7 +318,7 @@ def manual_update_ACE():
   start_date = get_most_recent_date(old_symbol)
   yday = str(yday).replace("-","") #ystockquote date format
   start_date = str(start_date).replace("-","")
-  hist_prices = ystockquote.get_historical_prices(new_symbol, start_date, yday)
-  if not hist_prices:
-    return []
-  return stockInserter.create_stock_objects(hist_prices, company)
\ No newline at end of file
+  for symbol, content in quoteFetcher.get_historical_csv([(new_symbol, start_date, yday)]): #retried like the other companies
+    if content:
+      return stockInserter.create_stock_objects(content, company)
+  return []
\ No newline at end of file
@@ -1,8 +1,8 @@
 from scraper import ystockquote
 from vola.models import Company, Stock, SNP500, Portfolio, Past_Portfolio, Past_Statistics, Plot
 from datetime import datetime, timedelta
-from db import access as dba, stockInserter
-from vola import portfolioCalculator
+from db import access as dba, stockInserter, stockPanel
+from vola import portfolioCalculator, portfolioAnalyzer, resultCache
 from bulk_update.helper import bulk_update
 import os
 import django
@@ -84,18 +84,11 @@ def populate_snp_2016():
 
 def populate_stocks(start_date, end_date):
   ''' Date: String format 'YYYYMMDD' '''
-  bulklist = []
   not_added = []
   companies = Company.objects.all()
-  for c in companies:
-    hist_prices = ystockquote.get_historical_prices(c.symbol, start_date, end_date)
-    if not hist_prices: #http error / no stock hist for specified dates
-      not_added.append(c.symbol)
-      continue
-    print(hist_prices)
-    bulklist.extend(stockInserter.create_stock_objects(hist_prices, c))
-  stockInserter.insert_and_log_stocks(bulklist, len(companies) - len(not_added), start_date, end_date, not_added)
-  return len(bulklist)
+  inserted, symbols = stockInserter.insert_stocks([(c.symbol, start_date, end_date) for c in companies], not_added)
+  stockInserter.refresh_and_log_stocks(symbols, inserted, len(companies) - len(not_added), start_date, end_date, not_added)
+  return inserted
 
 
 def populate_custom_portfolios():
@@ -109,9 +102,7 @@ def populate_custom_portfolios():
     print(lv)
     for period in periods:
       print(period)
-      for spread in spreads:
-        print(spread)
-        bulklist.append(portfolioCalculator.update_or_create_portfolio(spread, period, lv, today))
+      bulklist += portfolioCalculator.update_or_create_portfolios(spreads, period, lv, today) #all spreads at once
   Portfolio.objects.bulk_create(bulklist)
 
 def select_suggested_portfolio():
@@ -130,24 +121,29 @@ def populate_past_portfolios():
   SNP500LV_start_year = 2012
   portfolios = Portfolio.objects.all()
   bulklist = []
-  for p in portfolios:
-    print(p.lv, p.period, p.spread)
-    bulklist += portfolioCalculator.create_past_portfolios(p, SNP500LV_start_year, datetime.today().date())
+  info = {}
+  for ps in portfolioCalculator.group_portfolios(portfolios): #all spreads at once
+    print(ps[0].lv, ps[0].period)
+    bulklist += portfolioCalculator.create_past_portfolios_group(ps, SNP500LV_start_year, datetime.today().date(), info=info)
   Past_Portfolio.objects.bulk_create(bulklist)
+  print(portfolioCalculator.iteration_summary(info))
 
 def populate_past_statistics_and_plot():
-  investments = [10000, 25000, 50000, 100000, 250000, 1000000]
+  investments = portfolioCalculator.INVESTMENTS
   portfolios = Portfolio.objects.all()
   past_stats = []
   plots = []
   for p in portfolios:
     print(p.lv, p.period, p.spread)
-    for inv in investments:
-      print(inv)
-      ps, plot = portfolioCalculator.calculate_past_portfolio_performance(inv, p)
+    try:
+      calculated = portfolioCalculator.calculate_past_portfolio_performances(investments, p) #all investments at once
+    except portfolioAnalyzer.UnavailableStocksError as e:
+      print(e)
+      continue
+    for ps, plot in calculated:
       past_stats += ps
       plots.append(plot)
-  bulk_update(plots, update_fields=['html'])
+  bulk_update(plots, update_fields=['html_field'])
   Past_Statistics.objects.bulk_create(past_stats)
 
 # START: Remove dirty data from yahoo ------------------
@@ -168,6 +164,8 @@ def cleanse_BOL():
     bulklist.append(Stock(company=Company.objects.get(symbol='BOL'), close_price=i[1], change=i[2], date=i[0] - timedelta(days=1)))
   # Stock.objects.filter(company__symbol='BOL', date__in=to_remove).delete()
   Stock.objects.bulk_create(bulklist)
+  stockPanel.refresh(['BOL'])
+  resultCache.invalidate()
   bol = Stock.objects.filter(company__symbol='BOL', date__gte=start, date__lte=end).values_list('date').order_by('date', 'company__symbol')
   print(len(bol))
 
@@ -178,6 +176,8 @@ def cleanse_others():
   nyx = Stock.objects.filter(company__symbol='NYX', date__gte=start, date__lte=end).values_list('date').order_by('date', 'company__symbol')
   to_remove = [x[0] for x in nyx if x not in a]
   Stock.objects.filter(company__symbol__in=['NYX', 'FRX', 'CPWR'], date__in=to_remove).delete()
+  stockPanel.refresh(['NYX', 'FRX', 'CPWR'])
+  resultCache.invalidate()
   nyx = Stock.objects.filter(company__symbol='NYX', date__gte=start, date__lte=end).values_list('date').order_by('date', 'company__symbol')
   print(len(nyx))
 
@@ -209,6 +209,7 @@ if __name__ == '__main__':
     cleanse_BOL()
     cleanse_others()
     filter_zero_prices()
+    stockPanel.write_snapshot() # Memory-mapped stock history shared by web and pool workers
 
     # Pre-compute and store custom mvps and corresponding stats
     populate_custom_portfolios() # Pre-compute and store all possible custom portfolios for increased peformance
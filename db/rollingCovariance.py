@@ -0,0 +1,142 @@
+from db import stockPanel
+import numpy as np
+import threading
+
+'''
+This module provides rolling-window covariance statistics over the change panel (see stockPanel).
+
+->Sums of changes and products of changes are kept over the window's dates for the companies requested from it,
+  e.g. a stock universe, rather than for every company of the panel. Companies requested later are added as columns.
+->A window holds 8 * companies^2 bytes, e.g. 2 MB for 500 companies, at most MAX_WINDOWS are kept (see memory).
+->Moving a window adds and removes date rows (rank-k updates) rather than recomputing it,
+  e.g. for consecutive past portfolios or daily refreshes. A request moves the window of the same length that
+  overlaps it most, so different periods of the same length, e.g. concurrent minimisations, keep their own windows.
+->Windows are recomputed from scratch periodically to bound accumulated rounding errors.
+'''
+
+RECOMPUTE_ROWS = 2500 #rows added and removed before a window is recomputed
+MAX_WINDOWS = 6
+_lock = threading.RLock()
+_windows = []
+_uses = 0
+
+def covariance(start, end, symbols):
+  ''' Calculates the covariance matrix of daily changes for the given period and symbols,
+  i.e. np.cov(changes, rowvar=False, bias=True) for the change matrix (see access.get_stock_matrix).
+
+  :param start: A date object indicating the start of the period (inclusive).
+  :param end: A date object indicating the end of the period (inclusive).
+  :param symbols: A list of ticker symbols.
+
+  :returns: A pair containing the covariance matrix (ordered as sorted(symbols)) and the number of trading days,
+  or None if some symbols are unavailable on some of the trading days (see access.get_covariance).
+  '''
+  symbols = sorted(symbols)
+  panel = stockPanel.get()
+  cols = stockPanel.columns(panel, symbols)
+  if cols is None:
+    return None
+  with _lock:
+    window = get_window(start, end, cols, panel)
+    available = ~np.isnan(panel['change'][window['rows']][:, cols])
+    complete = available.all(axis=1)
+    if not complete.any() or np.any(complete != available.any(axis=1)): #inconsistent dates
+      return None
+    days = np.count_nonzero(complete)
+    index = np.searchsorted(window['cols'], cols) #window columns are sorted
+    mean = window['sum'][index] / days
+    cov = window['product'][np.ix_(index, index)] / days - np.outer(mean, mean)
+  return cov, days
+
+def get_window(start, end, cols, panel=None):
+  ''' Retreives a window for the given period and panel columns, moving the window of the same length that overlaps the period most
+  or computing a new one if none overlaps more than half of it.
+
+  :param start: A date object indicating the start of the period (inclusive).
+  :param end: A date object indicating the end of the period (inclusive).
+  :param cols: A numpy integer array of panel columns (see stockPanel.columns).
+  :param panel(optional): The stock panel. Defaults to the current one.
+
+  :returns: A dict containing the panel, its rows (slice) and columns (sorted), the sum of changes (vector) and products of changes (matrix) over those rows.
+  '''
+  panel = stockPanel.get() if panel is None else panel
+  rows = stockPanel.rows(panel, start, end)
+  length = (end - start).days
+  with _lock:
+    _windows[:] = [w for w in _windows if w['panel'] is panel and w['updated'] < RECOMPUTE_ROWS]
+    candidates = [w for w in _windows if w['length'] == length]
+    window = max(candidates, key=lambda w: overlap(w['rows'], rows)) if candidates else None
+    if window is None or 2 * overlap(window['rows'], rows) <= rows.stop - rows.start:
+      if len(_windows) >= MAX_WINDOWS: #least recently used
+        _windows.remove(min(_windows, key=lambda w: w['used']))
+      window = compute(panel, rows, cols)
+      window['length'] = length
+      _windows.append(window)
+    else:
+      extend(window, cols)
+      move(window, rows)
+    window['used'] = next_use()
+  return window
+
+def memory():
+  ''' :returns: An integer indicating the bytes held by the kept windows. '''
+  with _lock:
+    return sum(w['sum'].nbytes + w['product'].nbytes for w in _windows)
+
+def overlap(a, b):
+  return max(0, min(a.stop, b.stop) - max(a.start, b.start))
+
+def compute(panel, rows, cols):
+  cols = np.unique(cols)
+  n = len(cols)
+  window = {'panel': panel, 'rows': rows, 'cols': cols, 'sum': np.zeros(n), 'product': np.zeros((n, n)), 'updated': 0}
+  accumulate(window, rows, 1)
+  window['updated'] = 0
+  return window
+
+def extend(window, cols):
+  ''' Adds the given panel columns missing from the window, calculating their sums and products over the window's rows only. '''
+  new = np.setdiff1d(cols, window['cols'])
+  if not len(new):
+    return
+  merged = np.union1d(window['cols'], new)
+  old, added = np.searchsorted(merged, window['cols']), np.searchsorted(merged, new)
+  changes = changes_matrix(window['panel'], window['rows'], merged)
+  total, product = np.zeros(len(merged)), np.empty((len(merged), len(merged)))
+  total[old], total[added] = window['sum'], changes[:, added].sum(axis=0)
+  product[np.ix_(old, old)] = window['product']
+  product[:, added] = changes.T.dot(changes[:, added])
+  product[added, :] = product[:, added].T
+  window.update({'cols': merged, 'sum': total, 'product': product})
+
+def move(window, rows):
+  ''' Moves the window to the given rows by adding the new rows and removing the old ones, or recomputes it if that is cheaper. '''
+  old = window['rows']
+  removed = [slice(old.start, min(old.stop, rows.start)), slice(max(old.start, rows.stop), old.stop)]
+  added = [slice(rows.start, min(rows.stop, old.start)), slice(max(rows.start, old.stop), rows.stop)]
+  removed = [r for r in removed if r.stop > r.start]
+  added = [r for r in added if r.stop > r.start]
+  if sum(r.stop - r.start for r in removed + added) >= rows.stop - rows.start: #little or no overlap
+    window.update(compute(window['panel'], rows, window['cols']))
+    return
+  for r in removed:
+    accumulate(window, r, -1)
+  for r in added:
+    accumulate(window, r, 1)
+  window['rows'] = rows
+
+def accumulate(window, rows, sign):
+  changes = changes_matrix(window['panel'], rows, window['cols'])
+  window['sum'] += sign * changes.sum(axis=0)
+  window['product'] += sign * changes.T.dot(changes) #rank-k update
+  window['updated'] += rows.stop - rows.start
+
+def changes_matrix(panel, rows, cols):
+  changes = np.array(panel['change'][rows][:, cols], dtype=np.float64)
+  changes[np.isnan(changes)] = 0. #missing stocks do not contribute
+  return changes
+
+def next_use():
+  global _uses
+  _uses += 1
+  return _uses
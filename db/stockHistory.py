@@ -0,0 +1,86 @@
+from vola.models import Stock, Stock_History
+from django.conf import settings
+from django.db import transaction
+import numpy as np
+
+'''
+This module provides the compact stock storage, i.e. one Stock_History row of packed arrays per company.
+
+->Stock rows remain the source of truth. Inserted stocks are appended to the histories of their companies,
+  histories are only rebuilt from Stock rows when stocks are removed or changed otherwise.
+->With settings.STOCK_STORAGE = 'history', the stock panel is built from histories rather than Stock rows,
+  avoiding a Decimal per stock value and a row per stock entry.
+'''
+
+def enabled():
+  ''' :returns: A boolean indicating whether or not the stock panel is built from the compact storage. '''
+  return getattr(settings, 'STOCK_STORAGE', 'rows') == 'history'
+
+def rebuild(symbols=None):
+  ''' Rebuilds the stock histories of given companies from their Stock rows.
+
+  :param symbols(optional): A list of ticker symbols. Defaults to all companies.
+
+  :returns: An integer indicating the number of histories rebuilt.
+  '''
+  entries = Stock.objects.values_list('company_id', 'date', 'close_price', 'change').order_by('company', 'date')
+  histories = Stock_History.objects.all()
+  if symbols is not None:
+    entries = entries.filter(company__symbol__in=list(symbols))
+    histories = histories.filter(company__symbol__in=list(symbols))
+  packed = {}
+  for symbol, date, close_price, change in entries.iterator():
+    dates, prices, changes = packed.setdefault(symbol, ([], [], []))
+    dates.append(date)
+    prices.append(close_price)
+    changes.append(change)
+  bulklist = []
+  for symbol, (dates, prices, changes) in packed.items():
+    history = Stock_History(company_id=symbol)
+    history.set_history(dates, prices, changes)
+    bulklist.append(history)
+  with transaction.atomic():
+    histories.delete()
+    Stock_History.objects.bulk_create(bulklist, batch_size=100)
+  return len(bulklist)
+
+def append(stocks):
+  ''' Appends inserted stocks to the histories of their companies, i.e. without re-reading their Stock rows.
+
+  :param stocks: A list of stock objects just inserted.
+
+  :returns: An integer indicating the number of histories updated.
+  '''
+  appended = {}
+  for s in stocks:
+    dates, prices, changes = appended.setdefault(s.company_id, ([], [], []))
+    dates.append(s.date)
+    prices.append(s.close_price)
+    changes.append(s.change)
+  histories = Stock_History.objects.in_bulk(list(appended))
+  with transaction.atomic():
+    for symbol, (dates, prices, changes) in appended.items():
+      history = histories.get(symbol)
+      if history is None:
+        history = Stock_History(company_id=symbol)
+        history.set_history(dates, prices, changes)
+      else:
+        history.append_history(dates, prices, changes)
+      history.save()
+  return len(appended)
+
+def entries():
+  ''' Retreives all stock entries from the stock histories.
+
+  :returns: A 4-tuple containing the symbols, dates (datetime64), close prices and changes (numpy arrays, one entry per stock).
+  '''
+  symbols, dates, prices, changes = [], [], [], []
+  for history in Stock_History.objects.all().iterator():
+    history_dates = history.get_dates()
+    symbols.append(np.repeat(np.array([history.company_id]), len(history_dates)))
+    dates.append(history_dates)
+    prices.append(history.get_close_prices())
+    changes.append(history.get_changes())
+  if not symbols:
+    return np.array([], dtype=str), np.array([], dtype='datetime64[D]'), np.array([]), np.array([])
+  return np.concatenate(symbols), np.concatenate(dates), np.concatenate(prices), np.concatenate(changes)
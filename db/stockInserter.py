@@ -1,33 +1,94 @@
 from vola.models import Company, Stock
+from db import stockPanel, stockHistory
+from vola import resultCache
+from scraper import quoteFetcher
 from decimal import Decimal
 from datetime import datetime
+import numpy as np
 import os
 
 '''This modules provides functions to insert and log stock objects.'''
 
 directory = os.path.join(os.path.abspath(os.path.dirname(__file__)), "textfiles/")
 log = os.path.join(directory, "log.txt")
+WRITE_CHUNK = 5000 #stocks inserted per bulk query
 
-def create_stock_objects(hist_prices, c):
-  bulklist = []
-  prices_asc = hist_prices[::-1] # reverse order (start date -> end date)
-  prev_adj_close = Decimal(prices_asc[0][6]) #closing price earliest date (non inclusive)
-  # skip last entry: [Date, Open, High, Low, Close, Volume, Adj Close]
-  for i,day_data in enumerate(prices_asc[1:-1]):
-    close_price = Decimal(day_data[6])
-    if prev_adj_close == 0:
-      change = close_price
-    else:
-      change = Decimal(((close_price - prev_adj_close)*100) / prev_adj_close)
-    date = datetime.strptime(day_data[0], '%Y-%m-%d').date()
-    bulklist.append(Stock(company=c, close_price=close_price, change=change, date=date))
-    prev_adj_close = close_price
-  return bulklist
+def create_stock_objects(content, c):
+  return [Stock(company=c, close_price=close_price, change=change, date=date) for date, close_price, change in create_stock_values(content)]
 
-def insert_and_log_stocks(bulklist, total_symbols, start_date, end_date, not_added):
+def create_stock_values(content):
+  ''' Calculates the stock values of historical prices, i.e. rows ready for bulk insert or a compact alternative to stock objects.
+
+  :param content: A CSV table (bytes) ordered by date descending with a header row (see ystockquote.get_historical_csv).
+
+  :returns: A list of triples containing the date, close price (Decimal) and change (float) ordered by date.
+  '''
+  dates, close_prices, changes = parse_stock_values(content)
+  return list(zip(dates.tolist(), [Decimal(p.decode('ascii')) for p in close_prices], changes.tolist()))
+
+def parse_stock_values(content):
+  ''' Parses the stock values of historical prices column-wise, i.e. without parsing each day separately.
+  The earliest date only provides the previous close price of the first change and is omitted.
+
+  :param content: A CSV table (bytes) ordered by date descending with a header row (see ystockquote.get_historical_csv).
+
+  :returns: A triple of numpy arrays ordered by date: the dates (datetime64), close prices (bytes, as in the CSV table) and changes (%).
+  '''
+  days = np.array(content.splitlines()[:0:-1]) # reverse order (start date -> end date), skip header
+  if len(days) < 2:
+    return np.array([], dtype='datetime64[D]'), np.array([], dtype='S1'), np.array([])
+  # [Date, Open, High, Low, Close, Volume, Adj Close]
+  dates = days.astype('S10').astype('datetime64[D]')
+  close_prices = np.char.rpartition(days, b',')[:, 2]
+  prices = close_prices.astype(np.float64)
+  prev_prices = prices[:-1]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    changes = np.where(prev_prices == 0, prices[1:], np.diff(prices) * 100 / prev_prices) #close price if no previous price
+  return dates[1:], close_prices[1:], changes
+
+def bulk_insert(bulklist):
+  ''' Inserts stock objects and appends them to the stock histories if in use (see stockHistory.append). '''
   Stock.objects.bulk_create(bulklist)
-  obj_inserted = len(bulklist)
+  if stockHistory.enabled():
+    stockHistory.append(bulklist)
+
+def insert_stocks(jobs, not_added):
+  ''' Retrieves historical prices of many companies concurrently and inserts their stocks in chunks as the prices arrive,
+  i.e. without holding the stock objects of all companies.
+
+  :param jobs: A list of triples containing the ticker symbol, start date and end date (see quoteFetcher.get_historical_prices).
+  :param not_added: A list to extend with the symbols without historical prices.
+
+  :returns: A pair containing the number of stocks inserted and the set of symbols inserted.
+  '''
+  inserted, symbols, bulklist = 0, set(), []
+  for symbol, content in quoteFetcher.get_historical_csv(jobs):
+    if not content: #http error / no stock hist for specified dates
+      not_added.append(symbol)
+      continue
+    symbols.add(symbol)
+    bulklist.extend(Stock(company_id=symbol, close_price=close_price, change=change, date=date) for date, close_price, change in create_stock_values(content))
+    if len(bulklist) >= WRITE_CHUNK:
+      bulk_insert(bulklist)
+      inserted += len(bulklist)
+      bulklist = []
+  bulk_insert(bulklist)
+  return inserted + len(bulklist), symbols
+
+def insert_and_log_stocks(bulklist, total_symbols, start_date, end_date, not_added):
+  bulk_insert(bulklist)
+  refresh_and_log_stocks(set(s.company_id for s in bulklist), len(bulklist), total_symbols, start_date, end_date, not_added)
+
+def refresh_and_log_stocks(symbols, obj_inserted, total_symbols, start_date, end_date, not_added):
+  ''' Refreshes the stock panel, invalidates cached results and logs stocks already inserted, e.g. in chunks while streaming pool results.
+
+  :param symbols: A set of ticker symbols whose stocks were inserted (see bulk_insert).
+  :param obj_inserted: An integer indicating the number of stocks inserted.
+  '''
+  stockPanel.refresh(symbols, appended=True) #rebuilt with new stocks on next access
+  resultCache.invalidate() #cached results were calculated without the new stocks
   logfile = open(log, 'a')
   logfile.write(
     "\n\nDate: {0}\nInserted historical stocks from {1} to {2}\nTotal Stocks Added: {3}\nTotal Entries: {4}\nNot added: {5}".format(
-    datetime.now(),start_date, end_date, total_symbols, obj_inserted, not_added))
\ No newline at end of file
+    datetime.now(),start_date, end_date, total_symbols, obj_inserted, not_added))
+  logfile.close()
@@ -0,0 +1,230 @@
+from vola.models import Stock
+from db import stockHistory
+from django.conf import settings
+from django.db import connection
+import numpy as np
+import threading, time, os
+
+'''
+This module provides a process-wide, in-memory stock panel.
+
+->One dense matrix (dates x companies) per stock value, i.e. close_price and change.
+->Missing stock entries are stored as NaN.
+->Built once from the Stock table and sliced with index arithmetic afterwards.
+->Optionally written to a memory-mapped snapshot (.npy files) shared by all web and pool workers.
+'''
+
+VALUES = ('close_price', 'change')
+SNAPSHOT_FILES = ('dates', 'symbols') + VALUES
+SNAPSHOT_CHECK_INTERVAL = 1. #seconds between checks for a new snapshot written by another process
+_lock = threading.RLock()
+_panel = None
+_checked = 0.
+
+def get():
+  ''' Retreives the stock panel, building it from the database if required.
+  A new snapshot written by another process is picked up within SNAPSHOT_CHECK_INTERVAL seconds.
+
+  :returns: A dict containing the sorted dates (numpy datetime64 array), sorted symbols (list), symbol column index (dict) and a matrix of floats for each value.
+  '''
+  global _checked
+  panel = _panel
+  if panel is not None and time.time() - _checked < SNAPSHOT_CHECK_INTERVAL:
+    return panel
+  _checked = time.time()
+  if panel is None or panel['snapshot'] != snapshot_version():
+    with _lock:
+      panel = reload()
+  return panel
+
+def reload(snapshot=True):
+  ''' Reloads the stock panel, memory-mapping the snapshot if available and building it from the database otherwise.
+
+  :param snapshot(optional): A boolean indicating whether or not to use the snapshot.
+
+  :returns: The reloaded stock panel.
+  '''
+  global _panel
+  with _lock:
+    _panel = load_snapshot() if snapshot else None
+    if _panel is None:
+      _panel = build()
+      _panel['snapshot'] = snapshot_version() #do not retry an unreadable snapshot until it is replaced
+    return _panel
+
+def invalidate():
+  ''' Discards the stock panel. It is rebuilt on next access, e.g. after inserting stocks. '''
+  global _panel
+  with _lock:
+    _panel = None
+
+def build():
+  ''' Builds the stock panel from all stock entries in the database, i.e. the Stock rows or the stock histories (see stockHistory).
+
+  :returns: A stock panel (see get).
+  '''
+  if stockHistory.enabled():
+    symbols, dates, prices, changes = stockHistory.entries()
+  else:
+    entries = Stock.objects.values_list('company_id', 'date', *VALUES)
+    symbols, dates, prices, changes = [], [], [], []
+    for symbol, date, close_price, change in entries:
+      symbols.append(symbol)
+      dates.append(date)
+      prices.append(close_price)
+      changes.append(change)
+  all_dates, rows = np.unique(np.array(dates, dtype='datetime64[D]'), return_inverse=True)
+  all_symbols, cols = np.unique(np.array(symbols, dtype=str), return_inverse=True)
+  panel = {'dates': all_dates, 'symbols': all_symbols, 'snapshot': None}
+  for value, values in zip(VALUES, (prices, changes)):
+    m = np.full((len(all_dates), len(all_symbols)), np.nan, dtype=np.float32)
+    m[rows, cols] = np.array(values, dtype=np.float32)
+    panel[value] = m
+  return index(panel)
+
+def index(panel):
+  panel['symbols'] = [str(s) for s in panel['symbols']]
+  panel['index'] = {s: i for i, s in enumerate(panel['symbols'])}
+  return panel
+
+def refresh(symbols=None, appended=False):
+  ''' Invalidates the stock panel after stocks were inserted or removed, rewriting the snapshot if one is in use.
+
+  :param symbols(optional): A list of ticker symbols whose stocks changed. Defaults to all companies.
+  :param appended(optional): A boolean indicating whether or not the changes were inserted stocks already appended to the stock histories
+  (see stockInserter.bulk_insert), otherwise the histories are rebuilt from Stock rows.
+  '''
+  if stockHistory.enabled() and not appended:
+    stockHistory.rebuild(symbols)
+  with _lock:
+    invalidate()
+    if snapshot_version() is not None:
+      write_snapshot()
+
+def snapshot_directory():
+  ''' Retreives the snapshot directory (settings.STOCK_PANEL_SNAPSHOT).
+
+  :returns: A directory path or None if snapshots are disabled or the database is in memory (e.g. when testing).
+  '''
+  name = str(connection.settings_dict['NAME'])
+  if name == ':memory:' or 'mode=memory' in name:
+    return None
+  return getattr(settings, 'STOCK_PANEL_SNAPSHOT', None)
+
+def snapshot_version(directory=None):
+  ''' Retreives the version of the current snapshot, i.e. the modification time of its pointer file.
+
+  :param directory(optional): A snapshot directory. Defaults to snapshot_directory().
+
+  :returns: A float or None if no snapshot is available.
+  '''
+  directory = directory or snapshot_directory()
+  if directory is None:
+    return None
+  try:
+    return os.stat(os.path.join(directory, 'current')).st_mtime
+  except OSError:
+    return None
+
+def write_snapshot(directory=None):
+  ''' Writes the full stock history to a new snapshot: the date index, symbol index, price matrix and change matrix.
+  The pointer file is replaced last, so readers never see a partially written snapshot.
+  The previous generation is kept for workers still mapping or loading it, older generations are removed.
+
+  :param directory(optional): A snapshot directory. Defaults to snapshot_directory().
+
+  :returns: The snapshot directory or None if snapshots are disabled.
+  '''
+  directory = directory or snapshot_directory()
+  if directory is None:
+    return None
+  panel = build()
+  if not os.path.isdir(directory):
+    os.makedirs(directory)
+  generation = str(int(time.time() * 1e6)) #never overwrite files mapped by other workers
+  for name in SNAPSHOT_FILES:
+    np.save(os.path.join(directory, generation + '.' + name + '.npy'), np.asarray(panel[name]))
+  previous = current_generation(directory)
+  pointer = os.path.join(directory, 'current')
+  with open(pointer + '.tmp', 'w') as f:
+    f.write(generation)
+  os.replace(pointer + '.tmp', pointer)
+  keep = tuple(g + '.' for g in (generation, previous) if g is not None)
+  for filename in os.listdir(directory):
+    if filename.endswith('.npy') and not filename.startswith(keep):
+      os.remove(os.path.join(directory, filename))
+  return directory
+
+def current_generation(directory):
+  ''' :returns: The generation the pointer file of the given snapshot directory refers to or None if there is none. '''
+  try:
+    with open(os.path.join(directory, 'current')) as f:
+      return f.read().strip()
+  except (IOError, OSError):
+    return None
+
+def load_snapshot(directory=None):
+  ''' Memory-maps the current snapshot. Pages are shared through the page cache by all processes mapping it.
+
+  :param directory(optional): A snapshot directory. Defaults to snapshot_directory().
+
+  :returns: A stock panel or None if no snapshot is available.
+  '''
+  directory = directory or snapshot_directory()
+  version = snapshot_version(directory)
+  generation = current_generation(directory) if version is not None else None
+  if generation is None:
+    return None
+  path = lambda name: os.path.join(directory, generation + '.' + name + '.npy')
+  try:
+    panel = {'snapshot': version, 'dates': np.load(path('dates')), 'symbols': np.load(path('symbols'))}
+    for value in VALUES:
+      panel[value] = np.load(path(value), mmap_mode='r')
+  except (IOError, OSError): #replaced while loading
+    return None
+  return index(panel)
+
+def rows(panel, start, end):
+  ''' Translates a period into panel rows.
+
+  :param panel: A stock panel.
+  :param start: A date object indicating the start of the period (inclusive).
+  :param end: A date object indicating the end of the period (inclusive).
+
+  :returns: A slice of panel rows.
+  '''
+  dates = panel['dates']
+  first = np.searchsorted(dates, np.datetime64(start, 'D'), side='left')
+  last = np.searchsorted(dates, np.datetime64(end, 'D'), side='right')
+  return slice(first, max(first, last))
+
+def columns(panel, symbols):
+  ''' Translates symbols into panel columns.
+
+  :param panel: A stock panel.
+  :param symbols: A list of ticker symbols.
+
+  :returns: A numpy integer array of panel columns or None if any symbol has no stock entries.
+  '''
+  index = panel['index']
+  if not all(s in index for s in symbols):
+    return None
+  return np.array([index[s] for s in symbols], dtype=np.intp)
+
+def series(symbol, start, end, value):
+  ''' Retreives the available entries of a single symbol for the given period and value.
+
+  :param symbol: A ticker symbol.
+  :param start: A date object indicating the start of the period.
+  :param end: A date object indicating the end of the period.
+  :param value: A string indicating the value to retrieve, e.g. close_price.
+
+  :returns: A numpy array of floats ordered by date.
+  '''
+  panel = get()
+  col = panel['index'].get(symbol)
+  if col is None:
+    return np.array([], dtype=np.float32)
+  r = rows(panel, start, end)
+  available = ~np.isnan(panel['close_price'][r, col])
+  return panel[value][r, col][available]
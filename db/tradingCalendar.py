@@ -0,0 +1,68 @@
+from db import stockPanel
+import numpy as np
+import threading
+
+'''
+This module provides the trading calendar, i.e. the dates on which the majority of listed companies have stocks.
+
+->Derived from the stock panel, so it is rebuilt whenever stocks are inserted or removed (see stockPanel.refresh).
+->Trading dates are kept in a sorted array, periods translate into calendar offsets by binary search.
+'''
+
+_lock = threading.RLock()
+_calendar = None
+
+def get():
+  ''' Retreives the trading calendar, building it from the stock panel if required.
+
+  :returns: A dict containing the stock panel, a boolean per panel date indicating trading dates and the sorted trading dates (numpy datetime64 array).
+  '''
+  global _calendar
+  panel = stockPanel.get()
+  calendar = _calendar
+  if calendar is None or calendar['panel'] is not panel:
+    with _lock:
+      calendar = _calendar = build(panel)
+  return calendar
+
+def build(panel):
+  ''' Builds the trading calendar. A company is listed from its first to its last stock entry.
+
+  :param panel: A stock panel.
+
+  :returns: A trading calendar (see get).
+  '''
+  available = ~np.isnan(panel['close_price'])
+  num_dates = len(panel['dates'])
+  companies = available.sum(axis=1)
+  listed = available.any(axis=0)
+  first = np.argmax(available, axis=0)[listed]
+  last = num_dates - np.argmax(available[::-1], axis=0)[listed]
+  listings = np.cumsum(np.bincount(first, minlength=num_dates + 1) - np.bincount(last, minlength=num_dates + 1))[:num_dates]
+  trading = 2 * companies > listings #majority of listed companies
+  return {'panel': panel, 'trading': trading, 'dates': panel['dates'][trading]}
+
+def offsets(start, end, calendar=None):
+  ''' Translates a period into trading calendar offsets.
+
+  :param start: A date object indicating the start of the period (inclusive).
+  :param end: A date object indicating the end of the period (inclusive).
+  :param calendar(optional): A trading calendar. Defaults to the current one.
+
+  :returns: A slice of trading dates.
+  '''
+  dates = (calendar or get())['dates']
+  first = np.searchsorted(dates, np.datetime64(start, 'D'), side='left')
+  last = np.searchsorted(dates, np.datetime64(end, 'D'), side='right')
+  return slice(first, max(first, last))
+
+def dates(start, end):
+  ''' Retreives the trading dates for the given period.
+
+  :param start: A date object indicating the start of the period (inclusive).
+  :param end: A date object indicating the end of the period (inclusive).
+
+  :returns: A numpy datetime64 array of trading dates.
+  '''
+  calendar = get()
+  return calendar['dates'][offsets(start, end, calendar)]
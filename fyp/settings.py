@@ -84,6 +84,28 @@ DATABASES = {
     }
 }
 
+# Memory-mapped stock panel shared by all workers (see db.stockPanel.write_snapshot)
+STOCK_PANEL_SNAPSHOT = os.path.join(BASE_DIR, 'db', 'snapshot')
+
+# Storage the stock panel is built from: 'rows' (Stock table) or 'history' (packed Stock_History, see db.stockHistory)
+STOCK_STORAGE = 'rows'
+
+# Solver of stored portfolios: 'std' (SLSQP on daily changes), 'cov' (covariance with exact gradient) or 'qp' (active-set, see vola.minimizer)
+MINIMIZE_METHOD = 'std'
+
+# Custom view result cache per worker (see vola.resultCache), invalidated in all workers through the version file
+RESULT_CACHE_SIZE = 256
+RESULT_CACHE_VERSION = os.path.join(BASE_DIR, 'db', 'snapshot', 'results.version')
+
+# Custom view past performances calculated in the background and polled (see vola.performanceJobs), False to calculate them synchronously
+PERFORMANCE_JOBS = True
+
+# Days stored past performances of requested investments outside the grid (vola.portfolioCalculator.INVESTMENTS) are kept before being pruned
+PLOT_EXPIRY_DAYS = 30
+
+# Maximum number of dates per stored performance plot, downsampled with LTTB (0 for full resolution)
+PLOT_POINTS = 600
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/1.8/topics/i18n/
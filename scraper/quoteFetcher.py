@@ -0,0 +1,223 @@
+from scraper import ystockquote
+from urllib.parse import urlsplit
+import asyncio, queue, threading
+
+'''
+This module provides an asynchronous API for retrieving historical prices of many companies from Yahoo Finance.
+
+->Requests overlap on a single event loop rather than one process per company.
+->The event loop runs in a background thread and tables are yielded as soon as they arrive,
+  so callers can write them to the database while the remaining requests are downloading.
+->Connections are kept alive and reused by subsequent requests to the same host (see ConnectionPool).
+->Concurrent requests are bounded per host and their rate is limited by a token bucket (see TokenBucket),
+  avoiding Yahoo blocking the connection (suspected ddos).
+->Connection errors, timeouts and 429/5xx responses are retried with exponential backoff.
+'''
+
+CONCURRENCY = 8 #connections per host
+RATE = 10. #requests per second
+BURST = 10 #requests
+RETRIES = 3
+BACKOFF = .5 #seconds before the first retry, doubled per retry
+TIMEOUT = 30. #seconds per request
+PORTS = {'http': 80, 'https': 443} #supported schemes and their default ports
+
+def get_historical_prices(jobs, base_url=ystockquote.HISTORICAL_PRICES_URL, concurrency=CONCURRENCY, rate=RATE, retries=RETRIES, backoff=BACKOFF):
+    """ Get historical prices for many ticker symbols (see ystockquote.get_historical_prices).
+
+    :params jobs: A list of triples containing the ticker symbol, start date and end date (str, format 'YYYYMMDD').
+    :params base_url: Url (http or https) of the CSV table, e.g. of a local stand-in when testing.
+    :params concurrency: Maximum number of concurrent requests (and connections) per host.
+    :params rate: Maximum number of requests per second.
+    :params retries: Maximum number of retries per request.
+    :params backoff: Seconds to wait before the first retry, doubled per retry.
+
+    :returns: A generator of pairs containing the ticker symbol and a nested list of historical prices (empty if not available),
+    in order of completion.
+    """
+    for symbol, content in get_historical_csv(jobs, base_url, concurrency, rate, retries, backoff):
+        yield symbol, ystockquote.parse_historical_prices(content)
+
+def get_historical_csv(jobs, base_url=ystockquote.HISTORICAL_PRICES_URL, concurrency=CONCURRENCY, rate=RATE, retries=RETRIES, backoff=BACKOFF):
+    """ Get historical prices for many ticker symbols as raw CSV tables (see get_historical_prices).
+    Requests keep downloading in the background while the caller processes the tables already yielded.
+
+    :returns: A generator of pairs containing the ticker symbol and the CSV table (bytes, empty if not available), in order of completion.
+    """
+    urls = [urlsplit(ystockquote.historical_prices_url(symbol, start_date, end_date, base_url)) for symbol, start_date, end_date in jobs]
+    for url in urls:
+        if url.scheme not in PORTS:
+            raise ValueError('Unsupported scheme: ' + url.scheme)
+    fetcher = FetchThread([(job[0], url) for job, url in zip(jobs, urls)], concurrency, rate, retries, backoff)
+    fetcher.start()
+    try:
+        for _ in jobs:
+            result = fetcher.results.get()
+            if isinstance(result, Exception):
+                raise result
+            yield result
+    finally:
+        fetcher.cancel()
+        fetcher.join()
+
+class FetchThread(threading.Thread):
+    """
+    Runs an event loop fetching CSV tables, putting each pair of ticker symbol and table on results as soon as it arrives
+    (or the exception ending the loop).
+    """
+    def __init__(self, requests, concurrency, rate, retries, backoff):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.results = queue.Queue()
+        self.loop = asyncio.new_event_loop()
+        self.task = self.loop.create_task(fetch_all(requests, concurrency, rate, retries, backoff, self.results.put))
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError: #caller stopped early
+            pass
+        except Exception as e:
+            self.results.put(e)
+        finally:
+            self.loop.close()
+
+    def cancel(self):
+        ''' Cancels the remaining requests, e.g. if the caller stopped early. '''
+        try:
+            self.loop.call_soon_threadsafe(self.task.cancel)
+        except RuntimeError: #loop already closed
+            pass
+
+async def fetch_all(requests, concurrency, rate, retries, backoff, done):
+    bucket = TokenBucket(rate, BURST)
+    pools = {}
+    fetches = []
+    for symbol, url in requests:
+        pool = pools.get((url.scheme, url.netloc))
+        if pool is None:
+            pool = pools[(url.scheme, url.netloc)] = ConnectionPool(url.hostname, url.port or PORTS[url.scheme], concurrency, url.scheme == 'https')
+        fetches.append(fetch_symbol(symbol, pool, bucket, url.path + '?' + url.query, retries, backoff, done))
+    try:
+        await asyncio.gather(*fetches)
+    finally:
+        for pool in pools.values():
+            pool.close()
+
+async def fetch_symbol(symbol, pool, bucket, path, retries, backoff, done):
+    done((symbol, await fetch(pool, bucket, path, retries, backoff)))
+
+async def fetch(pool, bucket, path, retries, backoff):
+    """ Get a CSV table, retrying failed requests.
+
+    :returns: The CSV table (bytes), empty if not available (e.g. symbol not available or retries exhausted).
+    """
+    for attempt in range(retries + 1):
+        await bucket.acquire()
+        try:
+            status, body = await pool.get(path)
+        except (OSError, EOFError, ValueError, asyncio.TimeoutError): #connection closed or malformed response
+            status, body = None, b''
+        if status == 200:
+            return body
+        if status is not None and status != 429 and status < 500: #symbol not available
+            return b''
+        if attempt < retries:
+            await asyncio.sleep(backoff * 2 ** attempt)
+    return b''
+
+class TokenBucket(object):
+    """
+    Limits the rate of requests to rate per second, allowing bursts of up to capacity requests.
+    """
+    def __init__(self, rate, capacity):
+        self.rate, self.capacity = rate, capacity
+        self.tokens, self.updated = capacity, None
+
+    async def acquire(self):
+        ''' Waits until a token is available and takes it. '''
+        loop = asyncio.get_event_loop()
+        while True:
+            now = loop.time()
+            if self.updated is not None:
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class ConnectionPool(object):
+    """
+    Keep-alive HTTP/1.1 connections (TLS if ssl) to a single host, reused by subsequent requests.
+    At most size requests are sent concurrently, so at most size connections are open.
+    """
+    def __init__(self, host, port, size, ssl=False):
+        self.host, self.port, self.ssl = host, port, ssl
+        self.slots = asyncio.Semaphore(size)
+        self.idle = []
+
+    async def get(self, path):
+        ''' Sends a GET request on an idle connection or a new one if none is idle.
+
+        :returns: A pair containing the response status (int) and body (bytes).
+        '''
+        async with self.slots:
+            if self.idle:
+                reader, writer = self.idle.pop()
+            else:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port, ssl=self.ssl), TIMEOUT)
+            try:
+                status, headers, body = await asyncio.wait_for(self.exchange(reader, writer, path), TIMEOUT)
+            except BaseException:
+                writer.close()
+                raise
+            if headers.get('connection', '').lower() == 'close':
+                writer.close()
+            else:
+                self.idle.append((reader, writer))
+            return status, body
+
+    async def exchange(self, reader, writer, path):
+        host = self.host if self.port == PORTS['https' if self.ssl else 'http'] else '{0}:{1}'.format(self.host, self.port)
+        writer.write('GET {0} HTTP/1.1\r\nHost: {1}\r\nConnection: keep-alive\r\n\r\n'.format(path, host).encode('latin-1'))
+        status_line = await reader.readline()
+        if not status_line: #idle connection closed by the server
+            raise ConnectionError('Connection closed')
+        parts = status_line.split()
+        if len(parts) < 2 or not parts[0].startswith(b'HTTP/') or not parts[1].isdigit(): #retried on a new connection
+            raise ConnectionError('Malformed status line: {0!r}'.format(status_line[:100]))
+        status = int(parts[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = await read_chunked(reader)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else: #body delimited by closing the connection
+            body = await reader.read()
+            headers['connection'] = 'close'
+        return status, headers, body
+
+    def close(self):
+        ''' Closes all idle connections. '''
+        for reader, writer in self.idle:
+            writer.close()
+        self.idle = []
+
+async def read_chunked(reader):
+    chunks = []
+    while True:
+        size = int((await reader.readline()).split(b';')[0], 16)
+        if size == 0:
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''): #trailers
+                pass
+            return b''.join(chunks)
+        chunks.append(await reader.readexactly(size))
+        await reader.readline()
@@ -5,6 +5,7 @@ from http.cookiejar import CookieJar
 opener=request.URLopener()
 cj = CookieJar()
 price_opener = request.build_opener(request.HTTPCookieProcessor(cj))
+HISTORICAL_PRICES_URL = 'http://ichart.yahoo.com/table.csv'
 
 '''
 This module provides an API for retrieving stock data from Yahoo Finance.
@@ -19,7 +20,29 @@ def get_historical_prices(symbol, start_date, end_date):
    
     :returns: A nested list of historical prices.
     """
-    url = 'http://ichart.yahoo.com/table.csv?s=%s&' % symbol + \
+    return parse_historical_prices(get_historical_csv(symbol, start_date, end_date))
+
+def get_historical_csv(symbol, start_date, end_date):
+    """ Get historical prices for the given ticker symbol as the raw CSV table (see get_historical_prices).
+
+    :returns: CSV table (bytes), ordered by date descending with a header row. Empty if not available.
+    """
+    url = historical_prices_url(symbol, start_date, end_date)
+    try:
+        return opener.open(url).read()
+    except error.HTTPError: #symbol not available
+        return b''
+    except OSError: #yahoo block connection (suspected ddos)
+        return b''
+
+def historical_prices_url(symbol, start_date, end_date, base_url=HISTORICAL_PRICES_URL):
+    """ Get the historical prices url for the given ticker symbol (see get_historical_prices).
+
+    :params base_url: Url of the CSV table, e.g. of a local stand-in when testing.
+
+    :returns: A url (str).
+    """
+    return base_url + '?s=%s&' % symbol + \
           'd=%s&' % (int(str(end_date)[4:6]) - 1) + \
           'e=%s&' % (int(str(end_date)[6:8])) + \
           'f=%s&' % (int(str(end_date)[0:4])) + \
@@ -28,14 +51,15 @@ def get_historical_prices(symbol, start_date, end_date):
           'b=%s&' % (int(str(start_date)[6:8])) + \
           'c=%s&' % (int(str(start_date)[0:4])) + \
           'ignore=.csv'
-    try:
-        days = opener.open(url).readlines()
-    except error.HTTPError: #symbol not available
-        return []
-    except OSError: #yahoo block connection (suspected ddos)
-        return []
-    data = [day[:-1].decode('utf-8').split(',') for day in days]
-    return data
+
+def parse_historical_prices(content):
+    """ Parse historical prices from the CSV table.
+
+    :params content: CSV table (bytes).
+
+    :returns: A nested list of historical prices.
+    """
+    return [day.split(',') for day in content.decode('utf-8').splitlines()]
 
 def get_price(symbol):
     ''' Retreives current price for given symbol from Yahoo Finance.
@@ -19,6 +19,13 @@ def update_all_stock_data(ModelAdmin, request, queryset):
 	else:
 		messages.success(request, "Updated all stock data. Inserted {0} daily prices for {1} companies. See log file for more details.".format(total_data, companies))
 
+def update_stock_snapshot(ModelAdmin, request, queryset):
+	directory, dates = db.update_stock_panel_snapshot()
+	if directory is None:
+		messages.error(request, "Stock snapshots are disabled (see STOCK_PANEL_SNAPSHOT setting).")
+	else:
+		messages.success(request, "Wrote stock snapshot with {0} trading dates to {1}.".format(dates, directory))
+
 def update_current_SNP500_constituents(ModelAdmin, request, queryset):
 	snp = queryset[0]
 	if not (len(queryset) == 1 and snp.year==0):
@@ -61,7 +68,7 @@ def update_plots_and_statistics(ModelAdmin, request, queryset):
 class CompanyAdmin(admin.ModelAdmin):
 	list_display = ['symbol', 'name']
 	ordering = ['symbol']
-	actions = [update_recent_SNP500_stock_data, update_all_stock_data]
+	actions = [update_recent_SNP500_stock_data, update_all_stock_data, update_stock_snapshot]
 
 class SNP500Admin(admin.ModelAdmin):
 	list_display = ['readable']
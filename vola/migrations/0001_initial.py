@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Company',
+            fields=[
+                ('symbol', models.CharField(max_length=10, serialize=False, primary_key=True)),
+                ('name', models.CharField(max_length=100)),
+                ('sector', models.CharField(max_length=100)),
+                ('sub_industry', models.CharField(max_length=100)),
+                ('hq_address', models.CharField(max_length=100, verbose_name='Address of Headquarters')),
+            ],
+            options={
+                'verbose_name': 'Company',
+                'verbose_name_plural': 'Companies',
+            },
+        ),
+        migrations.CreateModel(
+            name='Past_Portfolio',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('start_date', models.DateField()),
+                ('allocations_field', models.TextField(editable=False)),
+                ('symbols_field', models.TextField(editable=False)),
+            ],
+            options={
+                'get_latest_by': 'start_date',
+            },
+        ),
+        migrations.CreateModel(
+            name='Past_Statistics',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('vol', models.DecimalField(max_digits=6, decimal_places=4, verbose_name='Volatility')),
+                ('ret', models.DecimalField(max_digits=6, decimal_places=4, verbose_name='Return')),
+                ('snp_vol', models.DecimalField(max_digits=6, decimal_places=4, verbose_name='SNP500 Volatility')),
+                ('snp_ret', models.DecimalField(max_digits=6, decimal_places=4, verbose_name='SNP500 Return')),
+                ('snp_lv_vol', models.DecimalField(max_digits=6, decimal_places=4, verbose_name='SNP500LV Volatility')),
+                ('snp_lv_ret', models.DecimalField(max_digits=6, decimal_places=4, verbose_name='SNP500LV Return')),
+                ('sharpe_ratio', models.DecimalField(max_digits=6, decimal_places=4)),
+                ('past_portfolio', models.ForeignKey(to='vola.Past_Portfolio')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Plot',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('investment', models.IntegerField(default=0)),
+                ('html', models.TextField(null=True)),
+                ('date_calculated', models.DateField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Portfolio',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('title', models.CharField(max_length=30)),
+                ('spread', models.IntegerField(verbose_name='Minimum Spread')),
+                ('period', models.IntegerField(verbose_name='Minimisation Period')),
+                ('lv', models.BooleanField(verbose_name='Low Volatility Stocks Only')),
+                ('vol', models.DecimalField(max_digits=6, decimal_places=4, verbose_name='Minimised Volatility')),
+                ('allocations_field', models.TextField(editable=False)),
+                ('symbols_field', models.TextField(editable=False)),
+                ('date_calculated', models.DateField(auto_now=True)),
+                ('suggested', models.BooleanField(default=False)),
+            ],
+            options={
+                'verbose_name': 'Portfolio',
+            },
+        ),
+        migrations.CreateModel(
+            name='SNP500',
+            fields=[
+                ('year', models.IntegerField(serialize=False, primary_key=True)),
+                ('companies', models.ManyToManyField(to='vola.Company')),
+            ],
+            options={
+                'verbose_name': 'SNP500',
+                'get_latest_by': 'year',
+            },
+        ),
+        migrations.CreateModel(
+            name='Stock',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('close_price', models.DecimalField(max_digits=12, decimal_places=2)),
+                ('change', models.DecimalField(max_digits=20, decimal_places=12)),
+                ('date', models.DateField()),
+                ('company', models.ForeignKey(to='vola.Company')),
+            ],
+            options={
+                'verbose_name': 'Stock',
+                'get_latest_by': 'date',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='portfolio',
+            unique_together=set([('title', 'spread', 'period', 'lv')]),
+        ),
+        migrations.AddField(
+            model_name='plot',
+            name='portfolio',
+            field=models.ForeignKey(to='vola.Portfolio'),
+        ),
+        migrations.AddField(
+            model_name='past_statistics',
+            name='plot',
+            field=models.ForeignKey(to='vola.Plot'),
+        ),
+        migrations.AddField(
+            model_name='past_portfolio',
+            name='portfolio',
+            field=models.ForeignKey(to='vola.Portfolio'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='stock',
+            unique_together=set([('company', 'date')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='plot',
+            unique_together=set([('portfolio', 'investment')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='past_portfolio',
+            unique_together=set([('portfolio', 'start_date')]),
+        ),
+    ]
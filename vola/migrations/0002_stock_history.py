@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import numpy as np
+
+
+def pack_stock_histories(apps, schema_editor):
+    ''' Packs the existing Stock rows into one Stock_History per company, in the layout of vola.models.pack_history at the time of this migration:
+    dates as int32 days since 1970-01-01, close prices and changes as float64.
+    '''
+    Stock = apps.get_model('vola', 'Stock')
+    Stock_History = apps.get_model('vola', 'Stock_History')
+    entries = Stock.objects.values_list('company_id', 'date', 'close_price', 'change').order_by('company', 'date')
+    packed = {}
+    for symbol, date, close_price, change in entries.iterator():
+        dates, prices, changes = packed.setdefault(symbol, ([], [], []))
+        dates.append(date)
+        prices.append(close_price)
+        changes.append(change)
+    bulklist = []
+    for symbol, (dates, prices, changes) in packed.items():
+        bulklist.append(Stock_History(company_id=symbol,
+            dates=np.array(dates, dtype='datetime64[D]').astype(np.int32).tobytes(),
+            close_prices=np.array(prices, dtype=np.float64).tobytes(),
+            changes=np.array(changes, dtype=np.float64).tobytes()))
+    Stock_History.objects.bulk_create(bulklist, batch_size=100)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vola', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Stock_History',
+            fields=[
+                ('company', models.OneToOneField(serialize=False, primary_key=True, to='vola.Company')),
+                ('dates', models.BinaryField()),
+                ('close_prices', models.BinaryField()),
+                ('changes', models.BinaryField()),
+            ],
+            options={
+                'verbose_name': 'Stock History',
+                'verbose_name_plural': 'Stock Histories',
+            },
+        ),
+        migrations.RunPython(pack_stock_histories, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import numpy as np
+import json
+
+MODELS = ['Portfolio', 'Past_Portfolio']
+
+
+def pack_portfolio_fields(apps, schema_editor):
+    ''' Converts the JSON allocations and symbols into float64 bytes and comma-separated symbols. '''
+    for name in MODELS:
+        model = apps.get_model('vola', name)
+        for obj in model.objects.all().iterator():
+            obj.allocations_packed = np.array(json.loads(obj.allocations_field or '[]'), dtype=np.float64).tobytes()
+            obj.symbols_packed = ','.join(json.loads(obj.symbols_field or '[]')).encode('utf-8')
+            obj.save(update_fields=['allocations_packed', 'symbols_packed'])
+
+
+def unpack_portfolio_fields(apps, schema_editor):
+    for name in MODELS:
+        model = apps.get_model('vola', name)
+        for obj in model.objects.all().iterator():
+            packed = bytes(obj.symbols_packed)
+            obj.allocations_field = json.dumps(np.frombuffer(bytes(obj.allocations_packed), dtype=np.float64).tolist())
+            obj.symbols_field = json.dumps(packed.decode('utf-8').split(',') if packed else [])
+            obj.save(update_fields=['allocations_field', 'symbols_field'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vola', '0002_stock_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='portfolio',
+            name='allocations_packed',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='portfolio',
+            name='symbols_packed',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='past_portfolio',
+            name='allocations_packed',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='past_portfolio',
+            name='symbols_packed',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.RunPython(pack_portfolio_fields, reverse_code=unpack_portfolio_fields),
+        migrations.RemoveField(
+            model_name='portfolio',
+            name='allocations_field',
+        ),
+        migrations.RemoveField(
+            model_name='portfolio',
+            name='symbols_field',
+        ),
+        migrations.RemoveField(
+            model_name='past_portfolio',
+            name='allocations_field',
+        ),
+        migrations.RemoveField(
+            model_name='past_portfolio',
+            name='symbols_field',
+        ),
+        migrations.RenameField(
+            model_name='portfolio',
+            old_name='allocations_packed',
+            new_name='allocations_field',
+        ),
+        migrations.RenameField(
+            model_name='portfolio',
+            old_name='symbols_packed',
+            new_name='symbols_field',
+        ),
+        migrations.RenameField(
+            model_name='past_portfolio',
+            old_name='allocations_packed',
+            new_name='allocations_field',
+        ),
+        migrations.RenameField(
+            model_name='past_portfolio',
+            old_name='symbols_packed',
+            new_name='symbols_field',
+        ),
+    ]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import zlib
+
+
+def compress_plots(apps, schema_editor):
+    ''' Compresses the html of existing plots with zlib. '''
+    Plot = apps.get_model('vola', 'Plot')
+    for plot in Plot.objects.all().iterator():
+        if plot.html is not None:
+            plot.html_packed = zlib.compress(plot.html.encode('utf-8'))
+            plot.save(update_fields=['html_packed'])
+
+
+def decompress_plots(apps, schema_editor):
+    Plot = apps.get_model('vola', 'Plot')
+    for plot in Plot.objects.all().iterator():
+        if plot.html_packed is not None:
+            plot.html = zlib.decompress(bytes(plot.html_packed)).decode('utf-8')
+            plot.save(update_fields=['html'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vola', '0004_packed_portfolio_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plot',
+            name='html_packed',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.RunPython(compress_plots, reverse_code=decompress_plots),
+        migrations.RemoveField(
+            model_name='plot',
+            name='html',
+        ),
+        migrations.RenameField(
+            model_name='plot',
+            old_name='html_packed',
+            new_name='html_field',
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vola', '0005_compressed_plots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Performance_Job',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('investment', models.IntegerField()),
+                ('status', models.CharField(default='pending', max_length=7)),
+                ('result_field', models.BinaryField(null=True)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, db_index=True)),
+                ('portfolio', models.ForeignKey(to='vola.Portfolio')),
+            ],
+            options={
+                'verbose_name': 'Performance Job',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='performance_job',
+            unique_together=set([('portfolio', 'investment')]),
+        ),
+    ]
@@ -4,7 +4,13 @@ import scipy.optimize as scopt
 
 '''This module provides functions to calculate the optimal shares that minimize the portfolio's volatility.'''
 
-def calculate_portfolio(start, end, min_spread, symbols, investment=None, live_prices=False):
+QP_TOL = 1e-10 #relative to the largest variance
+QP_BOUND_TOL = 1e-12
+QP_STEP_TOL = 1e-14
+QP_KKT_TOL = 1e-6 #relative to the largest variance, accepted at exit before falling back to minimize_cov
+QP_SUM_TOL = 1e-9
+
+def calculate_portfolio(start, end, min_spread, symbols, investment=None, live_prices=False, method='std', info=None):
   ''' Calculates the optimal shares that minimize the portfolio's volatility.
 
   :param start: A date object indicating the start of the period over which the volatility is to be minimised.
@@ -13,23 +19,100 @@ def calculate_portfolio(start, end, min_spread, symbols, investment=None, live_p
   :param symbols: A list of ticker symbols corresponding to the companies availble for minimisation.
   :param investment(optional): A positive integer representing the investment.
   :param live_prices(optional): A boolean indicating that live prices from Yahoo Finance should be used (if end date is today). Otherwise adjusted-close at end date is used.
+  :param method(optional): A string indicating the solver: 'std' (standard deviation of daily returns), 'cov' (variance from the covariance matrix) or 'qp' (dedicated active-set solver).
+  :param info(optional): A dict to update with the solver's iteration count and KKT residual.
 
   :returns: If investment given, a 4-tuple containing the shares(list), symbols(list), prices(list) and volatility(decimal). 
   If investment not given, a triple containing the allocations(list), symbols(list) and volatility(decimal).
   '''
-  changes = dba.get_stock_matrix(start, end, symbols, 'change')
-  allocations = minimize(vol, changes, investment, min_spread)
+  changes, cov, trading_days = get_changes_and_covariance(start, end, symbols, method)
+  allocations, solver_info = solve(changes, min_spread, method, cov=cov)
+  if info is not None:
+    info.update(solver_info)
   allocations = set_effective_zero(allocations)
-  trading_days = len(changes)
   if not investment:
     allocations, symbols, nz = filter_unused(allocations, symbols)
-    min_vol = vol(allocations, changes[:,nz])
+    min_vol = vol_cov(allocations, cov[np.ix_(nz, nz)])
     return allocations, symbols, vol_annualized(min_vol, trading_days)
   shares, prices = get_shares_and_prices(end, symbols, allocations, investment, live_prices)
   shares, symbols, nz = filter_unused(shares, symbols)
-  min_vol = vol_shares(shares, changes[:,nz])
+  min_vol = vol_cov(shares / np.sum(shares), cov[np.ix_(nz, nz)])
   return shares, symbols, prices[nz], round(vol_annualized(min_vol, trading_days), 2)
 
+def calculate_portfolios(start, end, min_spreads, symbols, method='std', info=None, initial=None):
+  ''' Calculates the optimal allocations for several minimum spreads sharing the same period and symbols.
+  The change matrix and its covariance are calculated once. Spreads are solved from the largest (tightest) down,
+  each warm-started from the previous solution, which remains feasible as the maximum investment per company grows.
+
+  :param start: A date object indicating the start of the period over which the volatility is to be minimised.
+  :param end: A date object indicating the end of the period over which the volatility is to be minimised.
+  :param min_spreads: A list of positive integers.
+  :param symbols: A list of ticker symbols corresponding to the companies availble for minimisation.
+  :param method(optional): A string indicating the solver (see calculate_portfolio).
+  :param info(optional): A dict to update with the solver's iteration count and KKT residual for each spread.
+  :param initial(optional): A list of pairs containing the allocations and symbols to warm-start each spread from, e.g. a past portfolio (None for no warm start). Ordered as min_spreads.
+
+  :returns: A list of triples containing the allocations(list), symbols(list) and volatility(decimal), ordered as min_spreads.
+  '''
+  changes, cov, trading_days = get_changes_and_covariance(start, end, symbols, method)
+  initial = dict(zip(min_spreads, initial or []))
+  weights = None
+  portfolios = {}
+  for min_spread in sorted(set(min_spreads), reverse=True):
+    warm_start = initial.get(min_spread)
+    remapped = None if warm_start is None else remap_weights(warm_start[0], warm_start[1], symbols, min_spread)
+    if remapped is not None: #otherwise keep the previous spread's solution
+      weights = remapped
+    weights, solver_info = solve(changes, min_spread, method, weights, cov)
+    solver_info['warm'] = remapped is not None
+    if info is not None:
+      info[min_spread] = solver_info
+    allocations = set_effective_zero(weights.copy())
+    allocations, portfolio_symbols, nz = filter_unused(allocations, symbols)
+    min_vol = vol_cov(allocations, cov[np.ix_(nz, nz)])
+    portfolios[min_spread] = (allocations, portfolio_symbols, vol_annualized(min_vol, trading_days))
+  return [portfolios[min_spread] for min_spread in min_spreads]
+
+def get_changes_and_covariance(start, end, symbols, method):
+  ''' Retreives the daily changes and their covariance for the given period and symbols.
+  Only the 'std' solver minimises over the changes themselves, the others use the rolling covariance (see access.get_covariance).
+
+  :param start: A date object indicating the start of the period over which the volatility is to be minimised.
+  :param end: A date object indicating the end of the period over which the volatility is to be minimised.
+  :param symbols: A list of ticker symbols corresponding to the companies availble for minimisation.
+  :param method: A string indicating the solver (see calculate_portfolio).
+
+  :returns: A triple containing the change matrix (None unless method is 'std'), covariance matrix and number of trading days.
+  '''
+  if method == 'std':
+    changes = dba.get_stock_matrix(start, end, symbols, 'change')
+    return changes, covariance(changes), len(changes)
+  cov, trading_days = dba.get_covariance(start, end, symbols)
+  return None, cov, trading_days
+
+def remap_weights(allocations, symbols, new_symbols, min_spread):
+  ''' Remaps allocations onto new symbols, e.g. a past portfolio onto the companies available a year later.
+
+  :param allocations: A list of allocations corresponding to ticker symbols in the symbols parameter.
+  :param symbols: A list of ticker symbols.
+  :param new_symbols: A list of ticker symbols for the new allocations.
+  :param min_spread: A positive integer.
+
+  :returns: A numpy array of feasible allocations ordered as sorted(new_symbols), or None if too few companies are still available.
+  '''
+  max_investment = 1./min_spread
+  previous = dict(zip(symbols, allocations))
+  weights = np.clip([previous.get(s, 0.) for s in sorted(new_symbols)], 0., max_investment)
+  for _ in range(len(weights)): #reinvest allocations of unavailable companies in the remaining ones, keeping the others at zero
+    deficit = 1. - np.sum(weights)
+    room = (weights > 0) & (weights < max_investment)
+    if deficit <= QP_BOUND_TOL or not np.any(room):
+      break
+    weights[room] = np.minimum(weights[room] * (1. + deficit / np.sum(weights[room])), max_investment)
+  if abs(1. - np.sum(weights)) > QP_BOUND_TOL:
+    return None
+  return weights
+
 def get_shares_and_prices(end, symbols, allocations, investment, live_prices=False):
   ''' Calculates annual statistics for the given period, symbols and shares.
 
@@ -45,11 +128,39 @@ def get_shares_and_prices(end, symbols, allocations, investment, live_prices=Fal
   shares = np.rint((allocations * investment) / prices)
   return shares.astype(int), prices
 
-def minimize(vol, changes, investment, min_spread):
+def minimize(vol, changes, investment, min_spread, method='std'):
+    return solve(changes, min_spread, method, objective=vol)[0]
+
+def solve(changes, min_spread, method='std', weights=None, cov=None, objective=None):
+    ''' Calculates the allocations that minimize the portfolio's volatility with the given solver.
+
+    :param changes: A numpy array of daily changes (days x symbols).
+    :param min_spread: A positive integer.
+    :param method(optional): A string indicating the solver: 'std', 'cov' or 'qp' (see calculate_portfolio).
+    :param weights(optional): A numpy array of initial weights, e.g. a previous solution.
+    :param cov(optional): The covariance matrix of changes if already calculated.
+    :param objective(optional): The objective for the 'std' solver. Defaults to vol.
+
+    :returns: A pair containing the allocations (numpy array) and a dict with the method, iterations and KKT residual.
+    '''
+    if method == 'std':
+        allocations, iterations = minimize_std(objective or vol, changes, min_spread, weights)
+    elif method in ('cov', 'qp'):
+        cov = covariance(changes) if cov is None else cov
+        minimize_method = minimize_cov if method == 'cov' else minimize_qp
+        allocations, iterations = minimize_method(cov, min_spread, weights)
+    else:
+        raise ValueError("Unknown minimisation method: " + str(method))
+    cov = covariance(changes) if cov is None else cov
+    info = {'method': method, 'iterations': iterations, 'kkt_residual': kkt_residual(cov, allocations, 1./min_spread)}
+    return allocations, info
+
+def minimize_std(vol, changes, min_spread, weights=None):
     no_symbols = len(changes[0])
     max_investment = 1./min_spread #in a single company
     bounds = [(0., max_investment) for i in np.arange(no_symbols)] #non-negative weights 
-    weights = np.ones(no_symbols)/no_symbols
+    if weights is None:
+        weights = np.ones(no_symbols)/no_symbols
     constraints = ({'type': 'eq',
                     'fun': lambda weights: np.sum(weights) - 1}) #sum of weights to equal 100%
     results = scopt.minimize(vol, weights, 
@@ -57,11 +168,180 @@ def minimize(vol, changes, investment, min_spread):
                                  constraints = constraints,
                                  bounds = bounds,
                                  args=changes)
-    return np.array(results.x)
+    return np.array(results.x), results.nit
+
+def minimize_cov(cov, min_spread, weights=None):
+    ''' Minimises the portfolio variance (w' cov w) using its exact gradient.
+    Each evaluation is O(symbols^2) rather than O(days x symbols) and no finite differences are needed.
+
+    :param cov: A covariance matrix of daily changes (symbols x symbols).
+    :param min_spread: A positive integer.
+    :param weights(optional): A numpy array of initial weights. Equal weights if not given.
+
+    :returns: A pair containing the allocations (numpy array) and the number of iterations.
+    '''
+    no_symbols = len(cov)
+    max_investment = 1./min_spread #in a single company
+    bounds = [(0., max_investment) for i in np.arange(no_symbols)] #non-negative weights
+    if weights is None:
+        weights = np.ones(no_symbols)/no_symbols
+    constraints = ({'type': 'eq',
+                    'fun': lambda weights: np.sum(weights) - 1,
+                    'jac': lambda weights: np.ones(len(weights))}) #sum of weights to equal 100%
+    results = scopt.minimize(variance, weights,
+                                 jac=variance_gradient,
+                                 method='SLSQP',
+                                 constraints = constraints,
+                                 bounds = bounds,
+                                 args=(cov,),
+                                 options={'ftol': 1e-9, 'maxiter': 1000}) #cheap evaluations, tighter tolerance
+    return np.array(results.x), results.nit
+
+def minimize_qp(cov, min_spread, weights=None, max_iter=None):
+    ''' Minimises the portfolio variance with a primal active-set method specialised for our constraints:
+    fully invested (sum of weights equal to 1) and long-only with a maximum investment per company (0 <= w <= 1/min_spread).
+    Each iteration solves the equality-constrained problem over the free (non-bound) companies only, which are few
+    for minimum volatility portfolios. Starting from the lowest variance companies keeps the free set small throughout.
+
+    :param cov: A covariance matrix of daily changes (symbols x symbols).
+    :param min_spread: A positive integer.
+    :param weights(optional): A numpy array of initial weights, e.g. a previous solution. Projected onto the feasible set.
+    :param max_iter(optional): A positive integer. Defaults to 10 iterations per symbol.
+
+    :returns: A pair containing the allocations (numpy array) and the number of iterations.
+    If the iterations run out, or the allocations do not sum to 1 or violate the KKT conditions at exit,
+    minimize_cov is run from them and its iterations are added.
+    '''
+    no_symbols = len(cov)
+    max_investment = 1./min_spread #in a single company
+    scale = max(np.max(np.diag(cov)), np.finfo(float).tiny)
+    tol = QP_TOL * scale
+    if weights is None:
+        weights = lowest_variance_weights(cov, max_investment)
+    weights = project_weights(weights, max_investment)
+    status = np.zeros(no_symbols, dtype=np.int8) #-1 at lower bound, 0 free, 1 at upper bound
+    status[weights <= QP_BOUND_TOL] = -1
+    status[weights >= max_investment - QP_BOUND_TOL] = 1
+    weights[status == -1], weights[status == 1] = 0., max_investment
+    max_iter = max_iter or 10 * no_symbols
+    iteration = 0
+    for iteration in range(1, max_iter + 1):
+        gradient = cov.dot(weights)
+        free = np.flatnonzero(status == 0)
+        if len(free):
+            step, nu = qp_step(cov, gradient, free)
+            if np.max(np.abs(step)) > QP_STEP_TOL:
+                ratios = np.full(len(free), np.inf)
+                dec, inc = step < 0, step > 0
+                ratios[dec] = -weights[free][dec] / step[dec]
+                ratios[inc] = (max_investment - weights[free][inc]) / step[inc]
+                j = np.argmin(ratios)
+                weights[free] += min(1., ratios[j]) * step
+                if ratios[j] < 1.: #blocking bound joins the active set
+                    status[free[j]] = -1 if step[j] < 0 else 1
+                    weights[free[j]] = 0. if step[j] < 0 else max_investment
+                continue
+            lagrange = -nu #equal marginal variance of all free companies
+        else:
+            lower, upper = gradient[status == -1], gradient[status == 1]
+            if not len(lower) or not len(upper) or np.max(upper) <= np.min(lower) + tol:
+                break
+            lagrange = np.max(upper)
+        multipliers = np.zeros(no_symbols)
+        multipliers[status == -1] = gradient[status == -1] - lagrange
+        multipliers[status == 1] = lagrange - gradient[status == 1]
+        i = np.argmin(multipliers)
+        if multipliers[i] >= -tol: #optimal
+            break
+        status[i] = 0 #release the most violated bound
+    else: #iterations ran out, not optimal
+        iteration = max_iter + 1
+    weights = np.clip(weights, 0., max_investment)
+    if iteration > max_iter or abs(np.sum(weights) - 1.) > QP_SUM_TOL or kkt_residual(cov, weights, max_investment) > QP_KKT_TOL * scale:
+        print("QP solver did not converge after {0} iterations, falling back to minimize_cov".format(min(iteration, max_iter)))
+        weights, fallback_iterations = minimize_cov(cov, min_spread, project_weights(weights, max_investment))
+        return weights, min(iteration, max_iter) + fallback_iterations
+    return weights, iteration
+
+def qp_step(cov, gradient, free):
+    k = len(free)
+    kkt = np.empty((k + 1, k + 1))
+    kkt[:k, :k] = cov[np.ix_(free, free)]
+    kkt[:k, k] = kkt[k, :k] = 1.
+    kkt[k, k] = 0.
+    rhs = np.append(-gradient[free], 0.)
+    try:
+        solution = np.linalg.solve(kkt, rhs)
+    except np.linalg.LinAlgError: #singular covariance, e.g. fewer trading days than symbols
+        solution = np.linalg.lstsq(kkt, rhs)[0]
+    return solution[:k], solution[k]
+
+def lowest_variance_weights(cov, max_investment):
+    weights = np.zeros(len(cov))
+    order = np.argsort(np.diag(cov))
+    full = min(int(np.floor(1. / max_investment + 1e-9)), len(cov))
+    weights[order[:full]] = max_investment
+    if full < len(cov):
+        weights[order[full]] = 1. - full * max_investment
+    return weights
+
+def project_weights(weights, max_investment):
+    ''' Projects weights onto the feasible set, i.e. sum of weights equal to 1 and 0 <= w <= max_investment.
+
+    :param weights: A numpy array of weights.
+    :param max_investment: A float indicating the maximum weight of a single company.
+
+    :returns: A numpy array of feasible weights (closest in Euclidean distance).
+    '''
+    weights = np.array(weights, dtype=np.float64)
+    lo, hi = np.min(weights) - max_investment, np.max(weights) #shift bracket
+    for _ in range(200): #bisection on the shift
+        shift = 0.5 * (lo + hi)
+        if np.clip(weights - shift, 0., max_investment).sum() > 1:
+            lo = shift
+        else:
+            hi = shift
+        if hi - lo <= 1e-16:
+            break
+    return np.clip(weights - 0.5 * (lo + hi), 0., max_investment)
+
+def kkt_residual(cov, weights, max_investment):
+    ''' Calculates the largest violation of the optimality (KKT) conditions of the minimum variance problem.
+
+    :param cov: A covariance matrix of daily changes (symbols x symbols).
+    :param weights: A numpy array of allocations.
+    :param max_investment: A float indicating the maximum weight of a single company.
+
+    :returns: A float, zero at the optimum.
+    '''
+    gradient = variance_gradient(weights, cov)
+    lower, upper = weights <= QP_BOUND_TOL, weights >= max_investment - QP_BOUND_TOL
+    free = ~(lower | upper)
+    if free.any():
+        lagrange = np.mean(gradient[free])
+    else:
+        lagrange = np.max(gradient[upper]) if upper.any() else np.min(gradient[lower])
+    residual = np.abs(gradient - lagrange)
+    residual[lower] = np.maximum(lagrange - gradient[lower], 0.)
+    residual[upper] = np.maximum(gradient[upper] - lagrange, 0.)
+    feasibility = max(abs(np.sum(weights) - 1), -np.min(weights), np.max(weights) - max_investment, 0.)
+    return max(np.max(residual), feasibility)
+
+def covariance(changes):
+    return np.atleast_2d(np.cov(changes, rowvar=False, bias=True)) #population covariance, consistent with np.std
+
+def variance(weights, cov):
+    return weights.dot(cov).dot(weights)
+
+def variance_gradient(weights, cov):
+    return 2 * cov.dot(weights)
 
 def vol(weights, changes):
     return np.std(changes.dot(weights))
 
+def vol_cov(weights, cov):
+    return np.sqrt(max(variance(weights, cov), 0.))
+
 def vol_shares(shares, changes):
   return np.std(changes.dot(shares) / sum(shares))
 
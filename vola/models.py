@@ -1,7 +1,8 @@
 from django.db import models
 from django.utils import timezone
-import json
+from decimal import Decimal
 import numpy as np
+import zlib
 
 '''
 This module provides Django models containing essential fields and behaviors of the data. 
@@ -11,6 +12,15 @@ This module provides Django models containing essential fields and behaviors of
 ->Allows Django to automatically generate a database-access API.
 '''
 
+def pack_history(dates, close_prices, changes):
+    ''' Packs stock entries into the binary fields of :model:`vola.Stock_History`.
+
+    :returns: A triple of bytes containing the dates (int32 days since 1970-01-01), close prices and changes (float64).
+    '''
+    return (np.array(dates, dtype='datetime64[D]').astype(np.int32).tobytes(),
+        np.array(close_prices, dtype=np.float64).tobytes(),
+        np.array(changes, dtype=np.float64).tobytes())
+
 class Company(models.Model):
     """
     Stores a single company entry.
@@ -54,6 +64,50 @@ class Stock(models.Model):
     change = models.DecimalField(max_digits=20, decimal_places=12) # %
     date = models.DateField() 
 
+class Stock_History(models.Model):
+    """
+    Stores the full stock history of a company as packed arrays, related to :model:`vola.Company`.
+    Compact alternative to :model:`vola.Stock` rows for bulk reads (see settings.STOCK_STORAGE).
+    """
+    class Meta:
+        verbose_name = "Stock History"
+        verbose_name_plural = "Stock Histories"
+
+    def __str__(self):
+        return self.company_id
+
+    company = models.OneToOneField(Company, primary_key=True)
+    dates = models.BinaryField() # int32 days since 1970-01-01, ascending
+    close_prices = models.BinaryField() # float64 €
+    changes = models.BinaryField() # float64 %
+
+    def get_dates(self):
+        return np.frombuffer(bytes(self.dates), dtype=np.int32).astype('datetime64[D]')
+
+    def get_close_prices(self):
+        return np.frombuffer(bytes(self.close_prices), dtype=np.float64)
+
+    def get_changes(self):
+        return np.frombuffer(bytes(self.changes), dtype=np.float64)
+
+    def set_history(self, dates, close_prices, changes):
+        self.dates, self.close_prices, self.changes = pack_history(dates, close_prices, changes)
+
+    def append_history(self, dates, close_prices, changes):
+        ''' Appends stock entries, replacing existing entries of the same dates. '''
+        dates = np.concatenate([self.get_dates(), np.array(dates, dtype='datetime64[D]')])
+        close_prices = np.concatenate([self.get_close_prices(), np.array(close_prices, dtype=np.float64)])
+        changes = np.concatenate([self.get_changes(), np.array(changes, dtype=np.float64)])
+        order = np.argsort(dates, kind='mergesort') #stable, appended entries follow existing ones of the same date
+        dates, close_prices, changes = dates[order], close_prices[order], changes[order]
+        last = np.append(dates[1:] != dates[:-1], True) #last entry of each date
+        self.set_history(dates[last], close_prices[last], changes[last])
+
+    def get_stocks(self):
+        ''' Unpacks the history into (unsaved) Stock objects, e.g. for code expecting Stock rows. '''
+        return [Stock(company_id=self.company_id, date=d, close_price=Decimal('%.2f' % p), change=Decimal('%.12f' % c))
+            for d, p, c in zip(self.get_dates().astype(object), self.get_close_prices(), self.get_changes())]
+
 class SNP500(models.Model):
     """
     Stores a single SNP500 year, related to :model:`vola.Company`.
@@ -74,6 +128,61 @@ class SNP500(models.Model):
     year = models.IntegerField(primary_key=True)
     companies = models.ManyToManyField(Company)
 
+def encode_allocations(allocations):
+    return np.asarray(allocations, dtype=np.float64).tobytes()
+
+def decode_allocations(data):
+    return np.frombuffer(data, dtype=np.float64).copy() if data else np.array([])
+
+def encode_symbols(symbols):
+    return ','.join(symbols).encode('utf-8')
+
+def decode_symbols(data):
+    return bytes(data).decode('utf-8').split(',') if data else []
+
+def compress_html(html):
+    return None if html is None else zlib.compress(html.encode('utf-8'))
+
+def decompress_html(data):
+    return None if data is None else zlib.decompress(bytes(data)).decode('utf-8')
+
+class PackedAttribute(object):
+    """
+    Lazily decoded attribute of a packed binary field, e.g. allocations of allocations_field.
+    Decoded on first access and only encoded again on save if assigned.
+    """
+    def __init__(self, field, decode, encode):
+        self.field, self.decode, self.encode = field, decode, encode
+        self.cache = '_' + field + '_value'
+        self.assigned = '_' + field + '_assigned'
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        if self.cache not in instance.__dict__:
+            instance.__dict__[self.cache] = self.decode(getattr(instance, self.field))
+        return instance.__dict__[self.cache]
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.cache] = value
+        instance.__dict__[self.assigned] = True
+
+    def load(self, instance, value):
+        ''' Sets the decoded value of an already encoded field. '''
+        instance.__dict__[self.cache] = value
+        instance.__dict__[self.assigned] = False
+
+    def pack(self, instance):
+        ''' Encodes the value into the field if assigned since it was last encoded. '''
+        if instance.__dict__.get(self.assigned):
+            setattr(instance, self.field, self.encode(instance.__dict__[self.cache]))
+            instance.__dict__[self.assigned] = False
+
+    def discard(self, state):
+        ''' Removes the decoded value from the pickled state of a packed instance, decoded again on access. '''
+        state.pop(self.cache, None)
+        state.pop(self.assigned, None)
+
 class Portfolio(models.Model):
     """
     Stores a single portfolio for specific parameters.
@@ -90,30 +199,26 @@ class Portfolio(models.Model):
     period = models.IntegerField('Minimisation Period')
     lv = models.BooleanField('Low Volatility Stocks Only')
     vol = models.DecimalField('Minimised Volatility', max_digits=6, decimal_places=4)
-    allocations_field = models.TextField(editable=False)
-    symbols_field = models.TextField(editable=False)
+    allocations_field = models.BinaryField(default=b'') #float64
+    symbols_field = models.BinaryField(default=b'') #comma-separated
     date_calculated = models.DateField(auto_now=True)
     suggested = models.BooleanField(default=False)
 
-    def __init__(self, *args, **kw):
-        self.allocations = np.array([])
-        self.symbols = []
-        super(Portfolio, self).__init__(*args, **kw)
-        if self.allocations_field:
-            self.allocations = np.array(json.loads(self.allocations_field))
-        if self.symbols_field:
-            self.symbols = json.loads(self.symbols_field)
+    allocations = PackedAttribute('allocations_field', decode_allocations, encode_allocations)
+    symbols = PackedAttribute('symbols_field', decode_symbols, encode_symbols)
 
     def save(self, *args, **kw):
-        self.set_allocations(self.allocations)
-        self.set_symbols(self.symbols)
+        Portfolio.allocations.pack(self)
+        Portfolio.symbols.pack(self)
         super(Portfolio, self).save(*args, **kw)
 
     def set_allocations(self, allocations):
-        self.allocations_field = json.dumps(list(allocations))
+        self.allocations_field = encode_allocations(allocations)
+        Portfolio.allocations.load(self, allocations)
 
     def set_symbols(self, symbols):
-        self.symbols_field = json.dumps(symbols)
+        self.symbols_field = encode_symbols(symbols)
+        Portfolio.symbols.load(self, symbols)
 
 #large field + rarely available/accessed -> store seperately for optimisation
 class Plot(models.Model):
@@ -128,9 +233,27 @@ class Plot(models.Model):
 
     portfolio = models.ForeignKey(Portfolio)
     investment = models.IntegerField(default=0)
-    html = models.TextField(null=True)
+    html_field = models.BinaryField(null=True) #zlib-compressed html/JSON plot
     date_calculated = models.DateField(auto_now=True)
 
+    html = PackedAttribute('html_field', decompress_html, compress_html)
+
+    def save(self, *args, **kw):
+        Plot.html.pack(self)
+        super(Plot, self).save(*args, **kw)
+
+    def set_html(self, html):
+        self.html_field = compress_html(html)
+        Plot.html.load(self, html)
+
+    def __reduce__(self):
+        ''' Pickles only the compressed html, e.g. when sent to or returned from pool workers. '''
+        Plot.html.pack(self)
+        reconstruct, args, state = super(Plot, self).__reduce__()
+        state = dict(state)
+        Plot.html.discard(state)
+        return reconstruct, args, state
+
 class Past_Portfolio(models.Model):
     """
     Stores a single past portfolio, related to :model:`vola.Portfolio`.
@@ -144,28 +267,24 @@ class Past_Portfolio(models.Model):
 
     portfolio = models.ForeignKey(Portfolio)
     start_date = models.DateField() #performance over the following year
-    allocations_field = models.TextField(editable=False) #volatility minimised over the previous 'period' num years
-    symbols_field = models.TextField(editable=False)
+    allocations_field = models.BinaryField(default=b'') #float64, volatility minimised over the previous 'period' num years
+    symbols_field = models.BinaryField(default=b'') #comma-separated
     
-    def __init__(self, *args, **kw):
-        self.allocations = np.array([])
-        self.symbols = []
-        super(Past_Portfolio, self).__init__(*args, **kw)
-        if self.allocations_field:
-            self.allocations = np.array(json.loads(self.allocations_field))
-        if self.symbols_field:
-            self.symbols = json.loads(self.symbols_field)
- 
+    allocations = PackedAttribute('allocations_field', decode_allocations, encode_allocations)
+    symbols = PackedAttribute('symbols_field', decode_symbols, encode_symbols)
+
     def save(self, *args, **kw):
-        self.set_allocations(self.allocations)
-        self.set_symbols(self.symbols)
+        Past_Portfolio.allocations.pack(self)
+        Past_Portfolio.symbols.pack(self)
         super(Past_Portfolio, self).save(*args, **kw)
 
     def set_allocations(self, allocations):
-        self.allocations_field = json.dumps(list(allocations))
+        self.allocations_field = encode_allocations(allocations)
+        Past_Portfolio.allocations.load(self, allocations)
 
     def set_symbols(self, symbols):
-        self.symbols_field = json.dumps(symbols)
+        self.symbols_field = encode_symbols(symbols)
+        Past_Portfolio.symbols.load(self, symbols)
 
 class Past_Statistics(models.Model):
     """
@@ -184,4 +303,22 @@ class Past_Statistics(models.Model):
     snp_ret = models.DecimalField('SNP500 Return', max_digits=6, decimal_places=4)
     snp_lv_vol = models.DecimalField('SNP500LV Volatility', max_digits=6, decimal_places=4)
     snp_lv_ret = models.DecimalField('SNP500LV Return', max_digits=6, decimal_places=4)
-    sharpe_ratio = models.DecimalField(max_digits=6, decimal_places=4)
\ No newline at end of file
+    sharpe_ratio = models.DecimalField(max_digits=6, decimal_places=4)
+
+class Performance_Job(models.Model):
+    """
+    Stores the state of a background past performance calculation for the custom view, related to :model:`vola.Portfolio`.
+    Shared by all web workers, so a poll reaching any worker sees the job (see vola.performanceJobs).
+    """
+    class Meta:
+        verbose_name = "Performance Job"
+        unique_together = (('portfolio', 'investment'),)
+
+    def __str__(self):
+        return "{0}:{1}".format(self.portfolio.__str__(), self.investment)
+
+    portfolio = models.ForeignKey(Portfolio)
+    investment = models.IntegerField()
+    status = models.CharField(max_length=7, default='pending') #pending, done or failed
+    result_field = models.BinaryField(null=True) #zlib-compressed JSON of the plot and statistics
+    created = models.DateTimeField(default=timezone.now, db_index=True) #expired if not polled
@@ -0,0 +1,91 @@
+from vola import portfolioCalculator
+from vola.models import Performance_Job
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction, IntegrityError
+from django.db.models import Q
+from django.utils import timezone
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import json, logging, zlib
+
+'''
+This module provides background calculations of past portfolio performances for the custom view.
+
+->The custom view responds with the portfolio immediately, its performance section polls for the job (see views.custom_performance).
+->Jobs are stored in the database (Performance_Job), so a poll reaching any worker sees a job submitted by another.
+->One job per portfolio and investment, run by the thread pool of the worker that submitted it.
+->Finished jobs are deleted once their result is retreived, unpolled ones expire after JOB_EXPIRY.
+->Pending jobs only expire after PENDING_EXPIRY (a worker that stopped), so a running calculation is never submitted twice.
+->With settings.PERFORMANCE_JOBS = False, the custom view calculates the performance synchronously instead (see enabled).
+'''
+
+WORKERS = 1 #pyplot figures are not thread-safe
+JOB_EXPIRY = timedelta(minutes=10)
+PENDING_EXPIRY = timedelta(hours=1) #longer than any calculation
+PENDING, DONE, FAILED = 'pending', 'done', 'failed'
+_executor = ThreadPoolExecutor(max_workers=WORKERS)
+logger = logging.getLogger(__name__)
+
+class JobFailedError(Exception):
+    ''' Raised when retreiving a job whose calculation failed. '''
+
+def enabled():
+    ''' :returns: A boolean indicating whether or not custom past performances are calculated in the background and polled. '''
+    return getattr(settings, 'PERFORMANCE_JOBS', True)
+
+def status(investment, portfolio):
+    ''' Retreives the past performance of a stored portfolio, submitting its calculation if not submitted yet by any worker.
+
+    :param investment: A positive integer.
+    :param portfolio: A stored Portfolio object.
+
+    :returns: A pair containing a html performance plot and zipped annual statistics, or None if still calculating.
+    '''
+    job = Performance_Job.objects.filter(portfolio=portfolio, investment=investment).first()
+    if job is not None and job.status == PENDING and job.created < timezone.now() - PENDING_EXPIRY:
+        job = None #submitting worker stopped, resubmitted once expired
+    if job is None:
+        expire_jobs() #only when submitting, polls stay a single lookup
+        try:
+            with transaction.atomic():
+                job = Performance_Job.objects.create(portfolio=portfolio, investment=investment)
+        except IntegrityError: #submitted meanwhile by another worker
+            return None
+        _executor.submit(calculate, job.pk, investment, portfolio)
+        return None
+    if job.status == PENDING:
+        return None
+    job.delete() #result retreived, later requests read the stored performance
+    if job.status == FAILED:
+        raise JobFailedError('Past performance calculation failed for {0}'.format(job))
+    fig, stats = decode_result(job.result_field)
+    return fig, stats
+
+def expire_jobs():
+    ''' Deletes finished jobs that were not retreived within JOB_EXPIRY and pending jobs older than PENDING_EXPIRY.
+
+    :returns: An integer indicating the number of jobs deleted.
+    '''
+    now = timezone.now()
+    expired = Performance_Job.objects.filter(Q(created__lt=now - JOB_EXPIRY) & ~Q(status=PENDING) | Q(created__lt=now - PENDING_EXPIRY))
+    num_jobs = expired.count()
+    if num_jobs:
+        expired.delete()
+    return num_jobs
+
+def encode_result(result):
+    return zlib.compress(json.dumps(result, cls=DjangoJSONEncoder).encode('utf-8')) #statistics are decimals
+
+def decode_result(data):
+    return json.loads(zlib.decompress(bytes(data)).decode('utf-8'))
+
+def calculate(pk, investment, portfolio):
+    try:
+        result = portfolioCalculator.get_past_portfolio_performance(investment, portfolio)
+        Performance_Job.objects.filter(pk=pk).update(status=DONE, result_field=encode_result(result))
+    except Exception: #any error fails the job rather than leaving it pending
+        logger.exception('Past performance calculation failed for portfolio %s and investment %s', portfolio, investment)
+        Performance_Job.objects.filter(pk=pk).update(status=FAILED)
+    finally:
+        connection.close() #pool threads open their own connection
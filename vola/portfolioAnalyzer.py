@@ -1,5 +1,8 @@
 import db.access as dba
+from db import stockPanel
 import numpy as np
+import threading
+from datetime import timedelta
 from decimal import Decimal
 from vola.models import Stock
 
@@ -8,6 +11,18 @@ This module provides functions to analyze a portfolio.
 Includes performance simulation against benchmarks and statistics calculation.
 '''
 
+BENCHMARK = '^SP500TR' #S&P 500 total return
+BENCHMARK_LV = 'SPLV' #S&P 500 Low Volatility Index
+MAX_BENCHMARKS = 1000 #cached (symbol, start, end) periods
+_lock = threading.Lock()
+_benchmarks = {}
+_benchmarks_panel = None
+
+class UnavailableStocksError(ValueError):
+    """
+    Raised when a portfolio holds companies without stocks, e.g. a backtest of symbols missing from the stock panel.
+    """
+
 def simulate(start, end, symbols, allocations, p_investment, b_investment, blv_investment=False, real=False):
     ''' Calculates the simulated performance of a portfolio.
 
@@ -25,19 +40,149 @@ def simulate(start, end, symbols, allocations, p_investment, b_investment, blv_i
     p_prices = getPrices(start, end, symbols)
     dates = dba.get_valid_dates(start, end)
     changes = getChanges(start, end, symbols) #daily portfilio % changes
-    b_changes = dba.SP500TR(start, end, 'change')
-    b_prices = dba.SP500TR(start, end, 'close_price')
+    b = benchmark(BENCHMARK, start, end)
     if real:
         shares = (allocations * p_investment) / p_prices[0]
     else:
         shares = np.rint((allocations * p_investment) / p_prices[0])
-    if blv_investment:
-        blv_changes = dba.SP500LV(start, end, 'change')
-        blv_prices = dba.SP500LV(start, end, 'close_price')
-    else:
-        blv_changes, blv_prices = [],[]
-    stats, p_daily, b_daily, blv_daily = calcStats(p_investment, p_prices, changes, shares, b_prices, b_changes, b_investment, blv_changes, blv_prices, blv_investment)
-    return stats, [p_daily, b_daily, blv_daily], [changes, b_changes, blv_changes], dates
+    blv = benchmark(BENCHMARK_LV, start, end) if blv_investment else None
+    stats, p_daily, b_daily, blv_daily = calcStats(p_investment, p_prices, changes, shares, b, b_investment, blv, blv_investment)
+    return stats, [p_daily, b_daily, blv_daily], [changes, b['changes'], blv['changes'] if blv else []], dates
+
+def benchmark(symbol, start, end):
+    ''' Retreives the daily prices, changes and statistics of a benchmark for the given period.
+    Benchmarks do not depend on the portfolio, so they are calculated once and cached until the stock panel is refreshed.
+
+    :param symbol: A ticker symbol, e.g. BENCHMARK or BENCHMARK_LV.
+    :param start: A date object indicating the start of the period to be analysed.
+    :param end: A date object indicating the end of the period to be analysed.
+
+    :returns: A dict containing the prices and changes (numpy arrays, not to be modified), the standard deviation of changes and the return (%),
+    both zero if the benchmark is not available for the period.
+    '''
+    global _benchmarks_panel
+    panel = stockPanel.get()
+    key = (symbol, start, end)
+    with _lock:
+        if _benchmarks_panel is not panel or len(_benchmarks) >= MAX_BENCHMARKS:
+            _benchmarks.clear()
+            _benchmarks_panel = panel
+        cached = _benchmarks.get(key)
+    if cached is None:
+        prices = stockPanel.series(symbol, start, end, 'close_price')
+        changes = stockPanel.series(symbol, start, end, 'change')
+        if len(prices):
+            cached = {'prices': prices, 'changes': changes, 'std': np.std(changes), 'return': 100 * ((prices[-1] - prices[0]) / prices[0])}
+        else: #not available for the period, no volatility or return rather than None
+            cached = {'prices': prices, 'changes': changes, 'std': np.float64(0), 'return': np.float64(0)}
+        with _lock:
+            _benchmarks[key] = cached
+    return cached
+
+def backtest(past_portfolios, investment, real=False):
+    ''' Calculates the simulated performance of consecutive past portfolios, each held for a year and then rebalanced into the next.
+
+    :param past_portfolios: A list of Past_Portfolio objects ordered by start date.
+    :param investment: A positive integer initial investment for the portfolio and both benchmarks.
+    :param real (optional): A boolean indication whether or not to use real-valued allocations, i.e. not round to integer shares.
+
+    :returns A triple containing the annual performance statistics (list of dicts), daily values of the portfolio, S&P 500 and S&P 500 LV
+    (list of numpy arrays, starting with the investment on the day before investing) and dates (list).
+
+    :raises UnavailableStocksError: If some symbols of the past portfolios have no stocks.
+    '''
+    results = backtest_investments(past_portfolios, [investment], real)
+    return results[0]
+
+def backtest_investments(past_portfolios, investments, real=False):
+    ''' Calculates the simulated performance of consecutive past portfolios for several investments at once (see backtest).
+    The stocks of the whole span are retrieved once and sliced per year. Only the share rounding differs between investments,
+    so each year is simulated with a shares matrix (investments x symbols) rather than per investment.
+
+    :param past_portfolios: A list of Past_Portfolio objects ordered by start date.
+    :param investments: A list of positive integer initial investments.
+    :param real (optional): A boolean indication whether or not to use real-valued allocations, i.e. not round to integer shares.
+
+    :returns A list of triples (see backtest) ordered as investments.
+
+    :raises UnavailableStocksError: If some symbols of the past portfolios have no stocks.
+    '''
+    start = past_portfolios[0].start_date
+    end = past_portfolios[-1].start_date + timedelta(days=365)
+    symbols = sorted(set(s for pp in past_portfolios for s in pp.symbols))
+    panel = stockPanel.get()
+    cols = stockPanel.columns(panel, symbols)
+    if cols is None:
+        missing = [s for s in symbols if s not in panel['index']]
+        raise UnavailableStocksError("No stocks for " + ", ".join(missing))
+    rows = stockPanel.rows(panel, start, end)
+    span_dates = panel['dates'][rows]
+    span_prices, span_changes = panel['close_price'][rows][:, cols], panel['change'][rows][:, cols]
+    index = {s: i for i, s in enumerate(symbols)}
+    current = [np.array(investments, dtype=np.float64)] * 3 #portfolio, S&P 500 and S&P 500 LV values per investment
+    daily_values = [[values[np.newaxis]] for values in current]
+    dates = [start - timedelta(days=1)] #day before investing
+    annual_stats = []
+    for pp in past_portfolios:
+        year_start, year_end = pp.start_date, pp.start_date + timedelta(days=365)
+        year = slice(np.searchsorted(span_dates, np.datetime64(year_start, 'D'), side='left'),
+            np.searchsorted(span_dates, np.datetime64(year_end, 'D'), side='right'))
+        prices, changes = span_prices[year], span_changes[year]
+        sub = [index[s] for s in sorted(pp.symbols)]
+        available = ~np.isnan(prices[:, sub])
+        present = available.any(axis=1)
+        if available[present].all():
+            p_prices, p_changes = prices[present][:, sub], changes[present][:, sub]
+        else: #inconsistent dates, aligned as usual
+            p_prices, p_changes = getPrices(year_start, year_end, pp.symbols), getChanges(year_start, year_end, pp.symbols)
+        shares = np.outer(current[0], pp.allocations) / p_prices[0]
+        if not real:
+            shares = np.rint(shares)
+        stats, p_daily, b_daily, blv_daily = calc_stats_batch(current[0], p_prices, p_changes, shares,
+            benchmark(BENCHMARK, year_start, year_end), current[1], benchmark(BENCHMARK_LV, year_start, year_end), current[2])
+        for values, daily in zip(daily_values, [p_daily, b_daily, blv_daily]):
+            values.append(daily)
+        current = [p_daily[-1], b_daily[-1], blv_daily[-1]] #rebalanced into the next year
+        dates += dba.get_valid_dates(year_start, year_end)
+        annual_stats.append(stats)
+    daily_values = [np.concatenate(values) for values in daily_values] #days x investments
+    return [([stats[i] for stats in annual_stats], [values[:, i] for values in daily_values], dates) for i in range(len(investments))]
+
+def calc_stats_batch(p_investments, p_prices, indiv_changes, shares, b, b_investments, blv, blv_investments):
+    ''' Calculates the statistics and daily values of calcStats for several investments at once.
+
+    :param p_investments: A numpy array of investments in the portfolio.
+    :param shares: A matrix of shares (investments x symbols).
+    :param b: The S&P 500 benchmark (see benchmark).
+    :param b_investments: A numpy array of investments in the S&P 500, ordered as p_investments.
+    :param blv: The S&P 500 LV benchmark (see benchmark).
+    :param blv_investments: A numpy array of investments in the S&P 500 LV, ordered as p_investments.
+
+    :returns: A 4-tuple containing the statistics (list of dicts) and daily values of the portfolio, S&P 500 and S&P 500 LV (days x investments), ordered as p_investments.
+    '''
+    p_values = p_prices.dot(shares.T)
+    p_return = 100 * (p_values[-1] - p_values[0]) / p_values[0]
+    p_daily_returns = indiv_changes.dot(shares.T) / shares.sum(axis=1)
+    p_daily_values = p_values + (p_investments - p_values[0]) #pot left over from rounding
+    sqrt_trading_days = np.sqrt(np.size(b['prices'])) #annualize
+    excess_returns = p_daily_returns - b['changes'][:, np.newaxis]
+    volatility = np.std(p_daily_returns, axis=0) * sqrt_trading_days
+    sharpe = (np.mean(excess_returns, axis=0) / np.std(excess_returns, axis=0)) * sqrt_trading_days
+    benchmark_values = []
+    for prices, investments in [(b['prices'], b_investments), (blv['prices'], blv_investments)]:
+        values = np.outer(prices, np.floor(investments / prices[0]))
+        benchmark_values.append(values + (investments - values[0]))
+    b_stats = {
+        'benchmark volatility': round((b['std']*sqrt_trading_days).astype(Decimal), 2),
+        'benchmark return': round(b['return'].astype(Decimal), 2),
+        'benchmarklv volatility': round((blv['std']*sqrt_trading_days).astype(Decimal), 2),
+        'benchmarklv return': round(blv['return'].astype(Decimal), 2)}
+    stats = []
+    for i in range(len(p_investments)):
+        p_stats = {'volatility': round(volatility[i], 2), 'return': round(p_return[i], 2), 'sharpe': round(sharpe[i], 2)}
+        p_stats.update(b_stats)
+        stats.append(p_stats)
+    return stats, p_daily_values, benchmark_values[0], benchmark_values[1]
 
 def calc_stats_params(start, end, symbols, shares):
     ''' Calculates annual statistics for the given period, symbols and shares.
@@ -50,19 +195,20 @@ def calc_stats_params(start, end, symbols, shares):
     :returns: A triple of decimals containing the volatility, return, and risk-adjusted return for the given parameters.
     '''
     prices = getPrices(start, end, symbols)
-    changes = getChanges(start, end, symbols)
-    vol = np.std(changes.dot(shares) / sum(shares))
+    cov, trading_days = dba.get_covariance(start, end, symbols)
+    weights = np.asarray(shares, dtype=np.float64) / sum(shares)
+    vol = np.sqrt(weights.dot(cov).dot(weights)) #std of daily portfolio % changes
     ret = (prices[-1].dot(shares) - prices[0].dot(shares)) / prices[0].dot(shares)
     risk_adj = ret / vol
     return vol, ret, risk_adj
 
-def calcStats(p_investment, p_prices, indiv_changes, shares, b_prices, b_changes, b_investment, blv_changes, blv_prices, blv_investment):
+def calcStats(p_investment, p_prices, indiv_changes, shares, b, b_investment, blv, blv_investment):
     stats = {}  
+    b_prices, b_changes = b['prices'], b['changes']
     p_return = 100 * (p_prices[-1].dot(shares) - p_prices[0].dot(shares)) / p_prices[0].dot(shares)
     p_daily_returns = (indiv_changes.dot(shares) / sum(shares)) 
     p_daily_values = p_prices.dot(shares) 
     p_daily_values = p_daily_values + (p_investment - p_daily_values[0]) #pot left over from rounding
-    b_return = 100 * ((b_prices[-1] - b_prices[0]) / b_prices[0]) #normalized $1
     b_daily_returns = b_changes 
     b_daily_values = b_prices * np.floor(b_investment / b_prices[0]) #normalized $1
     b_daily_values = b_daily_values + (b_investment - b_daily_values[0])
@@ -71,16 +217,15 @@ def calcStats(p_investment, p_prices, indiv_changes, shares, b_prices, b_changes
     stats['volatility'] = round(np.std(indiv_changes.dot(shares) / sum(shares)) * sqrt_trading_days, 2)
     stats['return'] = round(p_return, 2)
     stats['sharpe'] = round((np.mean(excess_returns) / np.std(excess_returns)) * sqrt_trading_days, 2)
-    stats['benchmark volatility'] = round((np.std(b_changes)*sqrt_trading_days).astype(Decimal), 2)
-    stats['benchmark return'] = round(b_return.astype(Decimal), 2)
+    stats['benchmark volatility'] = round((b['std']*sqrt_trading_days).astype(Decimal), 2)
+    stats['benchmark return'] = round(b['return'].astype(Decimal), 2)
     blv_daily_values = []
     if blv_investment:
-        blv_return = 100 * ((blv_prices[-1] - blv_prices[0]) / blv_prices[0]) 
+        blv_prices = blv['prices']
         blv_daily_values = blv_prices * np.floor(blv_investment / blv_prices[0])
         blv_daily_values = blv_daily_values + (blv_investment - blv_daily_values[0])
-        blv_daily_returns = blv_changes
-        stats['benchmarklv volatility'] = round((np.std(blv_changes)*sqrt_trading_days).astype(Decimal), 2)
-        stats['benchmarklv return'] = round(blv_return.astype(Decimal), 2)
+        stats['benchmarklv volatility'] = round((blv['std']*sqrt_trading_days).astype(Decimal), 2)
+        stats['benchmarklv return'] = round(blv['return'].astype(Decimal), 2)
     return stats, p_daily_values, b_daily_values, blv_daily_values
 
 def getChanges(start, end, symbols):
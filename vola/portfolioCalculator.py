@@ -1,6 +1,8 @@
-from vola import minimizer, portfolioAnalyzer
+from vola import minimizer, portfolioAnalyzer, resultCache
 from vola.models import Portfolio, Past_Portfolio, Past_Statistics, Plot
 from db import access as dba
+from django.db import transaction, IntegrityError
+from django.conf import settings
 from datetime import datetime, timedelta
 import matplotlib.pyplot as plt, mpld3
 import matplotlib.dates as mdates
@@ -8,30 +10,69 @@ import numpy as np
 
 '''This module provides functions for retreiving, calculating and storing portfolios and their past performances.'''
 
+INVESTMENTS = [10000, 25000, 50000, 100000, 250000, 1000000] #stored past performances, kept and recalculated weekly
+METHOD = getattr(settings, 'MINIMIZE_METHOD', 'std') #solver of stored portfolios (see minimizer.calculate_portfolio)
+PLOT_EXPIRY = timedelta(days=getattr(settings, 'PLOT_EXPIRY_DAYS', 30)) #stored past performances of other requested investments
+
 def calculate_portfolio(investment, minimum_spread, lv, analyse_performance, live, period):
     ''' Calculates portfolio performance for given investment (retreives performance if stored).
 
     :param investment: A positive integer.
-    :param minimum_spread: A positive integer <= 100.
+    :param minimum_spread: A positive integer <= 100. Calculated live if not stored.
     :param lv: A boolean. True indicates to only use the 100 lowest volatility stocks.
     :param analyse_performance: A boolean. True indicates to analyse past performance.
     :param period: A positive integer  <= 12 representing the minimisation period.
   
     :returns: A 4-tuple containing the zipped current portfolio data, amount actually invested (decimal), volatility (decimal), zipped statistics
     '''
-    p = Portfolio.objects.get(title="Custom", spread=minimum_spread, period=period, lv=lv)
     #yday = datetime.today().date() - timedelta(days=1) #yday prices, if NOT live prices
     end = dba.get_most_recent_date('KO')
     print(end)
+    try:
+        p = Portfolio.objects.get(title="Custom", spread=minimum_spread, period=period, lv=lv)
+    except Portfolio.DoesNotExist: #spread not precomputed, calculate live with the dedicated solver (no past performance)
+        p = update_or_create_portfolio(minimum_spread, period, lv, end, method='qp')
+        analyse_performance = False
     shares, prices = minimizer.get_shares_and_prices(end, p.symbols, p.allocations, investment, live)
     data, invested = pack_formated_data(shares, prices, p.symbols)
     fig, stats = None, None
     if analyse_performance:
-        fig, stats =dba.get_performance_data(p, investment)
-        if fig is None: #investment not stored
-            fig, stats = live_calculate_past_portfolio_performance(investment, p)
+        try:
+            fig, stats = get_past_portfolio_performance(investment, p)
+        except portfolioAnalyzer.UnavailableStocksError as e: #portfolio shown without its past performance
+            print(e)
     return data, invested, p.vol, fig, stats
 
+def get_past_portfolio_performance(investment, portfolio):
+    ''' Retreives the past performance of a stored portfolio, calculating and storing it if missing (see store_past_portfolio_performance).
+    Identical concurrent requests of a worker share one calculation, concurrent workers are coalesced by the database.
+
+    :param investment: A positive integer.
+    :param portfolio: A stored Portfolio object.
+
+    :returns: A pair containing a html performance plot and zipped annual statistics.
+    '''
+    fig, stats = dba.get_performance_data(portfolio, investment)
+    if fig is None: #not stored yet, e.g. a new portfolio or investment
+        key = ('performance', portfolio.pk, investment)
+        fig, stats = resultCache.coalesce(key, lambda: store_past_portfolio_performance(investment, portfolio))
+    return fig, stats
+
+def cached_calculate_portfolio(investment, minimum_spread, lv, analyse_performance, live, period):
+    ''' Calculates portfolio performance (see calculate_portfolio), serving repeated requests from the result cache.
+    Live requests are never cached, their prices change during the day.
+
+    :returns: See calculate_portfolio.
+    '''
+    key = (minimum_spread, period, lv, investment, analyse_performance, live)
+    result = None if live else resultCache.get(key)
+    if result is None:
+        version = resultCache.version()
+        result = calculate_portfolio(investment, minimum_spread, lv, analyse_performance, live, period)
+        if not live:
+            resultCache.put(key, result, version)
+    return result
+
 def calculate_past_portfolio_performance(investment, portfolio, plot=None):
     ''' Calculates the past performance of a portfolio.
 
@@ -41,34 +82,103 @@ def calculate_past_portfolio_performance(investment, portfolio, plot=None):
 
     :returns: A pair containing a list of Past_Portfolio objects to be saved in bulk and a Plot object for the given portfolio and investment.
     '''
+    return calculate_past_portfolio_performances([investment], portfolio, None if plot is None else [plot])[0]
+
+def calculate_past_portfolio_performances(investments, portfolio, plots=None):
+    ''' Calculates the past performance of a portfolio for several investments in a single backtest (see portfolioAnalyzer.backtest_investments).
+
+    :param investments: A list of positive integers.
+    :param portfolio: A Portfolio object for which to calculate the past performance.
+    :param plots(optional): A list of Plot objects in which to save the plot for each investment, ordered as investments. New plots created if not provided.
+
+    :returns: A list of pairs (see calculate_past_portfolio_performance), ordered as investments.
+    '''
     past_portfolios = list(Past_Portfolio.objects.filter(portfolio=portfolio).order_by('start_date'))
-    if plot is None:
-        plot = Plot(portfolio=portfolio, investment=investment)
-        plot.save() #assign pk
-    start_date = past_portfolios[0].start_date #initial start date
-    day_before_investing = start_date - timedelta(days=1)
-    p_daily_values = [investment]
-    b_daily_values = [investment]
-    blv_daily_values = [investment]
-    dates = [day_before_investing]
-    bulklist = []
-    for pp in past_portfolios:
-        stats, daily_values, daily_changes, ds = portfolioAnalyzer.simulate(pp.start_date, pp.start_date + timedelta(days=365), pp.symbols, pp.allocations, p_daily_values[-1], b_daily_values[-1], blv_daily_values[-1])
-        p_daily_values += list(daily_values[0])
-        b_daily_values += list(daily_values[1])
-        blv_daily_values += list(daily_values[2])
-        dates += list(ds)
-        if plot is None:
-            ps = Past_Statistics(past_portfolio=pp, plot=plot)
-        else:
-            ps = Past_Statistics.objects.get(past_portfolio=pp, plot=plot)
-        ps.vol, ps.ret, ps.sharpe_ratio = stats['volatility'], stats['return'], stats['sharpe']
-        ps.snp_vol, ps.snp_ret = stats['benchmark volatility'], stats['benchmark return']
-        ps.snp_lv_vol, ps.snp_lv_ret = stats['benchmarklv volatility'], stats['benchmarklv return']
-        bulklist.append(ps)
-    fig = plot_graphs(p_daily_values, b_daily_values, blv_daily_values, dates)
-    plot.html = fig
-    return bulklist, plot
+    backtests = portfolioAnalyzer.backtest_investments(past_portfolios, investments) #before saving new plots, raises if stocks are unavailable
+    new_plots = plots is None
+    if new_plots:
+        plots = [Plot(portfolio=portfolio, investment=investment) for investment in investments]
+        for plot in plots:
+            plot.save() #assign pk
+        past_stats = {}
+    else:
+        past_stats = {(ps.plot_id, ps.past_portfolio_id): ps for ps in Past_Statistics.objects.filter(plot__in=plots)}
+    results = []
+    for plot, (annual_stats, daily_values, dates) in zip(plots, backtests):
+        bulklist = []
+        for pp, stats in zip(past_portfolios, annual_stats):
+            if new_plots:
+                ps = Past_Statistics(past_portfolio=pp, plot=plot)
+            else:
+                ps = past_stats[(plot.pk, pp.pk)]
+            bulklist.append(set_past_statistics(ps, stats))
+        plot.set_html(plot_graphs(daily_values[0], daily_values[1], daily_values[2], dates)) #compressed by the calculating process
+        results.append((bulklist, plot))
+    return results
+
+def set_past_statistics(ps, stats):
+    ''' Sets the performance statistics of a Past_Statistics object.
+
+    :param ps: A Past_Statistics object.
+    :param stats: A dict of performance statistics (see portfolioAnalyzer.calcStats).
+
+    :returns: The Past_Statistics object.
+    '''
+    ps.vol, ps.ret, ps.sharpe_ratio = stats['volatility'], stats['return'], stats['sharpe']
+    ps.snp_vol, ps.snp_ret = stats['benchmark volatility'], stats['benchmark return']
+    ps.snp_lv_vol, ps.snp_lv_ret = stats['benchmarklv volatility'], stats['benchmarklv return']
+    return ps
+
+def store_past_portfolio_performance(investment, portfolio):
+    ''' Calculates the past performance of a portfolio for an investment that is not stored yet and stores it
+    as a new Plot with its Past_Statistics, so later requests retrieve it (see access.get_performance_data).
+    Concurrent workers are coalesced by the unique portfolio and investment of Plot, only the first insert is kept.
+    Expired plots of investments outside the stored grid are pruned on insert (see prune_plots).
+
+    :param investment: A positive integer.
+    :param portfolio: A Portfolio object for which to calculate the past performance.
+
+    :returns: A pair containing a html performance plot and zipped annual statistics.
+    '''
+    past_portfolios = list(Past_Portfolio.objects.filter(portfolio=portfolio).order_by('start_date')) #must be ordered ascending
+    annual_stats, daily_values, dates = portfolioAnalyzer.backtest(past_portfolios, investment)
+    html = plot_graphs(daily_values[0], daily_values[1], daily_values[2], dates)
+    try:
+        with transaction.atomic(): #calculated beforehand, so the database is only locked for the inserts
+            plot = Plot(portfolio=portfolio, investment=investment)
+            plot.set_html(html)
+            plot.save()
+            Past_Statistics.objects.bulk_create([set_past_statistics(Past_Statistics(past_portfolio=pp, plot=plot), stats)
+                for pp, stats in zip(past_portfolios, annual_stats)])
+    except IntegrityError: #stored meanwhile by another worker
+        pass
+    else:
+        prune_plots()
+    return dba.get_performance_data(portfolio, investment)
+
+def prune_plots():
+    ''' Deletes the stored past performances of investments outside the stored grid (INVESTMENTS) calculated more than PLOT_EXPIRY ago,
+    so requested investments neither grow the database nor the weekly recalculation without bound.
+
+    :returns: An integer indicating the number of plots deleted.
+    '''
+    expired = Plot.objects.exclude(investment__in=INVESTMENTS).filter(date_calculated__lt=datetime.today().date() - PLOT_EXPIRY)
+    num_plots = expired.count()
+    if num_plots:
+        expired.delete() #with their Past_Statistics
+    return num_plots
+
+def group_plots(plots):
+    ''' Groups plots by portfolio, so that each portfolio's investments are backtested together.
+
+    :param plots: A list of Plot objects.
+
+    :returns: A list of lists of Plot objects sharing the portfolio.
+    '''
+    groups = {}
+    for plot in plots:
+        groups.setdefault(plot.portfolio_id, []).append(plot)
+    return list(groups.values())
 
 def live_calculate_past_portfolio_performance(investment, portfolio):
     ''' Calculates the past performance of a portfolio live.
@@ -79,35 +189,11 @@ def live_calculate_past_portfolio_performance(investment, portfolio):
     :returns: A pair containing a html performance plot and zipped annual statistics.
     '''
     past_portfolios = list(Past_Portfolio.objects.filter(portfolio=portfolio).order_by('start_date')) #must be ordered ascending
-    start_date = past_portfolios[0].start_date #initial start date
-    day_before_investing = start_date - timedelta(days=1)
-    p_daily_values = [investment]
-    b_daily_values = [investment]
-    blv_daily_values = [investment]
-    dates = [day_before_investing]
-    p_annual_vols = []
-    p_annual_return = []
-    b_annual_vols = []
-    b_annual_return = []
-    blv_annual_vols = []
-    blv_annual_return = []
-    sharpes = []
-    for pp in past_portfolios:
-        stats, daily_values, daily_changes, ds = portfolioAnalyzer.simulate(pp.start_date, pp.start_date + timedelta(days=365), pp.symbols, pp.allocations, p_daily_values[-1], b_daily_values[-1], blv_daily_values[-1])
-        p_daily_values += list(daily_values[0])
-        b_daily_values += list(daily_values[1])
-        blv_daily_values += list(daily_values[2])
-        dates += list(ds)
-        p_annual_vols.append(stats['volatility'])
-        p_annual_return.append(stats['return'])
-        b_annual_vols.append(stats['benchmark volatility'])
-        b_annual_return.append(stats['benchmark return'])
-        blv_annual_vols.append(stats['benchmarklv volatility'])
-        blv_annual_return.append(stats['benchmarklv return'])
-        sharpes.append(stats['sharpe'])
-    fig = plot_graphs(p_daily_values, b_daily_values, blv_daily_values, dates)
-    vols = list(zip(p_annual_vols, b_annual_vols, blv_annual_vols))
-    returns = list(zip(p_annual_return, b_annual_return, blv_annual_return))
+    annual_stats, daily_values, dates = portfolioAnalyzer.backtest(past_portfolios, investment)
+    fig = plot_graphs(daily_values[0], daily_values[1], daily_values[2], dates)
+    vols = [(stats['volatility'], stats['benchmark volatility'], stats['benchmarklv volatility']) for stats in annual_stats]
+    returns = [(stats['return'], stats['benchmark return'], stats['benchmarklv return']) for stats in annual_stats]
+    sharpes = [stats['sharpe'] for stats in annual_stats]
     dates = [str(pp.start_date + timedelta(days=365)) for pp in past_portfolios] #already sorted by date
     stats = list(zip(dates, vols, returns, sharpes))
     return fig, stats
@@ -149,15 +235,20 @@ def live_calculate_past_portfolio_performance_hold(investment, portfolio):
     stats = list(zip(dates, vols, returns, sharpes))
     return fig, stats
 
-def plot_graphs(p_vals, b_vals, blv_vals, dates):
+def plot_graphs(p_vals, b_vals, blv_vals, dates, points=None):
     ''' Plots the portfolio's performance against the benchmarks (S&P 500 and S&P 500 Low Volatility Index).
 
     :param p_vals: A list containing the portfolio's daily values.
     :param b_vals: A list containing the S&P 500's daily values.
     :param blv_vals: A list containing the S&P 500 (LV)'s daily values.
+    :param points(optional): A positive integer indicating the maximum number of dates plotted (see downsample), 0 for full resolution. Defaults to settings.PLOT_POINTS.
 
     :returns: A html performance plot
     '''
+    keep = downsample(dates, [p_vals, b_vals, blv_vals], getattr(settings, 'PLOT_POINTS', 0) if points is None else points)
+    if len(keep) < len(dates):
+        p_vals, b_vals, blv_vals = [np.asarray(vals)[keep] for vals in (p_vals, b_vals, blv_vals)]
+        dates = [dates[i] for i in keep]
     years = mdates.YearLocator()
     months = mdates.MonthLocator()
     fig, ax = plt.subplots()
@@ -188,7 +279,49 @@ def plot_graphs(p_vals, b_vals, blv_vals, dates):
 def price(x):
     return '$%1.2f' % x
 
-def update_or_create_portfolio(spread, period, lv, end, title="Custom", p=None):
+def downsample(dates, curves, points):
+    ''' Selects the dates to plot with largest-triangle-three-buckets (LTTB) downsampling, preserving the shape of the curves.
+    The curves share their dates, so each bucket keeps the date maximising the sum of the curves' triangle areas.
+
+    :param dates: A list of dates.
+    :param curves: A list of value lists, each ordered as dates.
+    :param points: A positive integer indicating the maximum number of dates, 0 (or None) to keep all dates.
+
+    :returns: A numpy integer array of ascending indices into dates, always including the first and last date.
+    '''
+    n = len(dates)
+    if not points or n <= max(points, 2):
+        return np.arange(n)
+    if points < 3:
+        return np.array([0, n - 1])
+    x = np.array(dates, dtype='datetime64[D]').astype(np.float64)
+    ys = np.array(curves, dtype=np.float64)
+    every = (n - 2) / (points - 2)
+    keep = np.zeros(points, dtype=np.intp)
+    keep[-1] = n - 1
+    for i in range(points - 2):
+        lo, hi = int(i * every) + 1, int((i + 1) * every) + 1
+        next_hi = min(int((i + 2) * every) + 1, n)
+        a = keep[i]
+        x_avg, y_avg = x[hi:next_hi].mean(), ys[:, hi:next_hi].mean(axis=1, keepdims=True)
+        y_a = ys[:, a:a + 1]
+        areas = np.abs((x[a] - x_avg) * (ys[:, lo:hi] - y_a) - (x[a] - x[lo:hi]) * (y_avg - y_a)).sum(axis=0)
+        keep[i + 1] = lo + np.argmax(areas)
+    return keep
+
+def full_resolution_plot(investment, portfolio):
+    ''' Plots the past performance of a portfolio at full resolution, on demand rather than stored (stored plots are downsampled, see settings.PLOT_POINTS).
+
+    :param investment: A positive integer.
+    :param portfolio: A Portfolio object.
+
+    :returns: A html performance plot
+    '''
+    past_portfolios = list(Past_Portfolio.objects.filter(portfolio=portfolio).order_by('start_date')) #must be ordered ascending
+    annual_stats, daily_values, dates = portfolioAnalyzer.backtest(past_portfolios, investment)
+    return plot_graphs(daily_values[0], daily_values[1], daily_values[2], dates, points=0)
+
+def update_or_create_portfolio(spread, period, lv, end, title="Custom", p=None, method=METHOD):
     ''' Calculates the minimium volatility portfolio for the given parameters. Updates the existing portfolio object if it exists, otherwise creates a new one.
 
     :param spread: A positive integer <= 400.
@@ -197,12 +330,13 @@ def update_or_create_portfolio(spread, period, lv, end, title="Custom", p=None):
     :param end: A date object indicating the date on which to calculate the portfolio.
     :param title(optional): A string - one of "Custom" or "Real".
     :param p(optional): The portfolio object to update.
+    :param method(optional): A string indicating the minimisation method (see minimizer.calculate_portfolio). Defaults to settings.MINIMIZE_METHOD.
 
     :returns: The updated/created portfolio object.
     '''
     start = end - timedelta(days=365*period)
     symbols = dba.get_symbols_performance(start, end, lv, current=True)
-    allocations, symbols, vol = minimizer.calculate_portfolio(start, end, spread, symbols)
+    allocations, symbols, vol = minimizer.calculate_portfolio(start, end, spread, symbols, method=method)
     if p is None:
         p = Portfolio(title=title, spread=spread, period=period, lv=lv)
     p.set_allocations(allocations)
@@ -210,6 +344,45 @@ def update_or_create_portfolio(spread, period, lv, end, title="Custom", p=None):
     p.vol = vol
     return p
 
+def update_or_create_portfolios(spreads, period, lv, end, title="Custom", ps=None, method=METHOD):
+    ''' Calculates the minimium volatility portfolios for several spreads sharing the same period and stocks.
+    Symbols, stock changes and their covariance are retrieved/calculated once for all spreads.
+
+    :param spreads: A list of positive integers <= 400.
+    :param period: A positive integer <= 12.
+    :param lv: A boolean value. True indcates to use only the 100 lowest volatility stocks.
+    :param end: A date object indicating the date on which to calculate the portfolios.
+    :param title(optional): A string - one of "Custom" or "Real".
+    :param ps(optional): A list of portfolio objects to update, ordered as spreads.
+    :param method(optional): A string indicating the minimisation method (see minimizer.calculate_portfolio). Defaults to settings.MINIMIZE_METHOD.
+
+    :returns: A list of updated/created portfolio objects, ordered as spreads.
+    '''
+    start = end - timedelta(days=365*period)
+    symbols = dba.get_symbols_performance(start, end, lv, current=True)
+    calculated = minimizer.calculate_portfolios(start, end, spreads, symbols, method=method)
+    updated = []
+    for spread, p, (allocations, symbols, vol) in zip(spreads, ps or [None]*len(spreads), calculated):
+        if p is None:
+            p = Portfolio(title=title, spread=spread, period=period, lv=lv)
+        p.set_allocations(allocations)
+        p.set_symbols(symbols)
+        p.vol = vol
+        updated.append(p)
+    return updated
+
+def group_portfolios(portfolios):
+    ''' Groups portfolios that share a minimisation period and stocks, i.e. only differ in spread.
+
+    :param portfolios: A list of portfolio objects.
+
+    :returns: A list of lists of portfolio objects.
+    '''
+    groups = {}
+    for p in portfolios:
+        groups.setdefault((p.title, p.period, p.lv), []).append(p)
+    return [groups[key] for key in sorted(groups)]
+
 def update_past_portfolios(portfolio, end_date):
     ''' Calculates the past minimium volatility portfolios for a given portfolio.
 
@@ -244,6 +417,111 @@ def create_past_portfolios(portfolio, start_year, end_date):
         bulklist.append(update_or_create_past_portfolio(portfolio, annual_date, year))
     return bulklist
 
+def update_past_portfolios_group(portfolios, end_date, method=METHOD, info=None):
+    ''' Calculates the past minimium volatility portfolios for portfolios only differing in spread (see group_portfolios).
+    Past portfolios starting in the same year are calculated together, warm-started from the previous year.
+
+    :param portfolios: A list of portfolio objects for which to calculate the past portfolios.
+    :param end_date: A date object indicating the date on which to calculate the portfolio.
+    :param method(optional): A string indicating the minimisation method (see minimizer.calculate_portfolio). Defaults to settings.MINIMIZE_METHOD.
+    :param info(optional): A dict to update with solver iterations (see record_iterations).
+
+    :returns: A list of updated past portfolios to be saved.
+    '''
+    bulklist = []
+    annual_date = str(end_date.month) + str(end_date.day)
+    years = {}
+    for portfolio in portfolios:
+        pps = list(Past_Portfolio.objects.filter(portfolio=portfolio).order_by('start_date'))
+        for pp in pps:
+            years.setdefault(pp.start_date.year, []).append((portfolio, pp))
+        if not pps or pps[-1].start_date.year != (end_date.year - 1): #new year since last update
+            years.setdefault(end_date.year, []).append((portfolio, None))
+    previous = {}
+    for year in sorted(years):
+        group, pps = zip(*years[year])
+        initial = [previous.get(p.spread) for p in group]
+        for pp in update_or_create_past_portfolios(group, annual_date, year, pps, method, initial, info):
+            if pp.pk is None:
+                pp.save()
+            bulklist.append(pp)
+            previous[pp.portfolio.spread] = pp
+    return bulklist
+
+def update_or_create_past_portfolios(portfolios, annual_date, year, pps=None, method=METHOD, previous=None, info=None):
+    ''' Calculates the past minimium volatility portfolios starting in the given year for portfolios only differing in spread.
+
+    :param portfolios: A list of portfolio objects sharing the period and lv.
+    :param annual_date: A string indicating the month and day on which past portfolios start.
+    :param year: A positive integer indicating the year in which the past portfolios start.
+    :param pps(optional): A list of past portfolio objects to update, ordered as portfolios.
+    :param method(optional): A string indicating the minimisation method (see minimizer.calculate_portfolio). Defaults to settings.MINIMIZE_METHOD.
+    :param previous(optional): A list of past portfolio objects to warm-start from, e.g. those of the previous year (None for no warm start). Ordered as portfolios.
+    :param info(optional): A dict to update with solver iterations (see record_iterations).
+
+    :returns: A list of updated/created past portfolio objects, ordered as portfolios.
+    '''
+    end = datetime.strptime(str(year)+ annual_date, '%Y%m%d').date() - timedelta(days=1)
+    start = end - timedelta(days=365*portfolios[0].period)
+    symbols = dba.get_symbols_performance(start, end, portfolios[0].lv, True)
+    spreads = [p.spread for p in portfolios]
+    initial = [None if pp is None else (pp.allocations, pp.symbols) for pp in previous or []]
+    solver_info = {}
+    calculated = minimizer.calculate_portfolios(start, end, spreads, symbols, method=method, info=solver_info, initial=initial)
+    if info is not None:
+        record_iterations(info, solver_info.values())
+    updated = []
+    for portfolio, pp, (allocations, symbols, vol) in zip(portfolios, pps or [None]*len(portfolios), calculated):
+        if pp is None:
+            pp = Past_Portfolio(portfolio=portfolio)
+        pp.start_date=end #performance over the following year
+        pp.set_allocations(allocations)
+        pp.set_symbols(symbols)
+        updated.append(pp)
+    return updated
+
+def create_past_portfolios_group(portfolios, start_year, end_date, method=METHOD, info=None, warm_start=True):
+    ''' Calculates the past minimium volatility portfolios for portfolios only differing in spread (see group_portfolios).
+
+    :param portfolios: A list of portfolio objects for which to calculate the past portfolios.
+    :param start_year: A positive integer between 2001 and 2016 indicating the year on which to start.
+    :param end_date: A date object indicating the date on which to calculate the portfolio.
+    :param method(optional): A string indicating the minimisation method (see minimizer.calculate_portfolio). Defaults to settings.MINIMIZE_METHOD.
+    :param info(optional): A dict to update with solver iterations (see record_iterations).
+    :param warm_start(optional): A boolean indicating whether or not to start each year from the previous year's allocations.
+
+    :returns: A list of new past portfolios to be saved.
+    '''
+    bulklist = []
+    annual_date = str(end_date.month) + str(end_date.day)
+    previous = None
+    for year in range(start_year, end_date.year):
+        pps = update_or_create_past_portfolios(portfolios, annual_date, year, method=method, previous=previous, info=info)
+        previous = pps if warm_start else None
+        bulklist += pps
+    return bulklist
+
+def record_iterations(info, solver_infos):
+    ''' Records solver iterations, separating warm-started from cold-started minimisations.
+
+    :param info: A dict mapping 'warm' and 'cold' to lists of iteration counts, updated in place.
+    :param solver_infos: A list of dicts as returned by minimizer.solve.
+    '''
+    for solver_info in solver_infos:
+        info.setdefault('warm' if solver_info.get('warm') else 'cold', []).append(solver_info['iterations'])
+
+def iteration_summary(info):
+    ''' Summarises solver iterations recorded by record_iterations, e.g. for the maintenance log.
+
+    :param info: A dict mapping 'warm' and 'cold' to lists of iteration counts.
+
+    :returns: A string.
+    '''
+    mean = lambda n: float(sum(n))/len(n) if n else 0.
+    warm, cold = info.get('warm', []), info.get('cold', [])
+    return "{0} warm-started minimisations averaging {1:.1f} iterations, {2} cold-started averaging {3:.1f} iterations".format(
+        len(warm), mean(warm), len(cold), mean(cold))
+
 def update_or_create_past_portfolio(portfolio, annual_date, year, pp=None):
     end = datetime.strptime(str(year)+ annual_date, '%Y%m%d').date() - timedelta(days=1)
     start = end - timedelta(days=365*portfolio.period)
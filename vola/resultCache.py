@@ -0,0 +1,122 @@
+from django.conf import settings
+from django.db import connection
+from collections import OrderedDict
+import threading, time, os
+
+'''
+This module provides an in-process LRU cache of web request results, e.g. custom portfolios.
+
+->Entries are tagged with the cache version, bumped whenever stored portfolios or their performances are recalculated.
+->The version is shared by all workers through a version file (settings.RESULT_CACHE_VERSION),
+  so a bump by the maintenance process invalidates the caches of every web worker.
+->A hit costs a dict lookup and a stat of the version file, no database or numpy work.
+->Identical concurrent calculations are coalesced, i.e. share one in-flight calculation (see coalesce).
+'''
+
+MAX_ENTRIES = getattr(settings, 'RESULT_CACHE_SIZE', 256)
+_lock = threading.Lock()
+_entries = OrderedDict()
+_bumps = 0 #local invalidations, e.g. when the version file is disabled
+_flights = {}
+
+def version_file():
+    ''' Retreives the version file (settings.RESULT_CACHE_VERSION).
+
+    :returns: A file path or None if disabled or the database is in memory (e.g. when testing).
+    '''
+    name = str(connection.settings_dict['NAME'])
+    if name == ':memory:' or 'mode=memory' in name:
+        return None
+    return getattr(settings, 'RESULT_CACHE_VERSION', None)
+
+def version():
+    ''' Retreives the current cache version.
+
+    :returns: A pair containing the number of local invalidations and the modification time of the version file (None if unavailable).
+    '''
+    path = version_file()
+    try:
+        return _bumps, None if path is None else os.stat(path).st_mtime
+    except OSError:
+        return _bumps, None
+
+def get(key):
+    ''' Retreives a cached result, discarding it if the cache was invalidated since it was stored.
+
+    :param key: A hashable key, e.g. a tuple of request parameters.
+
+    :returns: The cached result or None if not cached.
+    '''
+    current = version()
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] != current:
+            del _entries[key]
+            return None
+        _entries.move_to_end(key) #most recently used
+        return entry[1]
+
+def put(key, result, computed_version):
+    ''' Stores a result, evicting the least recently used one if the cache is full.
+    Results computed before the last invalidation are not stored.
+
+    :param key: A hashable key, e.g. a tuple of request parameters.
+    :param result: The result to store, not None.
+    :param computed_version: The cache version (see version) retreived before computing the result.
+    '''
+    if computed_version != version():
+        return
+    with _lock:
+        _entries[key] = (computed_version, result)
+        _entries.move_to_end(key)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+def invalidate():
+    ''' Bumps the cache version, discarding the cached results of every worker. '''
+    global _bumps
+    with _lock:
+        _bumps += 1
+        _entries.clear()
+    path = version_file()
+    if path is None:
+        return
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path + '.tmp', 'w') as f:
+        f.write(str(time.time()))
+    os.replace(path + '.tmp', path)
+
+def coalesce(key, calculate):
+    ''' Runs a calculation once for identical concurrent requests of this worker: the first request calculates,
+    the others wait for and share its result (or exception).
+
+    :param key: A hashable key identifying the calculation.
+    :param calculate: A function without parameters returning the result.
+
+    :returns: The result of the calculation.
+    '''
+    with _lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = {'done': threading.Event(), 'result': None, 'error': None, 'waiters': 0}
+        else:
+            flight['waiters'] += 1
+    if leader:
+        try:
+            flight['result'] = calculate()
+        except Exception as e:
+            flight['error'] = e
+        finally:
+            with _lock:
+                del _flights[key]
+            flight['done'].set()
+    else:
+        flight['done'].wait()
+    if flight['error'] is not None:
+        raise flight['error']
+    return flight['result']
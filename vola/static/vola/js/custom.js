@@ -17,4 +17,28 @@ function loader()
 function showValue(newValue)
 {
 	document.getElementById("range").innerHTML=newValue;
-}
\ No newline at end of file
+}
+function pollPerformance(url)
+{
+	$.getJSON(url, function(data){
+		if(data.status == "pending"){
+			setTimeout(function(){ pollPerformance(url); }, 1000);
+		} else if(data.status == "done"){
+			$("#graph").html(data.fig);
+			var rows = "";
+			$.each(data.stats, function(i, year){
+				rows += "<tr><td>" + year[0] + "</td>";
+				$.each(year[1].concat(year[2], [year[3]]), function(j, value){
+					rows += "<td>" + parseFloat(value).toFixed(2) + "</td>";
+				});
+				rows += "</tr>";
+			});
+			$("#stats tbody").html(rows);
+			$("#stats").show();
+		} else {
+			$("#graph").html("<p>Past performance is unavailable.</p>");
+		}
+	}).fail(function(){
+		$("#graph").html("<p>Past performance is unavailable.</p>");
+	});
+}
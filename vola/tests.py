@@ -1,10 +1,18 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from django.core.urlresolvers import reverse
+from django.db import connection
 from datetime import datetime, timedelta
+from decimal import Decimal
 from .models import *
-from db import reconstruction, maintenance, access
+from db import reconstruction, maintenance, maintenance_multiprocessing, access, stockInserter, stockPanel, stockHistory, rollingCovariance
 import numpy as np
-from . import minimizer, portfolioCalculator, portfolioAnalyzer
+import threading, time, json, os, tempfile, pickle
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qs
+from scraper import quoteFetcher
+from . import minimizer, portfolioCalculator, portfolioAnalyzer, resultCache, performanceJobs
 
 '''
 This module provides automated tests for vola application.
@@ -53,9 +61,14 @@ class CompanyMethodTests(TestCase):
 		name = data[0]
 		self.assertEqual(name, "Agilent Technologies Inc")
 
+HISTORICAL_CSV = b'Date,Open,High,Low,Close,Volume,Adj Close\n2016-01-05,41.0,41.5,40.5,41.2,100,41.2\n2016-01-04,40.0,41.0,39.5,40.8,100,40.8\n'
+
 class StockMethodTests(TestCase):
 	fixtures = ['company.json', 'stock.json', 'SNP500.json']
 
+	def setUp(self):
+		stockPanel.invalidate() #panel is process-wide, fixtures are per test
+
 	def test_indexes(self):
 		""" S&P 500 and S&P 500 LV Stocks should be returned."""
 		start = datetime.today().date()
@@ -99,9 +112,22 @@ class StockMethodTests(TestCase):
 	    stocks = reconstruction.filter_zero_prices()
 	    self.assertEqual(len(stocks), 0)
 
+	def test_stock_values(self):
+		""" create_stock_values() should calculate changes from the previous close price, or the close price if that is zero. """
+		content = HISTORICAL_CSV + b'2016-01-01,0,0,0,0,0,0\n'
+		values = stockInserter.create_stock_values(content)
+		self.assertEqual([(date, close_price) for date, close_price, change in values],
+			[(datetime(2016, 1, 4).date(), Decimal('40.8')), (datetime(2016, 1, 5).date(), Decimal('41.2'))])
+		self.assertAlmostEqual(values[0][2], 40.8)
+		self.assertAlmostEqual(values[1][2], (41.2 - 40.8) * 100 / 40.8)
+		self.assertEqual(stockInserter.create_stock_values(b''), [])
+
 class SNP500MethodTests(TestCase):
 	fixtures = ['company.json', 'stock.json', 'SNP500.json']
 
+	def setUp(self):
+		stockPanel.invalidate() #panel is process-wide, fixtures are per test
+
 	def test_get_SNP500_companies(self):
 		""" get_SNP500_companies() should return at least one company based on fixture SNP500.json. """
 		s = access.get_SNP500_companies(0)
@@ -123,6 +149,9 @@ class SNP500MethodTests(TestCase):
 class PortfolioMethodTests(TestCase):
 	fixtures = ['company.json', 'stock.json', 'SNP500.json']		
 
+	def setUp(self):
+		stockPanel.invalidate() #panel is process-wide, fixtures are per test
+
 	def test_minimizer(self):
 	    """ 
 	    minimizer() should always return non-empty shares, symbols and prices. 
@@ -169,6 +198,536 @@ class PortfolioMethodTests(TestCase):
 		self.assertEqual(stats['benchmark volatility'], 0)
 		self.assertEqual(stats['benchmarklv volatility'], 0)
 
+	def test_backtest(self):
+		""" portfolioAnalyzer.backtest() should return the same statistics and daily values as simulate() for a single year. """
+		start = datetime.strptime('20160312', '%Y%m%d').date()
+		pp = Past_Portfolio(start_date=start)
+		pp.symbols, pp.allocations = ['ACE', 'CB'], np.array([.5, .5])
+		annual_stats, daily_values, dates = portfolioAnalyzer.backtest([pp], 10000)
+		stats, values, changes, ds = portfolioAnalyzer.simulate(start, start + timedelta(days=365), pp.symbols, pp.allocations, 10000, 10000, 10000)
+		self.assertEqual(annual_stats, [stats])
+		self.assertEqual(dates[1:], list(ds))
+		for daily, simulated in zip(daily_values, values):
+			self.assertTrue(np.allclose(daily[1:], simulated))
+
+	def test_backtest_unavailable_stocks(self):
+		""" portfolioAnalyzer.backtest() should raise UnavailableStocksError if some symbols have no stocks. """
+		pp = Past_Portfolio(start_date=datetime.strptime('20160312', '%Y%m%d').date())
+		pp.symbols, pp.allocations = ['ACE', 'NOSTOCKS'], np.array([.5, .5])
+		with self.assertRaises(portfolioAnalyzer.UnavailableStocksError):
+			portfolioAnalyzer.backtest([pp], 10000)
+
+	def test_benchmark_cache(self):
+		""" portfolioAnalyzer.benchmark() should be cached until the stock panel is rebuilt. """
+		end = datetime.strptime('20160316', '%Y%m%d').date()
+		start = datetime.strptime('20160312', '%Y%m%d').date()
+		b = portfolioAnalyzer.benchmark(portfolioAnalyzer.BENCHMARK, start, end)
+		self.assertIs(portfolioAnalyzer.benchmark(portfolioAnalyzer.BENCHMARK, start, end), b)
+		stockPanel.invalidate()
+		self.assertIsNot(portfolioAnalyzer.benchmark(portfolioAnalyzer.BENCHMARK, start, end), b)
+
+	def test_unavailable_benchmark(self):
+		""" portfolioAnalyzer.benchmark() should return a zero volatility and return rather than None if no prices are available. """
+		day = datetime.strptime('20160312', '%Y%m%d').date()
+		b = portfolioAnalyzer.benchmark('MISSING', day, day)
+		self.assertEqual(len(b['prices']), 0)
+		self.assertEqual(round(b['std'].astype(Decimal), 2), 0)
+		self.assertEqual(round(b['return'].astype(Decimal), 2), 0)
+
+	def test_packed_allocations(self):
+		""" Allocations and symbols should round-trip through their binary fields and only be decoded on access. """
+		p = Portfolio(title="Custom", spread=2, period=1, lv=False, vol=1)
+		p.allocations, p.symbols = np.array([.25, .75]), ['ACE', 'CB']
+		p.save()
+		p = Portfolio.objects.get(pk=p.pk)
+		self.assertNotIn('_symbols_field_value', p.__dict__)
+		self.assertEqual(p.symbols, ['ACE', 'CB'])
+		self.assertTrue(np.array_equal(p.allocations, [.25, .75]))
+		self.assertEqual(len(Portfolio(title="Real", spread=2, period=1, lv=False, vol=1).allocations), 0)
+
+	def test_compressed_plot(self):
+		""" Plot html should be stored compressed and decompressed by get_performance_data(). """
+		p = Portfolio(title="Custom", spread=2, period=1, lv=False, vol=1)
+		p.save()
+		html = '<div class="plot"></div>' * 1000
+		plot = Plot(portfolio=p, investment=10000)
+		plot.html = html
+		plot.save()
+		self.assertLess(len(Plot.objects.get(pk=plot.pk).html_field), len(html) // 10)
+		self.assertEqual(access.get_performance_data(p, 10000)[0], html)
+
+	def test_pickled_plot(self):
+		""" A pickled plot should carry the compressed html only and decompress it again on access. """
+		html = '<div class="plot"></div>' * 1000
+		plot = Plot(investment=10000)
+		plot.html = html
+		self.assertEqual(plot.html, html)
+		data = pickle.dumps(plot)
+		self.assertLess(len(data), len(html) // 10)
+		unpickled = pickle.loads(data)
+		self.assertNotIn('_html_field_value', unpickled.__dict__)
+		self.assertEqual(unpickled.html, html)
+
+	def test_pool_rows(self):
+		""" Portfolios reduced to compact pool results should be updated by rebuilt objects. """
+		p = Portfolio(title="Custom", spread=2, period=1, lv=False, vol=1)
+		p.save()
+		p.set_allocations(np.array([.5, .5]))
+		p.set_symbols(['ACE', 'CB'])
+		p.vol = 2
+		fields = maintenance_multiprocessing.PORTFOLIO_FIELDS
+		rows = maintenance_multiprocessing.pack_rows([p], fields)
+		self.assertEqual(maintenance_multiprocessing.write_chunk(maintenance_multiprocessing.unpack_rows(Portfolio, fields, rows), fields, True), [])
+		p = Portfolio.objects.get(pk=p.pk)
+		self.assertEqual(p.symbols, ['ACE', 'CB'])
+		self.assertTrue(np.array_equal(p.allocations, [.5, .5]))
+		self.assertEqual(p.vol, 2)
+
+	def test_downsample(self):
+		""" downsample() should keep the first and last dates, the point budget and peaks of any curve. """
+		start = datetime.strptime('20120103', '%Y%m%d').date()
+		dates = [start + timedelta(days=i) for i in range(1000)]
+		flat, peak = np.ones(1000), np.ones(1000)
+		peak[437] = 5
+		keep = portfolioCalculator.downsample(dates, [flat, peak], 50)
+		self.assertEqual(len(keep), 50)
+		self.assertEqual((keep[0], keep[-1]), (0, 999))
+		self.assertIn(437, keep)
+		self.assertEqual(len(portfolioCalculator.downsample(dates, [flat], 0)), 1000)
+
+class StockPanelTests(TestCase):
+
+	def setUp(self):
+		stockPanel.invalidate()
+		self.log, stockInserter.log = stockInserter.log, os.path.join(tempfile.mkdtemp(), 'log.txt') #keep the tracked log clean
+
+	def tearDown(self):
+		stockInserter.log = self.log
+
+	def test_panel_invalidated_on_insert(self):
+		""" get_stock_matrix() should include stocks inserted by insert_and_log_stocks() after the panel was built, and cached results should be discarded. """
+		c = Company(symbol='KO', name="Coca Cola")
+		c.save()
+		day = datetime.strptime('20160314', '%Y%m%d').date()
+		Stock(company=c, close_price=100, change=1, date=day).save()
+		self.assertEqual(access.get_stock_matrix(day, day, ['KO'], 'close_price').shape, (1, 1))
+		next_day = day + timedelta(days=1)
+		resultCache.put('result', 'stale', resultCache.version())
+		stockInserter.insert_and_log_stocks([Stock(company=c, close_price=101, change=1, date=next_day)], 1, day, next_day, [])
+		self.assertIsNone(resultCache.get('result'))
+		prices = access.get_stock_matrix(day, next_day, ['KO'], 'close_price')
+		self.assertEqual(list(prices[:, 0]), [100, 101])
+		self.assertEqual(list(access.SP500(day, next_day, 'change')), [])
+
+	def test_snapshot(self):
+		""" A loaded snapshot should equal the panel it was written from. The previous generation should be kept for workers still mapping it. """
+		c = Company(symbol='KO', name="Coca Cola")
+		c.save()
+		day = datetime.strptime('20160314', '%Y%m%d').date()
+		Stock(company=c, close_price=100, change=1, date=day).save()
+		Stock(company=c, close_price=101, change=1, date=day + timedelta(days=1)).save()
+		directory = tempfile.mkdtemp()
+		generations = []
+		for i in range(3):
+			stockPanel.write_snapshot(directory)
+			generations.append(stockPanel.current_generation(directory))
+		self.assertEqual(set(f.split('.')[0] for f in os.listdir(directory) if f.endswith('.npy')), set(generations[1:]))
+		panel, snapshot = stockPanel.build(), stockPanel.load_snapshot(directory)
+		self.assertEqual(snapshot['symbols'], panel['symbols'])
+		self.assertTrue(np.array_equal(snapshot['dates'], panel['dates']))
+		for value in stockPanel.VALUES:
+			self.assertTrue(np.array_equal(snapshot[value], panel[value]))
+
+	@override_settings(STOCK_STORAGE='history')
+	def test_history_storage(self):
+		""" The stock panel built from stock histories should equal the one built from Stock rows. Inserted stocks should be appended as if rebuilt. """
+		c = Company(symbol='KO', name="Coca Cola")
+		c.save()
+		day = datetime.strptime('20160314', '%Y%m%d').date()
+		Stock(company=c, close_price=100, change=1, date=day).save()
+		stockHistory.rebuild() #saved directly rather than inserted
+		stockInserter.insert_and_log_stocks([Stock(company=c, close_price=101.5, change=1.5, date=day + timedelta(days=2))], 1, day, day, [])
+		history = Stock_History.objects.get(company=c)
+		self.assertEqual([s.close_price for s in history.get_stocks()], [100, Decimal('101.50')])
+		appended = [bytes(history.dates), bytes(history.close_prices), bytes(history.changes)]
+		stockHistory.rebuild(['KO'])
+		history = Stock_History.objects.get(company=c)
+		self.assertEqual([bytes(history.dates), bytes(history.close_prices), bytes(history.changes)], appended)
+		history.append_history([day], [99], [0])
+		self.assertEqual([s.close_price for s in history.get_stocks()], [99, Decimal('101.50')])
+		with self.settings(STOCK_STORAGE='rows'):
+			rows = stockPanel.build()
+		panel = stockPanel.build()
+		self.assertTrue(np.array_equal(panel['dates'], rows['dates']))
+		for value in stockPanel.VALUES:
+			self.assertTrue(np.array_equal(panel[value], rows[value]))
+
+class MinimizerMethodTests(TestCase):
+
+	def test_covariance_method(self):
+		""" minimize() should return the same allocations (within tolerance) for the 'std' and 'cov' methods. """
+		rng = np.random.RandomState(0)
+		changes = (rng.randn(250, 3).dot(rng.randn(3, 40)) + rng.randn(250, 40)).astype(np.float32)
+		std_allocations = minimizer.minimize(minimizer.vol, changes, None, 10)
+		cov_allocations = minimizer.minimize(minimizer.vol, changes, None, 10, method='cov')
+		self.assertAlmostEqual(np.sum(cov_allocations), 1)
+		self.assertTrue(np.all(cov_allocations <= 0.1 + 1e-8))
+		self.assertTrue(np.allclose(std_allocations, cov_allocations, atol=1e-3))
+		self.assertTrue(minimizer.vol(cov_allocations, changes) <= minimizer.vol(std_allocations, changes) + 1e-6)
+
+	def test_qp_method(self):
+		""" The dedicated 'qp' solver should satisfy the constraints, be optimal (KKT) and agree with the 'cov' method. """
+		rng = np.random.RandomState(1)
+		changes = (rng.randn(500, 4).dot(rng.randn(4, 60)) + rng.randn(500, 60)).astype(np.float32)
+		cov_allocations, cov_info = minimizer.solve(changes, 25, 'cov')
+		qp_allocations, qp_info = minimizer.solve(changes, 25, 'qp')
+		self.assertAlmostEqual(np.sum(qp_allocations), 1)
+		self.assertTrue(np.all(qp_allocations >= 0) and np.all(qp_allocations <= 0.04))
+		self.assertTrue(qp_info['kkt_residual'] < 1e-8)
+		self.assertTrue(qp_info['iterations'] > 0)
+		self.assertTrue(np.allclose(cov_allocations, qp_allocations, atol=1e-4))
+
+	def test_qp_fallback(self):
+		""" The 'qp' solver should fall back to the 'cov' method rather than return unconverged allocations when its iterations run out. """
+		rng = np.random.RandomState(1)
+		cov = minimizer.covariance(rng.randn(500, 4).dot(rng.randn(4, 60)) + rng.randn(500, 60))
+		allocations, iterations = minimizer.minimize_qp(cov, 25, max_iter=1)
+		self.assertAlmostEqual(np.sum(allocations), 1)
+		self.assertTrue(iterations > 1)
+		self.assertTrue(minimizer.kkt_residual(cov, allocations, 0.04) < 1e-4)
+		self.assertTrue(np.allclose(allocations, minimizer.minimize_qp(cov, 25)[0], atol=1e-3))
+
+def create_random_stocks(symbols, start, days, seed=0):
+	''' Creates companies and random daily stocks for the given symbols. '''
+	rng = np.random.RandomState(seed)
+	for s in symbols:
+		c = Company(symbol=s, name=s)
+		c.save()
+		changes = rng.randn(days)
+		prices = 100 * np.cumprod(1 + changes / 100)
+		Stock.objects.bulk_create([Stock(company=c, close_price=round(prices[i], 2), change=round(changes[i], 12),
+			date=start + timedelta(days=i)) for i in range(days)])
+	stockPanel.invalidate()
+
+class PortfolioBatchTests(TestCase):
+
+	def setUp(self):
+		self.start = datetime.strptime('20150101', '%Y%m%d').date()
+		self.end = self.start + timedelta(days=59)
+		self.symbols = ['S' + str(i) for i in range(12)]
+		create_random_stocks(self.symbols, self.start, 60)
+
+	def test_calculate_portfolios(self):
+		""" calculate_portfolios() should return the same portfolios as calculate_portfolio() for each spread. """
+		spreads = [2, 4, 8]
+		info = {}
+		batch = minimizer.calculate_portfolios(self.start, self.end, spreads, self.symbols, method='qp', info=info)
+		self.assertEqual(sorted(info), spreads)
+		for spread, (allocations, symbols, vol) in zip(spreads, batch):
+			single_allocations, single_symbols, single_vol = minimizer.calculate_portfolio(self.start, self.end, spread, self.symbols, method='qp')
+			self.assertEqual(symbols, single_symbols)
+			self.assertTrue(np.allclose(allocations, single_allocations, atol=1e-6))
+			self.assertAlmostEqual(vol, single_vol)
+
+	def test_warm_start(self):
+		""" calculate_portfolios() should return the same portfolios when warm-started from a portfolio with fewer symbols. """
+		previous = minimizer.calculate_portfolio(self.start, self.end, 4, self.symbols[2:], method='qp')
+		info = {}
+		warm = minimizer.calculate_portfolios(self.start, self.end, [4], self.symbols, method='qp', info=info, initial=[previous[:2]])
+		cold = minimizer.calculate_portfolios(self.start, self.end, [4], self.symbols, method='qp')
+		self.assertTrue(info[4]['warm'])
+		self.assertTrue(np.allclose(warm[0][0], cold[0][0], atol=1e-6))
+
+class BacktestTests(TestCase):
+
+	def setUp(self):
+		self.start = datetime.strptime('20140101', '%Y%m%d').date()
+		create_random_stocks(['A', 'B', 'C', portfolioAnalyzer.BENCHMARK, portfolioAnalyzer.BENCHMARK_LV], self.start, 740)
+		self.past_portfolios = []
+		for year, (symbols, allocations) in enumerate([(['A', 'B'], [.5, .5]), (['A', 'C'], [.3, .7])]):
+			pp = Past_Portfolio(start_date=self.start + timedelta(days=365*year))
+			pp.symbols, pp.allocations = symbols, np.array(allocations)
+			self.past_portfolios.append(pp)
+
+	def test_backtest_investments(self):
+		""" backtest_investments() should equal simulate() run per past portfolio, each year investing the previous year's final values. """
+		investments = [10000, 25000, 1000000]
+		backtests = portfolioAnalyzer.backtest_investments(self.past_portfolios, investments)
+		for investment, (annual_stats, daily_values, dates) in zip(investments, backtests):
+			current = [investment] * 3 #portfolio, S&P 500 and S&P 500 LV
+			simulated_values, simulated_dates = [[], [], []], []
+			for pp, stats in zip(self.past_portfolios, annual_stats):
+				simulated, values, changes, ds = portfolioAnalyzer.simulate(pp.start_date, pp.start_date + timedelta(days=365), pp.symbols, pp.allocations, *current)
+				self.assertEqual(sorted(stats), sorted(simulated))
+				for key in simulated:
+					self.assertAlmostEqual(float(stats[key]), float(simulated[key]), delta=.01)
+				for all_values, year_values in zip(simulated_values, values):
+					all_values.extend(year_values)
+				simulated_dates += list(ds)
+				current = [year_values[-1] for year_values in values]
+			self.assertEqual(dates[1:], simulated_dates)
+			for daily, simulated in zip(daily_values, simulated_values):
+				self.assertEqual(daily[0], investment)
+				self.assertTrue(np.allclose(daily[1:], simulated))
+
+	def test_requested_investment(self):
+		""" Past performances of requested investments should be stored as plots and pruned once expired, those of the stored grid kept. """
+		p = Portfolio(title="Custom", spread=2, period=1, lv=False, vol=1)
+		p.save()
+		for pp in self.past_portfolios:
+			pp.portfolio = p
+			pp.save()
+		fig, stats = portfolioCalculator.get_past_portfolio_performance(12345, p)
+		self.assertEqual(list(Plot.objects.values_list('investment', flat=True)), [12345])
+		self.assertEqual(Past_Statistics.objects.count(), len(self.past_portfolios))
+		self.assertEqual(len(stats), len(self.past_portfolios))
+		self.assertEqual(portfolioCalculator.store_past_portfolio_performance(12345, p), (fig, stats)) #stored meanwhile by another worker
+		self.assertEqual(Plot.objects.count(), 1)
+		investment = portfolioCalculator.INVESTMENTS[0]
+		stored_fig, stored_stats = portfolioCalculator.get_past_portfolio_performance(investment, p)
+		self.assertEqual([s[0] for s in stored_stats], [s[0] for s in stats])
+		self.assertEqual(access.get_investments(portfolioCalculator.INVESTMENTS), [investment])
+		expired = datetime.today().date() - portfolioCalculator.PLOT_EXPIRY - timedelta(days=1)
+		Plot.objects.update(date_calculated=expired)
+		self.assertEqual(portfolioCalculator.prune_plots(), 1)
+		self.assertEqual(list(Plot.objects.values_list('investment', flat=True)), [investment])
+		self.assertEqual(Past_Statistics.objects.count(), len(self.past_portfolios))
+
+class RollingCovarianceTests(TestCase):
+
+	def setUp(self):
+		self.start = datetime.strptime('20150101', '%Y%m%d').date()
+		self.symbols = ['S' + str(i) for i in range(8)]
+		create_random_stocks(self.symbols, self.start, 120)
+
+	def test_moving_window(self):
+		""" get_covariance() should equal the covariance of the change matrix as the window moves. """
+		for offset in [0, 10, 25, 5, 80]:
+			start = self.start + timedelta(days=offset)
+			end = start + timedelta(days=39)
+			cov, trading_days = access.get_covariance(start, end, self.symbols)
+			changes = access.get_stock_matrix(start, end, self.symbols, 'change')
+			self.assertEqual(trading_days, len(changes))
+			self.assertTrue(np.allclose(cov, np.cov(changes, rowvar=False, bias=True), atol=1e-10))
+
+	def test_window_columns(self):
+		""" Windows should only hold the requested companies, adding later ones, and periods of the same length should keep separate windows. """
+		periods = [(self.start, self.start + timedelta(days=39)), (self.start + timedelta(days=70), self.start + timedelta(days=109))]
+		for symbols in [self.symbols[:3], self.symbols[2:6]]:
+			for start, end in periods:
+				cov, trading_days = access.get_covariance(start, end, symbols)
+				changes = access.get_stock_matrix(start, end, symbols, 'change')
+				self.assertTrue(np.allclose(cov, np.cov(changes, rowvar=False, bias=True), atol=1e-10))
+		windows = [w for w in rollingCovariance._windows if w['length'] == 39]
+		self.assertEqual(len(windows), 2)
+		self.assertEqual([len(w['cols']) for w in windows], [6, 6])
+		self.assertEqual(rollingCovariance.memory(), 2 * 8 * (6 + 6 * 6))
+
+class AlignmentTests(TestCase):
+
+	def setUp(self):
+		self.start = datetime.strptime('20150101', '%Y%m%d').date()
+		self.end = self.start + timedelta(days=20)
+		create_random_stocks(['KO', 'A', 'B'], self.start, 21)
+		Stock.objects.filter(company__symbol__in=['KO', 'B'], date=self.start + timedelta(days=10)).delete() #only A trading
+		stockPanel.invalidate()
+
+	def test_align_dates(self):
+		""" align_dates() should report extra dates and exclude them from the stock matrix. """
+		alignment = access.align_dates(self.start, self.end, ['A', 'B'])
+		self.assertEqual(list(alignment['extra']), ['A'])
+		self.assertEqual(alignment['missing'], {})
+		self.assertEqual(len(alignment['exclude']), 1)
+		self.assertEqual(access.get_stock_matrix(self.start, self.end, ['A', 'B'], 'change').shape, (20, 2))
+
+	def test_trading_calendar(self):
+		""" get_valid_dates() should only return dates the majority of listed companies trade on. """
+		dates = access.get_valid_dates(self.start, self.end)
+		self.assertEqual(len(dates), 20)
+		self.assertNotIn(self.start + timedelta(days=10), dates)
+		self.assertEqual(len(access.get_valid_dates(self.start, self.end, sym='A')), 21)
+
+class ValidSymbolsTests(TestCase):
+
+	def setUp(self):
+		self.start = datetime.strptime('20150101', '%Y%m%d').date()
+		self.end = self.start + timedelta(days=10)
+		create_random_stocks(['A', 'B', 'C', 'GAP', 'LATE', 'EXTRA'], self.start, 10)
+		Stock.objects.filter(company__symbol='GAP', date=self.start + timedelta(days=3)).delete()
+		Stock.objects.filter(company__symbol='LATE', date__lt=self.start + timedelta(days=5)).delete() #listed late
+		Stock.objects.filter(company__symbol='EXTRA', date=self.start + timedelta(days=2)).delete()
+		Stock(company_id='EXTRA', close_price=100, change=0, date=self.end).save() #only EXTRA trading
+		stockPanel.invalidate()
+
+	def test_select_valid_symbols(self):
+		""" select_valid_symbols() should only keep companies with the most common number of trading days that do not trade on the least common dates. """
+		symbols = ['A', 'B', 'C', 'GAP', 'LATE', 'EXTRA', 'MISSING']
+		self.assertEqual(access.select_valid_symbols(self.start, self.end, symbols), ['A', 'B', 'C'])
+		self.assertEqual(access.select_valid_symbols(self.start, self.end, ['A', 'GAP']), ['A']) #tied, larger number of trading days
+		self.assertEqual(access.select_valid_symbols(self.start, self.end, ['MISSING']), [])
+
+	def test_lowest_vol_unavailable(self):
+		""" get_lowest_100_vol() should rank the companies with consistent stocks if some have no covariance over the past year. """
+		self.assertEqual(sorted(access.get_lowest_100_vol(['A', 'B', 'C', 'MISSING'], self.end - timedelta(days=1))), ['A', 'B', 'C'])
+		self.assertEqual(access.get_lowest_100_vol(['MISSING'], self.end), [])
+
+class StockIndexTests(TestCase):
+
+	def test_most_recent_date_plan(self):
+		""" get_most_recent_date(), the last Stock query on the hot path, should search the unique (company, date) index rather than scan the table. """
+		create_random_stocks(['A', 'B'], datetime.strptime('20150101', '%Y%m%d').date(), 10)
+		sql, params = Stock.objects.filter(company__symbol='A').order_by('-date')[:1].query.sql_with_params()
+		with connection.cursor() as cursor:
+			cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+			plan = [row[-1] for row in cursor.fetchall()]
+		self.assertTrue(any('USING' in step and 'INDEX' in step for step in plan), plan)
+		self.assertFalse(any(step.startswith('SCAN') or 'TEMP B-TREE' in step for step in plan), plan)
+		self.assertEqual(access.get_most_recent_date('A'), datetime.strptime('20150110', '%Y%m%d').date())
+
+class ResultCacheTests(TestCase):
+
+	def setUp(self):
+		resultCache.invalidate()
+
+	def test_versioned_lru(self):
+		""" The result cache should evict the least recently used result and discard results on invalidation. """
+		version = resultCache.version()
+		for i in range(resultCache.MAX_ENTRIES):
+			resultCache.put(i, str(i), version)
+		self.assertEqual(resultCache.get(0), '0')
+		resultCache.put(resultCache.MAX_ENTRIES, 'new', version)
+		self.assertEqual(resultCache.get(0), '0')
+		self.assertIsNone(resultCache.get(1))
+		resultCache.invalidate()
+		self.assertIsNone(resultCache.get(0))
+		resultCache.put(0, '0', version) #computed before invalidation
+		self.assertIsNone(resultCache.get(0))
+
+	def test_cached_portfolio(self):
+		""" cached_calculate_portfolio() should serve a cached result without database queries. """
+		resultCache.put((10, 4, False, 10000, True, False), 'result', resultCache.version())
+		with self.assertNumQueries(0):
+			self.assertEqual(portfolioCalculator.cached_calculate_portfolio(10000, 10, False, True, False, 4), 'result')
+
+	def test_coalesce(self):
+		""" coalesce() should run identical concurrent calculations once and share the result. """
+		started, release, calls, results = threading.Event(), threading.Event(), [], []
+		def calculate():
+			calls.append(1)
+			started.set()
+			release.wait()
+			return 'result'
+		leader = threading.Thread(target=lambda: results.append(resultCache.coalesce('key', calculate)))
+		leader.start()
+		started.wait()
+		waiters = [threading.Thread(target=lambda: results.append(resultCache.coalesce('key', calculate))) for _ in range(3)]
+		for waiter in waiters:
+			waiter.start()
+		while resultCache._flights['key']['waiters'] < len(waiters):
+			time.sleep(0.001)
+		release.set()
+		for thread in [leader] + waiters:
+			thread.join()
+		self.assertEqual(len(calls), 1)
+		self.assertEqual(results, ['result'] * 4)
+
+class QuoteServer(ThreadingMixIn, HTTPServer):
+	""" Local stand-in for Yahoo Finance serving the same CSV table for every symbol. """
+	daemon_threads = True
+
+class QuoteHandler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1' #keep-alive
+
+	def do_GET(self):
+		symbol = parse_qs(urlsplit(self.path).query)['s'][0]
+		self.server.requests.append((symbol, self.client_address))
+		if symbol == 'MISSING':
+			status, body = 404, b''
+		elif self.server.failures.get(symbol):
+			self.server.failures[symbol] -= 1
+			status, body = 503, b''
+		elif self.server.garbled.get(symbol):
+			self.server.garbled[symbol] -= 1
+			self.wfile.write(b'HTTP/1.1\r\n\r\n') #no status code
+			self.close_connection = True
+			return
+		else:
+			status, body = 200, HISTORICAL_CSV
+		self.send_response(status)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+class QuoteFetcherTests(TestCase):
+
+	def setUp(self):
+		self.server = QuoteServer(('127.0.0.1', 0), QuoteHandler)
+		self.server.requests, self.server.failures, self.server.garbled = [], {'FLAKY': 2}, {'GARBLED': 1}
+		threading.Thread(target=self.server.serve_forever).start()
+		self.url = 'http://127.0.0.1:{0}/table.csv'.format(self.server.server_address[1])
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+	def test_historical_prices(self):
+		""" get_historical_prices() should retry failed requests, skip unavailable symbols and reuse connections. """
+		jobs = [(symbol, '20160101', '20160105') for symbol in ['KO', 'MISSING', 'FLAKY', 'PEP']]
+		fetched = quoteFetcher.get_historical_csv(jobs, base_url=self.url, concurrency=1, backoff=.01)
+		self.assertEqual(dict(fetched), {'KO': HISTORICAL_CSV, 'MISSING': b'', 'FLAKY': HISTORICAL_CSV, 'PEP': HISTORICAL_CSV})
+		self.assertEqual(len(self.server.requests), 6)
+		self.assertEqual(len(set(address for symbol, address in self.server.requests)), 1)
+
+	def test_malformed_status_line(self):
+		""" get_historical_csv() should retry a request answered with a malformed status line on a new connection. """
+		fetched = quoteFetcher.get_historical_csv([('GARBLED', '20160101', '20160105'), ('KO', '20160101', '20160105')], base_url=self.url, concurrency=1, backoff=.01)
+		self.assertEqual(dict(fetched), {'GARBLED': HISTORICAL_CSV, 'KO': HISTORICAL_CSV})
+		self.assertEqual(len(self.server.requests), 3)
+
+	def test_rate_limit(self):
+		""" get_historical_prices() should not exceed the given rate after the initial burst. """
+		jobs = [('KO', '20160101', '20160105')] * (quoteFetcher.BURST + 5)
+		start_time = time.time()
+		list(quoteFetcher.get_historical_prices(jobs, base_url=self.url, rate=50.))
+		self.assertGreaterEqual(time.time() - start_time, 5 / 50.)
+
+	def test_unsupported_scheme(self):
+		""" get_historical_csv() should reject urls other than http and https. """
+		with self.assertRaises(ValueError):
+			list(quoteFetcher.get_historical_csv([('KO', '20160101', '20160105')], base_url='ftp://127.0.0.1/table.csv'))
+
+class PerformanceJobTests(TestCase):
+
+	def setUp(self):
+		self.p = Portfolio(title="Custom", spread=2, period=1, lv=False, vol=1)
+		self.p.save()
+
+	def create_job(self, investment, status, result=None):
+		return Performance_Job.objects.create(portfolio=self.p, investment=investment, status=status,
+			result_field=None if result is None else performanceJobs.encode_result(result))
+
+	def test_shared_jobs(self):
+		""" A job finished by any worker should be retrieved once, failed jobs should raise and unpolled jobs should expire, running ones later. """
+		result = ['<div></div>', [['2016-03-14', ['1.00', '2.00', '3.00'], ['4.00', '5.00', '6.00'], '0.50']]]
+		self.create_job(10000, performanceJobs.DONE, result)
+		self.assertEqual(list(performanceJobs.status(10000, self.p)), result)
+		self.assertFalse(Performance_Job.objects.exists())
+		self.create_job(25000, performanceJobs.FAILED)
+		with self.assertRaises(performanceJobs.JobFailedError):
+			performanceJobs.status(25000, self.p)
+		expired = self.create_job(50000, performanceJobs.DONE, result)
+		running = self.create_job(100000, performanceJobs.PENDING)
+		stopped = self.create_job(250000, performanceJobs.PENDING)
+		Performance_Job.objects.filter(pk__in=[expired.pk, running.pk]).update(created=timezone.now() - 2 * performanceJobs.JOB_EXPIRY)
+		Performance_Job.objects.filter(pk=stopped.pk).update(created=timezone.now() - 2 * performanceJobs.PENDING_EXPIRY)
+		with self.assertNumQueries(1): #polls do not sweep
+			self.assertIsNone(performanceJobs.status(100000, self.p))
+		self.assertEqual(Performance_Job.objects.count(), 3)
+		self.assertEqual(performanceJobs.expire_jobs(), 2)
+		self.assertEqual(list(Performance_Job.objects.values_list('investment', flat=True)), [100000])
 
 class ViewTests(TestCase):
 
@@ -180,4 +739,10 @@ class ViewTests(TestCase):
 	def test_about_view(self):
 		""" Static about page should be available without database. """
 		response = self.client.get(reverse('vola:about'))
-		self.assertEqual(response.status_code, 200)
\ No newline at end of file
+		self.assertEqual(response.status_code, 200)
+
+	def test_custom_performance_view(self):
+		""" The performance polling endpoint should reject invalid parameters as JSON. """
+		response = self.client.get(reverse('vola:custom_performance'), {'investment': '100'})
+		self.assertEqual(response.status_code, 400)
+		self.assertEqual(json.loads(response.content.decode('utf-8'))['status'], 'invalid')
@@ -5,6 +5,7 @@ app_name = 'vola'
 urlpatterns = [
     url(r'^$', views.index, name='index'),
     url(r'^performance/$', views.performance, name='performance'),
+    url(r'^custom/performance/$', views.custom_performance, name='custom_performance'),
     url(r'^custom/', views.custom, name='custom'),
     url(r'^about/', views.about, name='about'),
 ]
\ No newline at end of file
@@ -1,10 +1,14 @@
 from django.shortcuts import render
-from django.http import HttpResponse
-from vola.portfolioCalculator import calculate_portfolio
-from db.access import get_investments, get_periods, get_spreads, get_suggested_portfolio_performance
+from django.http import HttpResponse, JsonResponse
+from vola.portfolioCalculator import cached_calculate_portfolio, INVESTMENTS
+from vola import performanceJobs, portfolioAnalyzer
+from db.access import get_investments, get_periods, get_spreads, get_suggested_portfolio_performance, get_custom_portfolio
+import logging
 
 '''This module provides functions that respond to web requests.'''
 
+logger = logging.getLogger(__name__)
+
 def index(request):
 	context = {} 
 	return render(request, 'vola/index.html', context)
@@ -17,17 +21,39 @@ def performance(request):
 def custom(request):
 	investment, minimum_spread, period, lv, performance, live = get_parameters(request)
 	if not valid_parameters(investment, minimum_spread, period):
-		investments = get_investments()
+		investments = get_investments(INVESTMENTS)
 		periods = get_periods()
 		context = {'investments': investments, 'periods': periods}
 		return render(request, 'vola/custom.html', context)
 	lv = True if lv == "true" else False
 	performance = True if performance == "true" else False
 	live = True if live == "true" else False
-	share_data, invested, min_vol, fig, stats = calculate_portfolio(int(investment), int(minimum_spread), lv, performance, live, int(period))
+	polled = performanceJobs.enabled() #otherwise calculated synchronously
+	share_data, invested, min_vol, fig, stats = cached_calculate_portfolio(int(investment), int(minimum_spread), lv, performance and not polled, live, int(period))
+	if polled:
+		performance = performance and get_custom_portfolio(int(minimum_spread), int(period), lv) is not None #not available for live spreads
+	else:
+		performance = performance and fig is not None
 	context = {'investment': investment, 'minimum_spread': minimum_spread, 'period': period, 'lv': lv, 'performance':performance,
-			   'share_data': share_data, 'invested': invested, 'min_vol': min_vol, 'fig': fig, 'stats':stats}
-	return render(request, 'vola/custom_performance.html', context)
+			   'share_data': share_data, 'invested': invested, 'min_vol': min_vol, 'fig': fig, 'stats':stats, 'query': request.GET.urlencode()}
+	return render(request, 'vola/custom_performance.html', context) #performance section polls custom_performance unless fig is given
+
+def custom_performance(request):
+	investment, minimum_spread, period, lv, performance, live = get_parameters(request)
+	if not valid_parameters(investment, minimum_spread, period):
+		return JsonResponse({'status': 'invalid'}, status=400)
+	p = get_custom_portfolio(int(minimum_spread), int(period), lv == "true")
+	if p is None:
+		return JsonResponse({'status': 'unavailable'})
+	try:
+		result = performanceJobs.status(int(investment), p)
+	except (performanceJobs.JobFailedError, portfolioAnalyzer.UnavailableStocksError):
+		logger.exception('Past performance unavailable for %s', request.GET.urlencode())
+		return JsonResponse({'status': 'failed'})
+	if result is None:
+		return JsonResponse({'status': 'pending'})
+	fig, stats = result
+	return JsonResponse({'status': 'done', 'fig': fig, 'stats': stats})
 
 def about(request):
 	context = {}
@@ -46,6 +72,7 @@ def valid_parameters(investment, min_spread, period):
 	min_invest = 1500
 	max_invest = 100000000
 	inv_check = investment.isdigit() and int(investment) >= min_invest and int(investment) <=max_invest
-	spread_check = min_spread.isdigit() and int(min_spread) in get_spreads()
+	spreads = get_spreads() #stored spreads, others are calculated live
+	spread_check = min_spread.isdigit() and len(spreads) > 0 and spreads[0] <= int(min_spread) <= spreads[-1]
 	period_check = period.isdigit() and int(period) in get_periods()
 	return inv_check and spread_check and period_check
\ No newline at end of file